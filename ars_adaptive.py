@@ -0,0 +1,179 @@
+import os
+import time
+import json
+import numpy as np
+from ars_scan import angle_range, export_scan_list
+from ars_quality import gated_acquire
+from ars_detector import FolderDetector
+
+
+class AdaptiveSampler:
+    '''Chooses scan angles coarse to fine. The first round is a uniform grid with coarse_step. After each round the change between
+    neighbouring spectra is measured and the midpoint of every interval whose change exceeds threshold is added to the next round,
+    largest change first, until the point budget is spent or no interval changes by more than threshold. Intervals are not split
+    below min_step.
+
+    The change metric is the RMS difference between neighbouring spectra. With normalise each spectrum is first divided by its mean,
+    so the metric measures changes of shape and threshold is a fraction (e.g. 0.02); otherwise threshold is in the units of the spectra
+    (e.g. reflectance percentage points).'''
+
+    def __init__(self, start, stop, coarse_step, threshold, budget, min_step=None, normalise=True):
+        self.start = float(start)
+        self.stop = float(stop)
+        self.threshold = threshold
+        self.budget = budget
+        self.min_step = min_step if min_step is not None else coarse_step / 16
+        self.normalise = normalise
+
+        self.spectra = {}
+        self.order = [] # angles in acquisition order
+        self.rounds = 0
+        self._pending = [float(angle) for angle in np.round(angle_range(self.start, self.stop, coarse_step), 6)][:budget]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        angle = self.next_angle()
+        if angle is None:
+            raise StopIteration
+        return angle
+
+    def next_angle(self):
+        '''The next angle to measure, or None when the scan is finished. Starts a refinement round when the current round is done.'''
+        if not self._pending:
+            self._pending = self.refine()
+        if not self._pending:
+            return None
+        return self._pending.pop(0)
+
+    def add(self, angle, spectrum):
+        '''Records the spectrum measured at angle. spectrum can be raw intensity or reflectance on a fixed wavelength axis.'''
+        angle = float(angle)
+        spectrum = np.asarray(spectrum, dtype=float)
+        if self.normalise:
+            mean = np.nanmean(spectrum)
+            spectrum = spectrum / mean if mean else spectrum
+        if angle not in self.spectra:
+            self.order.append(angle)
+        self.spectra[angle] = spectrum
+
+    def change_metric(self):
+        '''Returns (sorted angles, change between each pair of neighbours).'''
+        angles = np.array(sorted(self.spectra))
+        if len(angles) < 2:
+            return angles, np.zeros(0)
+        stack = np.vstack([self.spectra[angle] for angle in angles])
+        change = np.sqrt(np.nanmean(np.diff(stack, axis=0) ** 2, axis=1))
+        return angles, change
+
+    def _candidates(self):
+        '''Midpoints of the intervals to split next, largest change first. Does not change the sampler.'''
+        remaining = self.budget - len(self.spectra)
+        if remaining <= 0:
+            return []
+        angles, change = self.change_metric()
+        if len(change) == 0:
+            return []
+        gaps = np.diff(angles)
+        candidates = np.flatnonzero((change > self.threshold) & (gaps / 2 >= self.min_step))
+        candidates = candidates[np.argsort(change[candidates])[::-1]][:remaining]
+        return [float(np.round((angles[index] + angles[index + 1]) / 2, 6)) for index in candidates]
+
+    def refine(self):
+        '''Starts a refinement round: returns the midpoints of the intervals to split, largest change first.'''
+        midpoints = self._candidates()
+        if midpoints:
+            self.rounds += 1
+        return midpoints
+
+    @property
+    def done(self):
+        '''True when nothing is left to measure. Reading it does not change the sampler.'''
+        return not self._pending and not self._candidates()
+
+
+FolderAcquirer = FolderDetector # the acquirer of the .txt folder backend, see ars_detector
+
+
+def _reference_at(references, angles):
+    '''The reference at angles from a dict {angles: spectrum}: the stored one, or else interpolated linearly between the two nearest
+    stored points, since refinement rounds of the sample pass need not land on the points of the reference pass.'''
+    angles = tuple(float(angle) for angle in angles)
+    if angles in references:
+        return references[angles]
+    if len(references) < 2:
+        return None
+    keys = list(references)
+    distance = np.linalg.norm(np.array(keys, dtype=float) - np.array(angles), axis=1)
+    first, second = np.argsort(distance)[:2]
+    weight = distance[second] / (distance[first] + distance[second])
+    return weight * np.asarray(references[keys[first]], dtype=float) + (1 - weight) * np.asarray(references[keys[second]], dtype=float)
+
+
+def _reflectance(spectrum, reference, angles):
+    '''spectrum as reflectance (%) against reference, a dict {angles: spectrum} or a callable(angles) returning the reference.'''
+    reference_spectrum = reference(angles) if callable(reference) else _reference_at(reference, angles)
+    if reference_spectrum is None:
+        raise LookupError(f"No reference spectrum for {angles}; measure the reference pass first.")
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100 * np.asarray(spectrum, dtype=float) / np.asarray(reference_spectrum, dtype=float)
+
+
+def adaptive_scan_job(worker, sampler, acquire, point_for=None, data_dir=None, scan_pass='sample', gate=None, reference=None):
+    '''Worker job running an adaptive scan. sampler is an AdaptiveSampler, acquire a callable(worker, angles) returning the spectrum at
+    the current position (e.g. a detector driver, see ars_detector), and point_for maps a sampler angle to the (x, y) point to move to; the default is a
+    specular scan, (angle, angle).
+
+    The visited points are written to data_dir in acquisition order (scan_list.dat and scan_list.json, as for uniform scans) so the
+    files can be renamed with their angles. With a QualityGate (see ars_quality) every spectrum is checked as it arrives and acquired
+    again if it fails. Returns the visited points.
+
+    Sample spectra are refined on their reflectance, not on raw counts, which also follow the lamp and detector response: each is
+    divided by the reference at the same point, from reference (a dict {angles: spectrum}, interpolated between points, or a
+    callable(angles), e.g. wrapping a ReferenceLibrary) or else from the references the gate kept during the reference pass. Reference passes, and sample passes
+    without any reference, are refined on the raw spectra.'''
+    if point_for is None:
+        point_for = lambda angle: (angle, angle)
+    spectrometer = worker.spectrometer
+    if hasattr(acquire, 'data_type'):
+        acquire.data_type = scan_pass
+    if reference is None and gate is not None and gate.references:
+        reference = gate.references
+    if scan_pass == 'reference':
+        reference = None
+    visited = []
+    start_time = time.perf_counter()
+    worker.post('scan_started', total=sampler.budget, predicted=None)
+
+    for angle in sampler:
+        worker.checkpoint()
+        x_angle, y_angle = point_for(angle)
+        spectrometer.go_to_angle(x_angle, y_angle)
+        spectrometer.wait_for_motors()
+        worker.post_position()
+        worker.post('progress', index=len(visited), total=sampler.budget, angles=(x_angle, y_angle))
+
+        if gate is None:
+            spectrum = acquire(worker, (x_angle, y_angle))
+        else:
+            spectrum, _ = gated_acquire(worker, acquire, gate, (x_angle, y_angle), data_type=scan_pass, data_dir=data_dir)
+        sampler.add(angle, spectrum if reference is None else _reflectance(spectrum, reference, (x_angle, y_angle)))
+        visited.append((x_angle, y_angle))
+    if hasattr(acquire, 'flush'):
+        acquire.flush()
+
+    if data_dir is not None:
+        export_scan_list(visited, os.path.join(data_dir, "scan_list.dat"))
+        scan_list_path = os.path.join(data_dir, 'scan_list.json')
+        scan_list = {}
+        if os.path.exists(scan_list_path):
+            with open(scan_list_path, 'r') as file:
+                scan_list = json.load(file)
+        scan_list[scan_pass] = [[float(x), float(y)] for x, y in visited]
+        with open(scan_list_path, 'w') as file:
+            json.dump(scan_list, file)
+
+    elapsed = time.perf_counter() - start_time
+    worker.post('scan_complete', total=len(visited), elapsed=elapsed, predicted=None)
+    return visited
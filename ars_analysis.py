@@ -0,0 +1,1006 @@
+import os
+import numpy as np
+import json
+import re
+import logging
+from ars_profiling import StageProfiler, profiled
+from ars_quality import read_quality
+
+logger = logging.getLogger(__name__)
+
+def generate_scan_list(dataDir, params, reference=True):
+    '''Writes scan_list.json for a specular scan. With reference=False there is no reference pass (references from a library, see ars_references).'''
+    if len(params) != 3:
+        print("Please provide the correct number of parameters.")
+        return False
+    for x in params:
+        try:
+            float(x)
+        except ValueError:
+            print("Please provide valid angles.")
+            return False
+        
+    ref_angles = np.arange(float(params[0]), float(params[1]) + float(params[2]), float(params[2]))
+    # sample_angles = np.arange(float(params[0]), float(params[1]) + float(params[2]), float(params[2]))
+
+
+    scan_params = [[angle, angle] for angle in ref_angles]
+    scan_list = {'reference': scan_params, 'sample': scan_params} if reference else {'sample': scan_params}
+    with open(os.path.join(dataDir, 'scan_list.json'), 'w') as file:
+        json.dump(scan_list, file)
+    print("Scan list generated.")
+    return True
+
+
+def rename_files(dataDir, ref_id='reference', sample_id='sample'):
+    '''Renames files in the directory based on the scan_list.json file, which has one entry per acquisition of each pass. Raises
+    ValueError, renaming nothing, if the number of files of a pass differs from its number of entries.'''
+
+    def exclude_files(file_list):
+        '''Excludes files which already have the angles in the filename, indicating renaming has been successful.'''
+
+        new_file_list = [x for x in file_list]
+
+        for file in file_list:
+            try:
+                basename = re.sub(r'\.\w{3}$', '', file)
+                endstring = basename.split('_')[-1]
+                angles = endstring.split(',')
+                if len(angles) > 1:
+                    new_file_list.remove(file)
+            except Exception as e:
+                pass
+
+        
+        return new_file_list
+
+    reference_files = [file for file in os.listdir(dataDir) if ref_id in file]
+    sample_files = [file for file in os.listdir(dataDir) if sample_id in file]
+
+    reference_files = exclude_files(reference_files)
+    sample_files = exclude_files(sample_files)
+
+    
+    
+    if len(reference_files) == 0 and len(sample_files) == 0:
+        print("Files appear to be renamed. Skipping renaming.")
+        return
+
+    try:
+        sorted_reference_files = sorted(reference_files, key=lambda x: int(x.split('_')[2].split('.')[0]))
+        sorted_sample_files = sorted(sample_files, key=lambda x: int(x.split('_')[2].split('.')[0]))
+    except ValueError:
+        try:
+            test_file = reference_files[0].split('_')[2].split('.')[0].split(',')
+            test = [float(angle) for angle in test_file]
+            print("Files appear to be renamed. Skipping renaming.")
+            return
+        except Exception as e:
+            print(f"Error in file renaming: {e}\nPlease check the files and try again.")
+            
+    # open json file for scan list
+    if not os.path.exists(os.path.join(dataDir, 'scan_list.json')):
+        while True:
+            user_in = input("Scan list json file not found. Would you like to generate the scan list flie? (y/n): ")
+            if user_in.lower() == 'y':
+                while True:
+                    param_in = input("Enter scan params separated by comma: start_angle,stop_angle,resolution:\n")
+                    params = param_in.split(',')
+                    if generate_scan_list(dataDir, params) is True:
+                        break
+                    else:
+                        continue
+
+    with open(os.path.join(dataDir, 'scan_list.json'), 'r') as file:
+        scan_list = json.load(file)
+    
+    # breakpoint()
+    reference_angles = scan_list.get('reference')
+    sample_angles = scan_list.get('sample')
+
+    # breakpoint()
+
+    # either pass may be missing, e.g. sample scans using library references
+    passes = ((ref_id, reference_angles or [], sorted_reference_files), (sample_id, sample_angles or [], sorted_sample_files))
+    for identifier, pass_angles, pass_files in passes:
+        if pass_files and len(pass_angles) != len(pass_files):
+            # renaming one to one would label files with the angles of other points
+            raise ValueError(f"{len(pass_files)} {identifier} files for {len(pass_angles)} entries in scan_list.json; no files renamed.")
+    for identifier, pass_angles, pass_files in passes:
+        for idx in range(len(pass_files)):
+            angle_tag = ','.join(str(angle) for angle in pass_angles[idx])
+            rename = pass_files[idx].split('_')
+            rename = '_'.join(rename[:-1]) + f"_{angle_tag}.txt"
+            try:
+                os.rename(os.path.join(dataDir, pass_files[idx]), os.path.join(dataDir, rename))
+            except Exception as e:
+                print(f"Error renaming file: {e}")
+    print("Files renamed.")
+
+class ReflectionFile:
+    def __init__(self, filepath, profiler=None, load=True):
+        self.filepath = filepath
+        self.filename = os.path.basename(filepath)
+        self.profiler = profiler
+        self.data_type, self.angles = self._parse_filename(self.filename)
+        self.header = {}
+        self.data = None
+        if load:
+            self.load()
+
+    def load(self):
+        '''Loads the file, recording it as a per-file stage if a profiler is attached.'''
+        if self.profiler is None:
+            self.load_file()
+        else:
+            with self.profiler.stage('file', label=self.filename):
+                self.profiler.add_bytes_read(os.path.getsize(self.filepath))
+                self.load_file()
+
+    def release(self):
+        '''Drops the spectral data, keeping the header and parsed filename information.'''
+        self.data = None
+
+    def __repr__(self):
+        return f"ReflectionFile: {self.data_type}:{self.angles}:{self.filename}"
+    
+    def __str__(self):
+        return f"{self.data_type}: {self.angles}"
+    
+    def info(self):
+        return {'data_type': self.data_type, 'angles': self.angles, 'filename': self.filename, 'integration_time': self.header.get('Integration Time (sec)', None)}
+
+    def _parse_filename(self, filename):
+        '''Parses the filename to extract the data type and angles. File convention needs to contain:
+        1. A data type identifier ("ref", "dark" or sample identifier (not yet implimented)
+        2. Angles in the format "a,b" where a and b are the two angles in degrees, or "a,b,c" with the sample rotation (Z) c. Dark spectra may omit the angles, in which case angles is None.'''
+
+        def match_angles(name_string):
+            pattern = r"-?\d+(?:\.\d+)?(?:,-?\d+(?:\.\d+)?){1,2}"
+            matches = re.findall(pattern, name_string) 
+            return matches
+        
+        def match_basename_identifier(pattern, name_string):
+            match = re.match(pattern, name_string.lower())
+            return match
+
+        def extract_angles(name_string):
+            angles = match_angles(filename)
+            if len(angles) == 0 and data_type == 'dark':
+                return None
+            if len(angles) > 1:
+                logger.warning(f"Multiple angle matches found for {filename}. Using the first one.")
+            angles = angles[0].split(',')
+            angles = tuple([float(angle) for angle in angles])
+            return angles
+
+        # generate basename and identifier
+        name_parts = filename.split('_')
+        file_basename = name_parts[0]
+
+        reference_matches = match_basename_identifier(r'.*ref.*', file_basename)
+        dark_matches = match_basename_identifier(r'.*dark.*', file_basename)
+        # sample_name_matches = match_basename_identifier(file_basename, r'.*.*')
+
+        if dark_matches:
+            data_type = 'dark'
+        elif reference_matches:
+            data_type = 'reference'
+        else:
+            data_type = 'sample'
+            logger.debug(f"predicting sample for {file_basename}")
+
+        angles = extract_angles(filename)
+
+        return data_type, angles
+
+    def load_file(self):
+        self.header, self.data = self.read_file(self.filepath)
+
+    @classmethod
+    def read_file(cls, filepath):
+        '''Reads the header dict and the (wavelength, intensity) data array of a spectrometer text file, whatever its name.'''
+        with open(filepath, 'r') as file:
+            lines = file.readlines()
+
+        header_lines = []
+        data_lines = []
+        found_data = False
+
+        for line in lines:
+            if line.startswith('>>>>>Begin Spectral Data<<<<<'):
+                found_data = True
+                continue
+
+            if found_data:
+                data_lines.append(line)
+            else:
+                header_lines.append(line)
+
+        return cls._parse_header(header_lines), cls._parse_data(data_lines)
+
+    @staticmethod
+    def _parse_header(header_lines):
+        header = {}
+        for line in header_lines:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                header[key.strip()] = value.strip()
+        return header
+
+    @staticmethod
+    def _parse_data(data_lines):
+        data = [list(map(float, line.split('\t'))) for line in data_lines]
+        return np.array(data)
+
+    @property
+    def integration_time(self):
+        return float(self.header.get('Integration Time (sec)', 0))
+
+
+class AveragedSpectrum:
+    '''Running average of the repeats of one spectrum (same data type and angles), updated with Welford's algorithm.
+    
+    Only the running mean and the sum of squared deviations are kept, so memory does not grow with the number of repeats. Exposes the same data, header, angles and integration_time attributes as ReflectionFile so it can be used in its place.'''
+
+    def __init__(self, reflection_file):
+        self.data_type = reflection_file.data_type
+        self.angles = reflection_file.angles
+        self.filename = reflection_file.filename
+        self.header = reflection_file.header
+        self.filenames = []
+        self.data = np.array(reflection_file.data, dtype=float)
+        self.n_repeats = 0
+        self._m2 = np.zeros(len(self.data))
+        self.add(reflection_file)
+
+    def __repr__(self):
+        return f"AveragedSpectrum: {self.data_type}:{self.angles}:{self.n_repeats} repeats"
+
+    def __str__(self):
+        return f"{self.data_type}: {self.angles} (n={self.n_repeats})"
+
+    def add(self, reflection_file, values=None):
+        '''Adds a repeat to the running mean and variance. values overrides the intensity column of the file (e.g. after dark subtraction).'''
+        if values is None:
+            values = reflection_file.data[:, 1]
+
+        if self.n_repeats > 0:
+            if len(values) != len(self.data) or not np.allclose(reflection_file.data[:, 0], self.data[:, 0]):
+                raise ValueError(f"Wavelength axis of {reflection_file.filename} does not match {self.filename}.")
+            if reflection_file.integration_time != self.integration_time:
+                logger.warning(f"Integration time of {reflection_file.filename} differs from {self.filename}. Averaging anyway.")
+
+        self.n_repeats += 1
+        mean = self.data[:, 1]
+        delta = values - mean
+        mean += delta / self.n_repeats
+        self._m2 += delta * (values - mean)
+        self.filenames.append(reflection_file.filename)
+
+    @property
+    def integration_time(self):
+        return float(self.header.get('Integration Time (sec)', 0))
+
+    @property
+    def variance(self):
+        '''Sample variance per wavelength. Zero for a single repeat.'''
+        if self.n_repeats < 2:
+            return np.zeros_like(self._m2)
+        return self._m2 / (self.n_repeats - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def stderr(self):
+        '''Standard error of the mean per wavelength.'''
+        return self.std / np.sqrt(self.n_repeats)
+
+    def noise(self):
+        '''Median standard error across the spectrum, and the median signal to noise ratio of the mean. NaN with fewer than two repeats.'''
+        if self.n_repeats < 2:
+            return np.nan, np.nan
+        stderr = self.stderr
+        with np.errstate(divide='ignore', invalid='ignore'):
+            snr = np.abs(self.data[:, 1]) / stderr
+        snr = snr[np.isfinite(snr)]
+        median_snr = float(np.median(snr)) if len(snr) > 0 else np.nan
+        return float(np.median(stderr)), median_snr
+
+    def info(self):
+        return {'data_type': self.data_type, 'angles': self.angles, 'filename': self.filename, 'integration_time': self.header.get('Integration Time (sec)', None), 'n_repeats': self.n_repeats}
+
+
+class AngleReflectance:
+
+    def __init__(self, fileDir, reference_axis=(1, 1), profiler=None, combine_repeats=True, subtract_dark=True, reference_tolerance=0, quality_mask=0,
+                 reference_library=None, polarization=None):
+        '''Initialise the class and load files from the directory as angle resolved reflectance data. fileDir can also be a scan container (.arsc, see ars_container), or an open ScanContainer such as the one a detector driver is writing to (see ars_detector), whose spectra are memory mapped and read as they are used.
+        
+        reference_axis can be a combination of integer values, spanning the range of the total number of axes. It provides a mapping of axis for which uncoupled scans are to be normalised. The ordering is (sample, reference). Secondary axes are selected by default. For instance, (0, 0) maps the two primary axes together, such that all of the samples with angles (a, _) will be normalised agains the reference with (a, _). (0, 1) maps (a, _) to (_, a), and (1, 1) maps (_, a) to (_, a).
+        
+        Use caution when selecting axes - you must consider an appropriate logical reference mapping for your data to be quantitative.
+        
+        profiler is an optional StageProfiler (or True to create one) which records timings, bytes read and allocations for each processing stage and file. See profile_report.
+
+        reference_tolerance (degrees) lets a sample use the nearest reference within that distance when there is none at exactly its angle, as for fly scans (see ars_flyscan), whose spectra are tagged with the mean angle they were acquired over. The angular blur of fly scan spectra is loaded into angular_blur, {data_type: {angles: (blur_x, blur_y)}}.
+
+        The per-angle quality flags logged by a quality gate during the scan (quality_flags.csv, see ars_quality) are loaded into quality, {data_type: {angles: flags}}; check_quality computes them from the loaded spectra instead. Angles whose sample or reference flags share a bit with quality_mask (e.g. SATURATED | NOT_FINITE) are left out of the reflectance.
+
+        reference_library (a ReferenceLibrary or its path, see ars_references) supplies the references of samples without a measured one, e.g. scans that skipped the reference pass: the library reference for the sample's angle, polarization and integration time, acquired within the library's freshness limit before the sample (see timestamps), interpolated between library angles if needed. The references used are kept in library_references.
+
+        With combine_repeats, files sharing a data type and angles are averaged as they are read (see AveragedSpectrum), otherwise later files replace earlier ones. With subtract_dark, files identified as "dark" are averaged per integration time and subtracted from every spectrum with the same integration time as it is loaded. See noise_report for the per-angle noise estimates.'''
+
+        if profiler is True:
+            profiler = StageProfiler()
+        elif not profiler:
+            profiler = None # e.g. profiler=False straight from a command line flag
+        self.profiler = profiler
+        self.combine_repeats = combine_repeats
+        self.subtract_dark = subtract_dark
+        self.dark_dict = {}
+        self.reference_tolerance = reference_tolerance
+        self.angular_blur = {}
+        self.quality_mask = quality_mask
+        if isinstance(reference_library, str):
+            from ars_references import ReferenceLibrary
+            reference_library = ReferenceLibrary(reference_library)
+        self.reference_library = reference_library
+        self.polarization = polarization
+        self.library_references = {}
+        self.timestamps = {} # {(data_type, angles): acquisition time of the newest spectrum}
+
+        self.source = fileDir
+        if hasattr(fileDir, 'records'):
+            self.fileDir = os.path.dirname(os.path.abspath(fileDir.filepath))
+        else:
+            self.fileDir = os.path.dirname(os.path.abspath(fileDir)) if os.path.isfile(fileDir) else fileDir
+        self.dataDict = self.load_data()
+        self.quality = read_quality(self.fileDir)
+        self.data_ok = self.report_info()
+
+        self.sample_identifier = 'sample'
+        self.reference_identifier = 'reference'
+        self.reference_axis = reference_axis
+        self.identifier = None
+        self.warning_flags = []
+
+    @profiled('load')
+    def load_data(self):
+        '''Streams the files in the directory into per-angle spectra. Dark files are read first so that every other file can be dark subtracted and folded into its running average as it is read, after which its raw data is released.'''
+        if hasattr(self.source, 'records') or os.path.isfile(self.source):
+            from ars_container import ScanContainer, ContainerSpectrum
+            container = self.source if hasattr(self.source, 'records') else ScanContainer(self.source)
+            container.refresh()
+            reflection_files = [ContainerSpectrum(container, index, profiler=self.profiler) for index in range(len(container))]
+        else:
+            files = sorted(os.path.join(self.fileDir, file) for file in os.listdir(self.fileDir) if file.endswith('.txt'))
+            reflection_files = [ReflectionFile(file, profiler=self.profiler, load=False) for file in files]
+
+        self.dark_dict = {}
+        for file in reflection_files:
+            if file.data_type != 'dark':
+                continue
+            file.load()
+            dark = self.dark_dict.get(file.integration_time)
+            if dark is None:
+                self.dark_dict[file.integration_time] = AveragedSpectrum(file)
+            else:
+                dark.add(file)
+            file.release()
+
+        from ars_flyscan import read_tags
+        blur_tags = read_tags(self.fileDir)
+
+        angle_dict = {}
+        missing_darks = set()
+        for file in reflection_files:
+            if file.data_type == 'dark':
+                continue
+            file.load()
+
+            if self.subtract_dark and self.dark_dict:
+                dark = self.dark_for(file.integration_time)
+                if dark is None:
+                    missing_darks.add(file.integration_time)
+                else:
+                    file.data[:, 1] -= dark
+
+            if file.data_type not in angle_dict:
+                angle_dict[file.data_type] = {}
+            timestamp = getattr(file, 'timestamp', None) or os.path.getmtime(file.filepath)
+            key = (file.data_type, file.angles)
+            self.timestamps[key] = max(self.timestamps.get(key, timestamp), timestamp)
+            if file.filename in blur_tags:
+                blur = self.angular_blur.setdefault(file.data_type, {}).get(file.angles, (0.0, 0.0))
+                self.angular_blur[file.data_type][file.angles] = tuple(max(a, b) for a, b in zip(blur, blur_tags[file.filename]))
+            existing = angle_dict[file.data_type].get(file.angles)
+
+            if not self.combine_repeats:
+                if existing is not None:
+                    logger.warning(f"Duplicate {file.data_type} file for {file.angles}: {file.filename} replaces {existing.filename}.")
+                angle_dict[file.data_type][file.angles] = file
+                continue
+
+            if existing is None:
+                angle_dict[file.data_type][file.angles] = AveragedSpectrum(file)
+            else:
+                existing.add(file)
+            file.release()
+
+        for integration_time in sorted(missing_darks):
+            logger.warning(f"No dark spectrum with integration time {integration_time} s. Spectra with this integration time are not dark subtracted.")
+
+        return angle_dict
+
+    def dark_for(self, integration_time):
+        '''Dark spectrum (intensity) for an integration time. Without a dark at that time, as with auto-exposed scans (see
+        ars_exposure), it is interpolated or extrapolated linearly in time from the darks at the two nearest times, since the dark
+        level is an offset plus a dark current. None if there is no dark at that time and fewer than two darks.'''
+        dark = self.dark_dict.get(integration_time)
+        if dark is not None:
+            return dark.data[:, 1]
+        if len(self.dark_dict) < 2:
+            return None
+        times = sorted(self.dark_dict, key=lambda time: abs(time - integration_time))[:2]
+        (t0, t1), (d0, d1) = times, (self.dark_dict[time].data[:, 1] for time in times)
+        return d0 + (d1 - d0) * (integration_time - t0) / (t1 - t0)
+
+    def noise_report(self):
+        '''Per-angle noise estimates from the repeat statistics. Returns {data_type: {angles: {'n_repeats', 'stderr', 'snr'}}}, where stderr is the median standard error of the mean across the spectrum and snr the median signal to noise ratio.'''
+        report = {}
+        for data_type, file_dict in self.dataDict.items():
+            report[data_type] = {}
+            for angles, spectrum in file_dict.items():
+                if isinstance(spectrum, AveragedSpectrum):
+                    stderr, snr = spectrum.noise()
+                    n_repeats = spectrum.n_repeats
+                else:
+                    stderr, snr, n_repeats = np.nan, np.nan, 1
+                report[data_type][angles] = {'n_repeats': n_repeats, 'stderr': stderr, 'snr': snr}
+                logger.debug(f"{data_type} {angles}: {n_repeats} repeats, stderr {stderr:.4g}, SNR {snr:.4g}")
+        return report
+    
+    @profiled('report')
+    def report_info(self):
+        references = {}
+        samples = {}
+
+        for file_type, file_dict in self.dataDict.items():
+            # print(f"{file_type}:")
+            for angles, file in file_dict.items():
+                infoDict = file.info()
+                if file_type == 'reference':
+                    references[angles] = infoDict
+                else:
+                    samples[angles] = infoDict
+
+        logger.info("### Report ###")
+        if self.reference_library is not None and references.keys() <= samples.keys():
+            logger.info(f"{len(samples) - len(references)} references from {self.reference_library}.")
+            return True
+        ref_angles_set = set(references.keys())
+        # the samples of a scan with a Z axis, (x, y, z), share the references of their arm angles
+        sample_angles_set = set(angles if angles is None or angles in ref_angles_set else angles[:2] for angles in samples.keys())
+        if len(ref_angles_set) != len(sample_angles_set):
+            logger.warning("Warning: Different number of reference and sample files.")
+
+        missing_in_samples = ref_angles_set - sample_angles_set
+        missing_in_references = sample_angles_set - ref_angles_set
+
+        if missing_in_samples:
+            logger.warning(f"Warning: The following reference angles are missing in samples: {missing_in_samples}")
+        elif missing_in_references:
+            logger.warning(f"Warning: The following sample angles are missing in references: {missing_in_references}")
+        else:
+            logger.info("All angles accounted for.")
+
+        return True
+
+    
+    def quality_flags(self, data_type, angles):
+        '''Quality flags of the spectrum at angles (0 if it was not checked).'''
+        return self.quality.get(data_type, {}).get(angles, 0)
+
+    def flagged(self, mask=None, data_type=None):
+        '''Sorted angles whose quality flags share a bit with mask (any flag by default), for all data types or one.'''
+        from ars_quality import ALL_FLAGS
+
+        mask = ALL_FLAGS if mask is None else mask
+        data_types = [data_type] if data_type is not None else list(self.quality)
+        return sorted(set(angles for name in data_types for angles, flags in self.quality.get(name, {}).items() if flags & mask))
+
+    @profiled('quality')
+    def check_quality(self, gate):
+        '''Runs a QualityGate over all loaded spectra at once (the samples against their references) and replaces quality with the
+        result, e.g. for scans taken without a gate. Checks the dark subtracted, averaged spectra. Returns quality.'''
+        self.quality = {}
+        for data_type in ('reference', 'sample'):
+            file_dict = self.dataDict.get(self.reference_identifier if data_type == 'reference' else self.sample_identifier, {})
+            if not file_dict:
+                continue
+            keys = list(file_dict)
+            intensity = np.vstack([file_dict[angles].data[:, 1] for angles in keys])
+            reference = None
+            if data_type == 'sample' and (self.reference_identifier in self.dataDict or self.reference_library is not None):
+                reference = np.vstack([self.reference_spectrum(angles, file_dict[angles])[1].data[:, 1] for angles in keys])
+            flags = gate.check(intensity, reference)
+            self.quality[data_type] = {angles: int(flag) for angles, flag in zip(keys, flags)}
+        return self.quality
+
+    def reference_spectrum(self, angles, sample, references=None):
+        '''(reference angles, reference spectrum) for the sample spectrum at angles: the measured reference (see find_reference) or,
+        failing that, the library reference (reference angles None).'''
+        if references is None:
+            references = self.dataDict.get(self.reference_identifier, {})
+        reference_angles = angles if angles in references else self.find_reference(angles)
+        reference = references.get(reference_angles)
+        if reference is None:
+            return None, self.library_reference(angles, sample)
+        return reference_angles, reference
+
+    def library_reference(self, angles, sample):
+        '''The reference for the sample spectrum at angles from the reference library, cached in library_references.'''
+        if angles not in self.library_references:
+            self.library_references[angles] = self.reference_library.resolve(angles[self.reference_axis[0]], sample.integration_time, self.polarization,
+                                                                             wavelength=sample.data[:, 0], when=self.timestamps.get((self.sample_identifier, angles)),
+                                                                             axis=self.reference_axis[1])
+        return self.library_references[angles]
+
+    def find_reference(self, angles:tuple):
+        '''Finds the reference file based on the reference axis mapping'''
+        sample_angle = angles[self.reference_axis[0]]
+        references = self.dataDict.get(self.reference_identifier, {})
+
+        reference_candidates = [angle for angle in references.keys() if angle[self.reference_axis[1]] == sample_angle]
+        if len(reference_candidates) == 0 and self.reference_tolerance:
+            distances = {angle: abs(angle[self.reference_axis[1]] - sample_angle) for angle in references.keys()}
+            reference_candidates = sorted((angle for angle, distance in distances.items() if distance <= self.reference_tolerance), key=distances.get)
+
+        if len(reference_candidates) == 0 and self.reference_library is not None:
+            return None # resolved from the library
+        assert len(reference_candidates) > 0 , f"No reference found for {angles}."
+        if len(reference_candidates) > 1:
+            self.warning_flags.append(f"Multiple references found for {angles}. Using the first one.")
+
+        return reference_candidates[0]
+    
+
+
+    @profiled('reflectivity')
+    def calculate_reflectivity(self, reference_identifier=None, sample_identifier=None, time_normalised=False):
+        '''Calculates the reflectivity of the sample using the reference data. If time_normalised is True, the reflectance is normalised by the integration time of the sample.'''
+
+        if reference_identifier is None:
+            reference_identifier = self.reference_identifier
+        if sample_identifier is None:
+            sample_identifier = self.sample_identifier
+
+
+        # breakpoint()
+        
+        reference_dict = self.dataDict.get(reference_identifier, {})
+        sample_dict = self.dataDict[sample_identifier]
+        self.reflectance_dict = {}
+
+        masked = []
+        mixed_times = []
+        for angles in sample_dict:
+            sample_file = sample_dict.get(angles)
+            reference_angles, reference_file = self.reference_spectrum(angles, sample_file, reference_dict)
+            if self.quality_mask and (self.quality_flags(sample_identifier, angles) | self.quality_flags(reference_identifier, reference_angles)) & self.quality_mask:
+                masked.append(angles)
+                continue
+            
+            sample_data = sample_file.data
+            reference_data = reference_file.data
+            reflectance_data = sample_data[:, 1] / reference_data[:, 1]
+
+            if time_normalised is not True and reference_file.integration_time != sample_file.integration_time:
+                mixed_times.append(angles)
+            if time_normalised is True:
+                # Handle different integration times if needed
+                integration_time_ratio = reference_file.integration_time / sample_file.integration_time 
+                # breakpoint()
+                reflectance_data *= integration_time_ratio
+
+            reflectance_data *= 100  # Convert to percentage
+            # reflectance_data /= 2 # the data is doubled for some reason, possibly normalisation time #TODO: Fix this Its from the integration time of 0.5s... but the ratios should be the same...
+            self.reflectance_dict[angles] = np.column_stack((sample_data[:, 0], reflectance_data))
+
+        if masked:
+            logger.warning(f"{len(masked)} angles left out by their quality flags: {masked}")
+        if mixed_times:
+            logger.warning(f"Sample and reference integration times differ at {len(mixed_times)} angles (e.g. an auto-exposed scan). Use time_normalised.")
+
+        # sorted by angle, so adaptive scans (acquired out of order, non-uniform steps) plot and export in angle order
+        self.reflectance_dict = dict(sorted(self.reflectance_dict.items()))
+        return self.reflectance_dict
+
+    def reflectance_map(self, axis=None, select=None):
+        '''Returns (angles, wavelength, reflectance) with reflectance an (n_angles, n_wavelengths) array, sorted by angle. The angles
+        need not be evenly spaced. axis picks the angle (0 for X, 1 for Y, 2 for Z); by default the one that varies most. select
+        ({axis: angle}) keeps only the spectra at those angles, e.g. {2: 30.0} for one sample rotation of a scan with a Z axis.'''
+        keys = np.array(list(self.reflectance_dict.keys()), dtype=float).reshape(len(self.reflectance_dict), -1)
+        spectra = list(self.reflectance_dict.values())
+        if select:
+            keep = np.ones(len(keys), dtype=bool)
+            for column, angle in select.items():
+                keep &= np.isclose(keys[:, column], angle)
+            keys, spectra = keys[keep], [spectrum for spectrum, kept in zip(spectra, keep) if kept]
+        if axis is None:
+            axis = int(np.argmax([len(np.unique(keys[:, column])) for column in range(keys.shape[1])]))
+        order = np.argsort(keys[:, axis], kind='stable')
+        wavelength = spectra[0][:, 0]
+        reflectance = np.vstack([spectra[index][:, 1] for index in order])
+        return keys[order, axis], wavelength, reflectance
+
+    @staticmethod
+    def _cell_edges(centres):
+        '''Cell edges half way between neighbouring centres, for pcolormesh on a non-uniform grid.'''
+        centres = np.asarray(centres, dtype=float)
+        if len(centres) == 1:
+            return np.array([centres[0] - 0.5, centres[0] + 0.5])
+        middles = (centres[1:] + centres[:-1]) / 2
+        return np.concatenate(([2 * centres[0] - middles[0]], middles, [2 * centres[-1] - middles[-1]]))
+
+    @profiled('plot')
+    def plot_reflectance_map(self, axis=None, xregion=None, title=None, exportDir=None, save_plot=True, show_points=True, select=None):
+        '''Reflectance against wavelength and angle. Each measured angle is drawn as a band reaching half way to its neighbours, so
+        adaptively refined scans are shown at their true resolution; show_points marks the measured angles. axis and select as for
+        reflectance_map.'''
+        import matplotlib.pyplot as plt
+
+        if title is None:
+            title = self.identifier
+        angles, wavelength, reflectance = self.reflectance_map(axis, select)
+
+        fig, ax = plt.subplots()
+        mesh = ax.pcolormesh(self._cell_edges(wavelength), self._cell_edges(angles), reflectance, shading='flat', cmap='plasma')
+        if show_points:
+            ax.plot(np.full(len(angles), wavelength[-1]), angles, '<', color='k', markersize=3)
+        if xregion:
+            ax.set_xlim(*xregion)
+        ax.set_xlabel('Wavelength (nm)')
+        ax.set_ylabel('Angle (deg)')
+        ax.set_title(title)
+        fig.colorbar(mesh, ax=ax, label='Reflectance percentage (%)')
+
+        if save_plot == True:
+            if exportDir is None:
+                exportDir = os.path.join(self.fileDir, 'exported_data')
+            if not os.path.exists(exportDir):
+                os.makedirs(exportDir)
+            plt.savefig(os.path.join(exportDir, f"{self.identifier}_map.png"))
+        plt.show()
+
+    @profiled('plot')
+    def plot_raw(self, offset=0):
+        import matplotlib.pyplot as plt
+
+        label_1, label_2 = list(self.dataDict.keys())[:2]
+        key_dict_1 = self.dataDict[label_1]
+        key_dict_2 = self.dataDict[label_2]
+
+        fig, ax = plt.subplots(1, 2)
+
+        for idx, (angle, file) in enumerate(key_dict_1.items()):
+            ax[0].plot(file.data[:, 0], file.data[:, 1] + offset * idx, label=f"{angle}°")
+        ax[0].set_title(label_1)
+        ax[0].set_xlabel('Wavelength (nm)')
+        ax[0].set_ylabel('Intensity (a.u.)')
+        ax[0].legend()
+
+        for idx, (angle, file) in enumerate(key_dict_2.items()):
+            ax[1].plot(file.data[:, 0], file.data[:, 1] + offset * idx, label=f"{angle}°")
+        ax[1].set_title(label_2)
+        ax[1].set_xlabel('Wavelength (nm)')
+        ax[1].set_ylabel('Intensity (a.u.)')
+        ax[1].legend()
+
+        plt.show()
+
+    @profiled('plot')
+    def plot_reflectance(self, xregion=None, yregion=None, title=None, exportDir=None, save_plot=True):
+        import matplotlib.pyplot as plt
+
+        if title is None:
+            title = self.identifier
+        for angle, data in self.reflectance_dict.items():
+            plt.plot(data[:, 0], data[:, 1], label=f"{angle}°")
+
+        if xregion:
+            plt.xlim(*xregion)
+        if yregion:
+            plt.ylim(*yregion)
+
+        plt.xlabel('Wavelength (nm)')
+        plt.ylabel('Reflectance percentage (%)')
+        plt.title(title)
+        plt.legend()
+
+        if save_plot == True:
+            if exportDir is None:
+                exportDir = os.path.join(self.fileDir, 'exported_data')
+            plt.savefig(os.path.join(exportDir, f"{self.identifier}.png"))
+        plt.show()
+
+    @profiled('filter')
+    def filter_spectra(self, steps, target='reflectance', region=None, chunk_size=64):
+        '''Applies spectral filters along the wavelength axis of all spectra at once, chunk_size spectra at a time. steps is a list of
+        (name, parameters) pairs run in order, with names from ars_filters.FILTERS:
+            ('savgol', {'window': 11, 'order': 3})      Savitzky-Golay smoothing
+            ('median', {'window': 5})                   moving median, e.g. against spikes
+            ('baseline', {'order': 3, 'iterations': 10}) subtracts a (modified) polynomial baseline
+        target 'raw' filters the dark subtracted sample and reference spectra, so it goes before calculate_reflectivity; 'reflectance'
+        filters the reflectance, e.g. before normalise_reflectance. region limits the filtering to a wavelength range.'''
+        from ars_filters import apply_filters
+
+        if target == 'raw':
+            spectra = [spectrum for file_dict in self.dataDict.values() for spectrum in file_dict.values()]
+            arrays = [spectrum.data for spectrum in spectra]
+        elif target == 'reflectance':
+            arrays = list(self.reflectance_dict.values())
+        else:
+            raise ValueError("target must be 'raw' or 'reflectance'.")
+        if not arrays:
+            return
+
+        # spectra are filtered together per wavelength axis length (normally all of them share one)
+        groups = {}
+        for array in arrays:
+            groups.setdefault(len(array), []).append(array)
+        for group in groups.values():
+            wavelength = group[0][:, 0]
+            columns = slice(None) if region is None else (wavelength >= region[0]) & (wavelength <= region[1])
+            filtered = apply_filters(np.vstack([array[:, 1] for array in group]), steps, chunk_size=chunk_size, columns=columns)
+            for array, values in zip(group, filtered):
+                array[:, 1] = values
+        return self.reflectance_dict if target == 'reflectance' else self.dataDict
+
+    @profiled('features')
+    def extract_features(self, kind='dip', model='lorentzian', region=None, window=3.0, processes=None, axis=None):
+        '''Per-angle dip (kind='dip') or peak positions, depths, centroids and widths of the reflectance, first estimated for all
+        angles at once and then refined with Lorentzian or Gaussian fits run in a process pool, each warm started from the neighbouring
+        angle (see ars_features.extract_features). region limits the search to a wavelength range. Returns the table, a numpy
+        structured array with one row per angle sorted by angle, and keeps it in self.features for export_features.'''
+        from ars_features import extract_features
+
+        angles, wavelength, reflectance = self.reflectance_map(axis)
+        self.features = extract_features(wavelength, reflectance, angles, kind=kind, model=model, region=region, window=window, processes=processes)
+        return self.features
+
+    def export_features(self, exportDir=None, filename="features"):
+        '''Writes the table from extract_features to a csv file in exportDir.'''
+        from ars_features import export_features
+
+        if exportDir is None:
+            exportDir = os.path.join(self.fileDir, 'exported_data')
+        if not os.path.exists(exportDir):
+            os.makedirs(exportDir)
+        filepath = export_features(self.features, os.path.join(exportDir, f"{filename}_{self.identifier}.csv"))
+        print(f"Features saved to {filepath}")
+        return filepath
+
+    @profiled('kspace')
+    def kspace(self, n_k=200, n_e=200, k_range=None, e_range=None, axis=None, regridder=None):
+        '''Reflectance on a uniform grid of in-plane wavevector k = (2 pi / lambda) sin(theta) (1/um) and photon energy (eV), for
+        dispersion plots. Returns (k_grid, e_grid, reflectance) with reflectance an (n_e, n_k) array, NaN outside the measured range.
+        The interpolation weights are cached by the regridder (ars_kspace.default_regridder unless given), so repeating this for
+        scans with the same angles and wavelengths only costs the weighted sum. axis is as for reflectance_map.'''
+        from ars_kspace import default_regridder
+
+        if regridder is None:
+            regridder = default_regridder
+        angles, wavelength, reflectance = self.reflectance_map(axis)
+        k_grid, e_grid = regridder.default_grid(angles, wavelength, n_k, n_e, k_range, e_range)
+        return k_grid, e_grid, regridder.regrid(reflectance, angles, wavelength, k_grid, e_grid)
+
+    @profiled('plot')
+    def plot_reflectance_kspace(self, n_k=200, n_e=200, k_range=None, e_range=None, axis=None, title=None, exportDir=None, save_plot=True):
+        '''Reflectance against in-plane wavevector and energy (see kspace).'''
+        import matplotlib.pyplot as plt
+
+        if title is None:
+            title = self.identifier
+        k_grid, e_grid, reflectance = self.kspace(n_k, n_e, k_range, e_range, axis)
+
+        fig, ax = plt.subplots()
+        mesh = ax.pcolormesh(k_grid, e_grid, np.ma.masked_invalid(reflectance), shading='nearest', cmap='plasma')
+        ax.set_xlabel(r'$k_\parallel$ ($\mu$m$^{-1}$)')
+        ax.set_ylabel('Energy (eV)')
+        ax.set_title(title)
+        fig.colorbar(mesh, ax=ax, label='Reflectance percentage (%)')
+
+        if save_plot == True:
+            if exportDir is None:
+                exportDir = os.path.join(self.fileDir, 'exported_data')
+            if not os.path.exists(exportDir):
+                os.makedirs(exportDir)
+            plt.savefig(os.path.join(exportDir, f"{self.identifier}_kspace.png"))
+        plt.show()
+
+    @profiled('plot')
+    def plot_reflectance_individual(self, xregion=None, yregion=None, title=None, exportDir=None, save_plot=True):
+        '''Makes a subplots for each angle in the reflectance data.'''
+        import matplotlib.pyplot as plt
+
+        if title is None:
+            title = self.identifier
+        fig, ax = plt.subplots(len(self.reflectance_dict), 1, figsize=(5, 10), sharex=True, sharey=False)
+
+        cmap = plt.get_cmap('plasma')
+
+        for idx, (angle, data) in enumerate(self.reflectance_dict.items()):
+            # ax[idx].plot(data[:, 0], data[:, 1], label=f"{angle}°")
+            ax[idx].plot(data[:, 0], data[:, 1], label=f"{angle}°", color=cmap(idx / len(self.reflectance_dict)))
+            # ax[idx].set_title(f"{angle}°")
+            # ax[idx].set_xlabel('Wavelength (nm)')
+            if idx == len(self.reflectance_dict) - 1:
+                ax[idx].set_xlabel('Wavelength (nm)')
+            if idx == len(self.reflectance_dict) // 2:
+                ax[idx].set_ylabel('Reflectance percentage (%)')
+            ax[idx].legend()
+
+            # ax[idx].set_xlim(min(data[:, 0]), max(data[:, 0]))
+
+            if xregion:
+                for idx in range(len(ax)):
+                    ax[idx].set_xlim(*xregion)
+            
+            if yregion:
+                for idx in range(len(ax)):
+                    ax[idx].set_ylim(*yregion)
+
+            else:
+                ax[idx].set_ylim(min(data[:, 1])/1.01, max(data[:, 1])*1.01)
+
+        plt.suptitle(title)
+        plt.tight_layout()
+        plt.subplots_adjust(top=0.95, hspace=0.1)
+
+        if save_plot == True:
+            if exportDir is None:
+                exportDir = os.path.join(self.fileDir, 'exported_data')
+                if not os.path.exists(exportDir):
+                    os.makedirs(exportDir)
+            plt.savefig(os.path.join(exportDir, f"{self.identifier}_individual.png"))
+        plt.show()
+
+
+    @profiled('plot')
+    def plot_original(self):
+        import matplotlib.pyplot as plt
+
+        data_dict = self.dataDict['sample']
+        ref_dict = self.dataDict['reference']
+
+        fig, ax = plt.subplots(2, 1)
+
+        for angle, file in data_dict.items():
+            ax[0].plot(file.data[:, 0], file.data[:, 1], label=f"{angle}°")
+        for angle, file in ref_dict.items():
+            ax[1].plot(file.data[:, 0], file.data[:, 1], label=f"{angle}°")
+
+        ax[0].set_title('Sample')
+        ax[1].set_title('Reference')
+        ax[0].legend()
+        ax[1].legend()
+        plt.show()
+
+    @profiled('export')
+    def export_data(self, exportDir=None, filename="reflectance_data", file_format="csv"):
+        """
+        Export the normalized reflectance data for all angles to a single CSV or Excel file.
+
+        Parameters:
+        exportDir (str): The directory where the file will be saved.
+        filename (str): The name of the file to save (without extension). Default is 'reflectance_data'.
+        file_format (str): The format to save the file in. Options are 'csv' or 'excel'. Default is 'csv'.
+        """
+        import pandas as pd
+
+        if exportDir is None:
+            exportDir = os.path.join(self.fileDir, 'exported_data')
+
+        if not os.path.exists(exportDir):
+            os.makedirs(exportDir)
+
+        combined_data = None
+        for angle, data in self.reflectance_dict.items():
+            df = pd.DataFrame(data, columns=['Wavelength (nm)', f'Reflectance at {angle} deg (%)'])
+            if combined_data is None:
+                combined_data = df
+            else:
+                combined_data = pd.merge(combined_data, df, on='Wavelength (nm)', how='outer')
+
+        filepath = os.path.join(exportDir, f"{filename}_{self.identifier}.{file_format}")
+
+        if file_format == "csv":
+            combined_data.to_csv(filepath, index=False)
+        elif file_format == "excel":
+            combined_data.to_excel(filepath, index=False)
+
+        print(f"All data saved to {filepath}")
+
+    @profiled('normalise')
+    def normalise_raw(self, region=(1500, 1600)):
+        '''Normalised the raw data to the region of interest, using the a global minimum. '''
+        newDict = {key: {} for key in self.dataDict.keys()}
+
+        for key, reflectanceFile in self.dataDict.items():
+            for angles, data in reflectanceFile.items():
+                mask = (data.data[:, 0] >= region[0]) & (data.data[:, 0] <= region[1])
+                if True not in mask:
+                    print("Mask region empty. Skipping normalisation")
+                    return
+                min_val = np.min(data.data[:, 1])
+                max_val = np.max(data.data[mask, 1])
+                data.data[:, 1] = (data.data[:, 1] - min_val) / (max_val - min_val) * 100
+                newDict[angles] = data.data
+
+            newDict[key] = newDict
+    
+        self.angleDict = newDict
+
+    @profiled('normalise')
+    def normalise_reflectance(self, region=(1100, 1200), normalisation_type='min'):
+        '''Normalises the reflectance data to the specified region. Options for normalisation_type are 'min' and 'max'. 'max' uses the region for the maximum value, 'min' uses the region for the minimum value.'''
+
+        for angle, data in self.reflectance_dict.items():
+            mask = (data[:, 0] >= region[0]) & (data[:, 0] <= region[1])
+            if normalisation_type == 'min':
+                min_val = np.min(data[mask, 1])
+            else:
+                min_val = np.min(data[:, 1])
+                
+            if normalisation_type == 'max':
+                max_val = np.max(data[mask, 1])
+            else:
+                max_val = np.max(data[:, 1])
+                
+            
+            # max_val = np.max(data[mask, 1])
+            data[:, 1] = (data[:, 1] - min_val) / (max_val - min_val) * 100
+
+        return self.reflectance_dict
+    
+    @profiled('normalise')
+    def normalise_reflectance_partial(self, region=(1100, 1200), normalisation_type='min'):
+        '''Normalises the reflectance data using the region as a mask for either max or minimum values. By selecting a region of interest in the spectrum which is not expected to show angle dependent intensities, angle dependent intensities elsewhere represented more clearly. Note this is in lieu of an absolute or relative intensity reference.'''
+
+        for angle, data in self.reflectance_dict.items():
+            mask = (data[:, 0] >= region[0]) & (data[:, 0] <= region[1])
+            if normalisation_type == 'min':
+                min_val = np.min(data[mask, 1])
+                data[:, 1] = data[:, 1] - min_val
+                
+            elif normalisation_type == 'max':
+                max_val = np.max(data[mask, 1])
+                data[:, 1] = data[:, 1] / max_val * 100
+                
+
+        return self.reflectance_dict
+
+    @profiled('truncate')
+    def truncate_data(self, region=(900, 1650)):
+        '''Truncates the data to the specified region'''
+        for angle, data in self.reflectance_dict.items():
+            mask = (data[:, 0] >= region[0]) & (data[:, 0] <= region[1])
+            self.reflectance_dict[angle] = data[mask]
+
+        return self.reflectance_dict
+
+    def profile_report(self, sort_by='wall', per_file=False, filepath=None, stats_filepath=None):
+        '''Returns the profiling report, sorted by one of 'wall', 'cpu', 'bytes_read', 'alloc' or 'calls'. Optionally writes the report to filepath and the cProfile stats to stats_filepath.'''
+        if self.profiler is None:
+            raise RuntimeError("Profiling is not enabled. Pass profiler=True when creating AngleReflectance.")
+
+        report = self.profiler.report(sort_by=sort_by, per_file=per_file)
+        if filepath is not None:
+            self.profiler.write_report(filepath, sort_by=sort_by, per_file=per_file)
+        if stats_filepath is not None:
+            self.profiler.dump_stats(stats_filepath)
+        return report
@@ -0,0 +1,212 @@
+import sys
+import argparse
+import logging
+
+
+def run_gui(args):
+    from ars_gui import SpectrometerGUI, DummySpectrometer
+
+    if args.dummy:
+        spectrometer = DummySpectrometer()
+    else:
+        from ars_controller import AngleResolvedSpectrometer
+        spectrometer = AngleResolvedSpectrometer(serial_port=args.port, ready_timeout=args.ready_timeout, transcript=args.record)
+    app = SpectrometerGUI(spectrometer)
+    app.mainloop()
+
+
+def run_console(args):
+    from ars_controller import AngleResolvedSpectrometer
+
+    spectrometer = AngleResolvedSpectrometer(serial_port=args.port, ready_timeout=args.ready_timeout, transcript=args.record)
+    spectrometer.main_loop()
+
+
+def run_analysis(args):
+    from ars_analysis import rename_files, AngleReflectance
+    from ars_quality import parse_flags
+
+    if args.rename:
+        rename_files(args.data_dir, ref_id=args.ref_id, sample_id=args.sample_id)
+    library = None
+    if args.reference_library:
+        from ars_references import ReferenceLibrary
+        library = ReferenceLibrary(args.reference_library, max_age=args.max_reference_age * 3600 if args.max_reference_age else None)
+    angle_data = AngleReflectance(args.data_dir, reference_axis=tuple(args.reference_axis), profiler=args.profile or None, reference_tolerance=args.reference_tolerance,
+                                  quality_mask=parse_flags(args.exclude_flagged), reference_library=library, polarization=args.polarization)
+    angle_data.identifier = args.identifier
+    angle_data.calculate_reflectivity(time_normalised=args.time_normalised)
+    if args.truncate:
+        angle_data.truncate_data(region=tuple(args.truncate))
+    angle_data.export_data()
+    if args.plot:
+        angle_data.plot_reflectance(xregion=tuple(args.truncate) if args.truncate else None, save_plot=True)
+    if args.map:
+        angle_data.plot_reflectance_map(xregion=tuple(args.truncate) if args.truncate else None, save_plot=True)
+    if args.kspace:
+        angle_data.plot_reflectance_kspace(save_plot=True)
+    if args.profile:
+        print(angle_data.profile_report(per_file=True))
+
+
+def run_serve(args):
+    from ars_server import ControlServer
+    from ars_controller import AngleResolvedSpectrometer
+
+    if args.simulate:
+        from ars_simulator import SimulatedController
+        simulator = SimulatedController()
+        simulator.start()
+        args.port = simulator.port
+    spectrometer = AngleResolvedSpectrometer(serial_port=args.port, ready_timeout=args.ready_timeout, ready_ping_after=0 if args.simulate else 2.5,
+                                             transcript=args.record)
+    ControlServer(spectrometer, port=args.listen).serve_forever()
+
+
+def run_references(args):
+    from ars_references import ReferenceLibrary
+
+    library = ReferenceLibrary(args.library)
+    for source in args.add:
+        entry = library.add_scan(source, polarization=args.polarization, label=args.label)
+        print(f"Added {entry['n_spectra']} references from {source} as {entry['file']}")
+    for entry in library.entries:
+        print(f"{entry['file']}  {entry['label']}  polarization {entry['polarization']}  {entry['n_spectra']} spectra")
+
+
+def run_convert(args):
+    from ars_container import convert_folder, export_folder
+
+    if args.export:
+        print(f"Spectra written to {export_folder(args.source, args.export)}")
+    else:
+        print(f"Scan container written to {convert_folder(args.source, args.output)}")
+
+
+def run_queue(args):
+    import queue
+    from ars_recipes import load_recipe, RecipeQueue
+    from ars_worker import MotionWorker
+    from ars_estimator import ScanEstimator
+
+    recipes = [load_recipe(filepath) for filepath in args.recipes]
+    if args.simulate:
+        from ars_simulator import SimulatedController
+        simulator = SimulatedController()
+        simulator.start()
+        args.port = simulator.port
+
+    from ars_controller import AngleResolvedSpectrometer
+    spectrometer = AngleResolvedSpectrometer(serial_port=args.port, ready_timeout=args.ready_timeout, ready_ping_after=0 if args.simulate else 2.5,
+                                             transcript=args.record)
+    recipe_queue = RecipeQueue(recipes, policy=args.policy, estimator=ScanEstimator(spectrometer), report_path=args.report)
+
+    worker = MotionWorker(spectrometer)
+    worker.start()
+    worker.submit('recipe queue', recipe_queue.run)
+    while True:
+        try:
+            kind, payload = worker.events.get(timeout=1)
+        except queue.Empty:
+            continue
+        if kind == 'recipe_started':
+            print(f"[{payload['index'] + 1}/{payload['total']}] {payload['name']}")
+        elif kind == 'homed':
+            saved = f", {payload['saved']:.1f} s saved" if payload['saved'] else ''
+            print(f"    homed ({payload['mode']}) in {payload['elapsed']:.1f} s{saved}")
+        elif kind == 'swap_sample':
+            if args.simulate:
+                print(f"    {payload['previous']} pass done, continuing with the {payload['scan_pass']} pass")
+            else:
+                input(f"    {payload['previous']} pass done. Swap in the {payload['scan_pass']} for {payload['name']} and press Enter to continue...")
+            worker.continue_scan()
+        elif kind == 'recipe_finished':
+            print(f"    {payload['status']}{': ' + payload['error'] if payload['error'] else ''}")
+        elif kind == 'error':
+            print(payload['traceback'])
+        if kind in ('finished', 'aborted', 'error'):
+            break
+    worker.stop()
+    print(recipe_queue.summary())
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Angle resolved spectrometer control and analysis.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    gui = subparsers.add_parser('gui', help="Start the control GUI.")
+    gui.add_argument('--port', default='COM9', help="Serial port of the motor controller.")
+    gui.add_argument('--ready-timeout', type=float, default=5.0, help="Seconds to wait for the controller to boot.")
+    gui.add_argument('--dummy', action='store_true', help="Use the dummy spectrometer instead of the hardware.")
+    gui.add_argument('--record', default=None, metavar='TRANSCRIPT', help="Record the serial traffic to a transcript file (see ars_transcript).")
+    gui.set_defaults(func=run_gui)
+
+    console = subparsers.add_parser('console', help="Start the interactive command loop.")
+    console.add_argument('--port', default='COM9', help="Serial port of the motor controller.")
+    console.add_argument('--ready-timeout', type=float, default=5.0, help="Seconds to wait for the controller to boot.")
+    console.add_argument('--record', default=None, metavar='TRANSCRIPT', help="Record the serial traffic to a transcript file (see ars_transcript).")
+    console.set_defaults(func=run_console)
+
+    serve = subparsers.add_parser('serve', help="Serve JSON-RPC control on a local socket for scripts.")
+    serve.add_argument('--port', default='COM9', help="Serial port of the motor controller.")
+    serve.add_argument('--ready-timeout', type=float, default=5.0, help="Seconds to wait for the controller to boot.")
+    serve.add_argument('--listen', type=int, default=8765, help="TCP port to listen on (localhost only).")
+    serve.add_argument('--simulate', action='store_true', help="Run against a simulated controller.")
+    serve.add_argument('--record', default=None, metavar='TRANSCRIPT', help="Record the serial traffic to a transcript file (see ars_transcript).")
+    serve.set_defaults(func=run_serve)
+
+    analyse = subparsers.add_parser('analyse', help="Calculate and export the reflectance of a data folder.")
+    analyse.add_argument('data_dir', help="Data folder, or a scan container (.arsc).")
+    analyse.add_argument('--identifier', default=None, help="Name used for the exported files.")
+    analyse.add_argument('--reference-axis', type=int, nargs=2, default=(1, 1))
+    analyse.add_argument('--reference-tolerance', type=float, default=0, help="Use the nearest reference within this many degrees (fly scans).")
+    analyse.add_argument('--exclude-flagged', nargs='+', default=[], choices=('saturated', 'low_signal', 'low_snr', 'not_finite'),
+                         help="Leave out angles with these quality flags (from quality_flags.csv, see ars_quality).")
+    analyse.add_argument('--reference-library', default=None, metavar='LIBRARY', help="Take missing references from this reference library (see references).")
+    analyse.add_argument('--max-reference-age', type=float, default=None, metavar='HOURS', help="Only use library references taken within this many hours of the sample.")
+    analyse.add_argument('--polarization', default=None, help="Polarization of the library references to use.")
+    analyse.add_argument('--rename', action='store_true', help="Rename the files from scan_list.json first.")
+    analyse.add_argument('--ref-id', default='reference')
+    analyse.add_argument('--sample-id', default='sample')
+    analyse.add_argument('--time-normalised', action='store_true')
+    analyse.add_argument('--truncate', type=float, nargs=2, default=None, metavar=('MIN', 'MAX'))
+    analyse.add_argument('--plot', action='store_true')
+    analyse.add_argument('--kspace', action='store_true', help="Plot reflectance against in-plane wavevector and energy.")
+    analyse.add_argument('--map', action='store_true', help="Plot reflectance against wavelength and angle (handles non-uniform angle steps).")
+    analyse.add_argument('--profile', action='store_true', help="Print a stage profile after the run.")
+    analyse.set_defaults(func=run_analysis)
+
+    convert = subparsers.add_parser('convert', help="Pack a folder of .txt spectra into a scan container (.arsc), or unpack one.")
+    convert.add_argument('source', help="Data folder, or a .arsc file with --export.")
+    convert.add_argument('--output', default=None, help="Container path (default: <folder>/scan.arsc).")
+    convert.add_argument('--export', default=None, metavar='FOLDER', help="Write the spectra of the container source to FOLDER as .txt files.")
+    convert.set_defaults(func=run_convert)
+
+    references = subparsers.add_parser('references', help="Add reference scans to a reference library, and list it.")
+    references.add_argument('library', help="Reference library folder (created if needed).")
+    references.add_argument('--add', nargs='+', default=[], metavar='SOURCE', help="Data folders or .arsc files whose references to add.")
+    references.add_argument('--polarization', default=None)
+    references.add_argument('--label', default=None)
+    references.set_defaults(func=run_references)
+
+    recipe_queue = subparsers.add_parser('queue', help="Run scan recipe files back to back.")
+    recipe_queue.add_argument('recipes', nargs='+', help="Recipe files (.json, .yaml).")
+    recipe_queue.add_argument('--port', default='COM9', help="Serial port of the motor controller.")
+    recipe_queue.add_argument('--ready-timeout', type=float, default=5.0, help="Seconds to wait for the controller to boot.")
+    recipe_queue.add_argument('--policy', choices=('fail_fast', 'skip'), default='skip', help="What to do when a recipe fails.")
+    recipe_queue.add_argument('--report', default=None, help="Json file updated with the progress after every recipe.")
+    recipe_queue.add_argument('--simulate', action='store_true', help="Run against a simulated controller.")
+    recipe_queue.add_argument('--record', default=None, metavar='TRANSCRIPT', help="Record the serial traffic to a transcript file (see ars_transcript).")
+    recipe_queue.set_defaults(func=run_queue)
+
+    return parser
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import numpy as np
+from ars_analysis import ReflectionFile
+
+
+MAGIC = b'ARSCAN01'
+DATA_TYPES = ('sample', 'reference', 'dark')
+VERSION = 3
+SOURCE_LENGTH = 255 # bytes, the longest file name most file systems allow
+
+
+class ScanContainer:
+    '''Single-file, append-only store for all the spectra of a scan (extension .arsc).
+
+    Layout: an 8 byte magic, the length of a json header (uint64), the json header (format version, number of wavelengths, spectrum
+    dtype, scan recipe, creation time), the shared wavelength axis (float64), then fixed-size records, one per spectrum:
+
+        x, y, z           angles (deg), NaN for darks without angles; z (sample rotation) is NaN for points without one, and
+                          absent from version 1 containers
+        integration_time  s
+        timestamp         acquisition time (time.time)
+        repeat            repeat index at these angles
+        data_type         index into DATA_TYPES
+        source            original file name (UTF-8, up to SOURCE_LENGTH bytes; 64 in version 1 and 2 containers), if
+                          converted from a .txt file
+        intensity         the spectrum
+
+    Records are only ever appended, each in one write, so a reader (another process, or the same one) can open the file while it is
+    being written and sees every complete record; call refresh() to pick up new ones. The records are memory mapped, so opening a large
+    scan reads nothing until spectra are used.
+
+        with ScanContainer.create('scan.arsc', wavelength, recipe=recipe.to_dict()) as container:
+            container.append(intensity, angles=(20, 20), integration_time=0.5)
+        records = ScanContainer('scan.arsc').records  # numpy structured array'''
+
+    def __init__(self, filepath, mode='r'):
+        if mode not in ('r', 'a'):
+            raise ValueError("mode must be 'r' or 'a'.")
+        self.filepath = filepath
+        self.mode = mode
+        with open(filepath, 'rb') as file:
+            magic = file.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError(f"{filepath} is not a scan container.")
+            header_length = int(np.frombuffer(file.read(8), dtype='<u8')[0])
+            self.header = json.loads(file.read(header_length).decode())
+            n_wavelengths = self.header['n_wavelengths']
+            self.wavelength = np.frombuffer(file.read(8 * n_wavelengths), dtype='<f8').copy()
+        self.data_offset = len(MAGIC) + 8 + header_length + 8 * n_wavelengths
+        self.record_dtype = self.make_record_dtype(n_wavelengths, self.header['dtype'], self.header.get('version', 1))
+        self._records = None
+        self._repeats = {}
+        self._file = open(filepath, 'ab') if mode == 'a' else None
+        if mode == 'a':
+            for record in self.records:
+                key = (int(record['data_type']), record_angles(record))
+                self._repeats[key] = max(self._repeats.get(key, 0), int(record['repeat']) + 1)
+
+    @staticmethod
+    def make_record_dtype(n_wavelengths, dtype='<f8', version=VERSION):
+        angles = [('x', '<f8'), ('y', '<f8'), ('z', '<f8')] if version >= 2 else [('x', '<f8'), ('y', '<f8')]
+        source_length = SOURCE_LENGTH if version >= 3 else 64
+        return np.dtype(angles + [('integration_time', '<f8'), ('timestamp', '<f8'), ('repeat', '<i4'),
+                         ('data_type', '<i4'), ('source', f'S{source_length}'), ('intensity', dtype, (n_wavelengths,))])
+
+    @classmethod
+    def create(cls, filepath, wavelength, recipe=None, dtype='<f8'):
+        '''Creates a new container for spectra on the given wavelength axis and opens it for appending.'''
+        wavelength = np.asarray(wavelength, dtype='<f8')
+        header = {'version': VERSION, 'n_wavelengths': len(wavelength), 'dtype': np.dtype(dtype).str, 'recipe': recipe, 'created': time.time()}
+        header_bytes = json.dumps(header).encode()
+        header_bytes += b' ' * (-(len(MAGIC) + 8 + len(header_bytes)) % 8) # keeps the records 8 byte aligned
+        with open(filepath, 'wb') as file:
+            file.write(MAGIC)
+            file.write(np.array([len(header_bytes)], dtype='<u8').tobytes())
+            file.write(header_bytes)
+            file.write(wavelength.tobytes())
+        return cls(filepath, mode='a')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __repr__(self):
+        return f"ScanContainer: {self.filepath}: {len(self)} spectra"
+
+    @property
+    def recipe(self):
+        return self.header.get('recipe')
+
+    @property
+    def records(self):
+        '''Memory mapped structured array of the complete records.'''
+        if self._records is None:
+            self.refresh()
+        return self._records
+
+    def refresh(self):
+        '''Maps the records written so far, including those appended by another process since the last refresh.'''
+        n_records = (os.path.getsize(self.filepath) - self.data_offset) // self.record_dtype.itemsize
+        if n_records <= 0:
+            self._records = np.zeros(0, dtype=self.record_dtype)
+        else:
+            self._records = np.memmap(self.filepath, dtype=self.record_dtype, mode='r', offset=self.data_offset, shape=(n_records,))
+        return len(self._records)
+
+    def append(self, intensity, angles=None, data_type='sample', integration_time=0.0, timestamp=None, repeat=None, source=''):
+        '''Appends one spectrum. repeat defaults to the number of spectra already stored with the same data type and angles.'''
+        if self._file is None:
+            raise ValueError("Container is open read only.")
+        intensity = np.asarray(intensity)
+        if intensity.shape != (self.header['n_wavelengths'],):
+            raise ValueError(f"Spectrum has {intensity.shape} points, the container's wavelength axis has {self.header['n_wavelengths']}.")
+        source = os.path.basename(source).encode('utf-8')
+        if len(source) > self.record_dtype['source'].itemsize:
+            raise ValueError(f"Source name {source.decode('utf-8')} is {len(source)} bytes long, {self.filepath} stores at most "
+                             f"{self.record_dtype['source'].itemsize}.")
+        angles = None if angles is None else tuple(float(angle) for angle in angles)
+        if angles is not None and len(angles) > 2 and 'z' not in self.record_dtype.names:
+            raise ValueError(f"{self.filepath} is a version 1 container, which stores two angles.")
+        type_index = DATA_TYPES.index(data_type)
+        key = (type_index, angles)
+        if repeat is None:
+            repeat = self._repeats.get(key, 0)
+        self._repeats[key] = max(self._repeats.get(key, 0), repeat + 1)
+
+        record = np.zeros(1, dtype=self.record_dtype)
+        record['x'], record['y'] = (np.nan, np.nan) if angles is None else angles[:2]
+        if 'z' in self.record_dtype.names:
+            record['z'] = angles[2] if angles is not None and len(angles) > 2 else np.nan
+        record['integration_time'] = integration_time
+        record['timestamp'] = time.time() if timestamp is None else timestamp
+        record['repeat'] = repeat
+        record['data_type'] = type_index
+        record['source'] = source
+        record['intensity'] = intensity
+        self._file.write(record.tobytes())
+        self._file.flush()
+        self._records = None # remapped on next access
+        return (self._file.tell() - self.data_offset) // self.record_dtype.itemsize - 1
+
+    def append_file(self, filepath, angles=None, repeat=None, data_type=None):
+        '''Appends a spectrometer .txt file. The data type and, unless given, the angles are parsed from the file name, so files that
+        have not been renamed yet (e.g. while the scan is running) need angles.'''
+        filename = os.path.basename(filepath)
+        if angles is None:
+            spectrum = ReflectionFile(filepath)
+            header, data = spectrum.header, spectrum.data
+            angles, data_type = spectrum.angles, data_type or spectrum.data_type
+        else:
+            header, data = ReflectionFile.read_file(filepath)
+        if data_type is None:
+            basename = filename.split('_')[0].lower()
+            data_type = 'dark' if 'dark' in basename else 'reference' if 'ref' in basename else 'sample'
+        if not np.allclose(data[:, 0], self.wavelength):
+            raise ValueError(f"Wavelength axis of {filename} does not match the container.")
+        return self.append(data[:, 1], angles=angles, data_type=data_type, integration_time=float(header.get('Integration Time (sec)', 0)),
+                           timestamp=os.path.getmtime(filepath), repeat=repeat, source=filename)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def spectra(self):
+        '''ContainerSpectrum objects for every record, for use in place of ReflectionFile.'''
+        return [ContainerSpectrum(self, index) for index in range(len(self.records))]
+
+
+def record_angles(record):
+    '''(x, y) or (x, y, z) of a record, None for a dark without angles.'''
+    if np.isnan(record['x']):
+        return None
+    if 'z' in record.dtype.names and not np.isnan(record['z']):
+        return (float(record['x']), float(record['y']), float(record['z']))
+    return (float(record['x']), float(record['y']))
+
+
+class ContainerSpectrum:
+    '''One record of a ScanContainer, with the attributes and load/release methods of ReflectionFile, so AngleReflectance can
+    stream containers and .txt folders alike. Only load() reads the spectrum from the memory map.'''
+
+    def __init__(self, container, index, profiler=None):
+        record = container.records[index]
+        self.container = container
+        self.index = index
+        self.profiler = profiler
+        self.filepath = container.filepath
+        source = record['source'].decode('utf-8', errors='replace') # older containers may have cut a name mid-character
+        self.filename = source or f"{os.path.basename(container.filepath)}[{index}]"
+        self.data_type = DATA_TYPES[int(record['data_type'])]
+        self.angles = record_angles(record)
+        self.repeat = int(record['repeat'])
+        self.timestamp = float(record['timestamp'])
+        self.header = {'Integration Time (sec)': str(float(record['integration_time']))}
+        self.data = None
+
+    def load(self):
+        if self.profiler is None:
+            self.load_record()
+        else:
+            with self.profiler.stage('file', label=self.filename):
+                self.profiler.add_bytes_read(self.container.record_dtype.itemsize)
+                self.load_record()
+
+    def load_record(self):
+        intensity = np.array(self.container.records[self.index]['intensity'], dtype=float)
+        self.data = np.column_stack((self.container.wavelength, intensity))
+
+    def release(self):
+        self.data = None
+
+    def __repr__(self):
+        return f"ContainerSpectrum: {self.data_type}:{self.angles}:{self.filename}"
+
+    def info(self):
+        return {'data_type': self.data_type, 'angles': self.angles, 'filename': self.filename, 'integration_time': self.header.get('Integration Time (sec)', None)}
+
+    @property
+    def integration_time(self):
+        return float(self.header.get('Integration Time (sec)', 0))
+
+
+def convert_folder(data_dir, filepath=None, recipe=None):
+    '''Converts a folder of renamed spectrometer .txt files into a scan container (data_dir/scan.arsc by default). Files are appended
+    in the order they were written; the recipe defaults to data_dir/recipe.json if there is one. Returns the container path.'''
+    files = [os.path.join(data_dir, file) for file in os.listdir(data_dir) if file.endswith('.txt')]
+    if not files:
+        raise ValueError(f"No .txt files in {data_dir}.")
+    files.sort(key=os.path.getmtime)
+    if filepath is None:
+        filepath = os.path.join(data_dir, 'scan.arsc')
+    recipe_path = os.path.join(data_dir, 'recipe.json')
+    if recipe is None and os.path.exists(recipe_path):
+        with open(recipe_path, 'r') as file:
+            recipe = json.load(file)
+
+    _, data = ReflectionFile.read_file(files[0])
+    with ScanContainer.create(filepath, data[:, 0], recipe=recipe) as container:
+        for file in files:
+            container.append_file(file)
+    return filepath
+
+
+def export_folder(filepath, data_dir):
+    '''Writes the spectra of a container back out as .txt files in the layout of the spectrometer software, named
+    <data_type>_<index>_<x>,<y>[,<z>].txt (darks without angles as dark_<index>.txt).'''
+    container = ScanContainer(filepath)
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    for spectrum in container.spectra():
+        spectrum.load()
+        angles = '' if spectrum.angles is None else '_' + ','.join(str(angle) for angle in spectrum.angles)
+        with open(os.path.join(data_dir, f"{spectrum.data_type}_{spectrum.index}{angles}.txt"), 'w') as file:
+            file.write(f"Integration Time (sec): {spectrum.integration_time}\n>>>>>Begin Spectral Data<<<<<\n")
+            for wavelength, intensity in spectrum.data:
+                file.write(f"{wavelength}\t{intensity}\n")
+    return data_dir
@@ -0,0 +1,497 @@
+import os
+import re
+import time
+import numpy as np
+from ars_position import PositionState, PositionMismatch, user_data_dir, rig_state_name
+
+# // initial cal: X motor 0 angle: -10720 steps from limit switch
+# // initial cal: X 10 deg, 9770 steps from vertical
+# // initial cal: X 170 deg, -9680 steps from vertical
+
+# // Initial cal: Y motor 0 angle: -10252 steps from limit switch
+# // initial cal: Y 170 deg, 9680 steps from vertical
+# // initial cal: Y 10 deg, -9680 steps from vertical
+# (9680*2)/160
+
+class AngleResolvedSpectrometer:
+
+    def __init__(self, serial_port='COM4', working_dir=None, ready_timeout=5.0, ready_ping_after=2.5, position_tolerance=2, check_every=None, check_interval=None,
+                 position_journal=True, transport=None, transcript=None, z_steps_per_degree=600/90,
+                 state_dir=None):
+        '''transport is an already open serial-like object (e.g. ars_transcript.ReplaySerial) to use instead of opening serial_port.
+        transcript is a path to record every byte exchanged with the controller to (see ars_transcript.RecordingSerial).
+        z_steps_per_degree is the calibration of the sample rotation; the default is the ~600 steps/90 deg noted for the rig.
+        state_dir is where the state kept between sessions (position journal, motion timings) goes, by default user_data_dir(); the
+        files are named after the serial port (state_name), so each rig has its own.'''
+
+        self.flag_dict = {'S0': 'ok',
+                          'R1': 'motors running',
+                          'F0': 'invalid command',
+                          '#CF': 'end of response'
+        }
+
+        if transport is None:
+            import serial # imported here so that the module can be used without pyserial, e.g. for planning and simulation
+            transport = serial.Serial(serial_port, 9600)
+        if transcript is not None:
+            from ars_transcript import RecordingSerial
+            transport = RecordingSerial(transport, transcript)
+        self.uno_serial = transport
+        print(self.wait_until_ready(ready_timeout, ready_ping_after))
+
+        if working_dir is None:
+            working_dir = os.path.dirname(os.path.abspath(__file__))
+        self.working_dir = working_dir
+        self.state_dir = state_dir if state_dir is not None else user_data_dir()
+        self.state_name = rig_state_name(serial_port)
+
+        # Calibration data (based on your provided calibration info)
+        self.steps_per_degree = {
+            'X': (9584)/180,  # Steps per degree for X axis
+            'Y': (9584)/180,  # Steps per degree for Y axis
+            'Z': z_steps_per_degree,  # Sample rotation, ~600 steps/90 deg unless calibrated
+        }
+        self.z_steps = 0 # Z has no limit switch, so its position is counted from where it was at connection
+
+        # Dead-reckoned position, checked against the controller every check_every moves / check_interval seconds and after errors.
+        # Journaled to state_dir so that the next session knows where the arms were left (position_journal=False to disable)
+        journal_path = os.path.join(self.state_dir, f'position_state_{self.state_name}.json') if position_journal else None
+        self.position = PositionState(self.steps_to_angle, tolerance=position_tolerance, check_every=check_every, check_interval=check_interval, journal_path=journal_path)
+        self.approach_margin = 2 # degrees above the soft limit to move to before a fast approach to the limit switches
+
+        self.x_home = -4673
+        self.y_home = -5006
+
+        self.soft_limit = 10 # degrees
+        # ive changed things
+
+        self.hard_limits = {
+            # 'X': ((self.angle_to_steps("X", 15)), 10720),
+            'X': (self.angle_to_steps("X", self.soft_limit), self.angle_to_steps("X", 90)),
+            'Y': (self.angle_to_steps("Y", self.soft_limit), self.angle_to_steps("Y", 90)),
+        }
+
+        self.measure_mode = 'specular'
+        self.measure_mode = 'variable'
+        
+        self.commandDict = {
+            'wait': self.wait_for_motors,
+            'home': self.home_motors,
+            'fasthome': self.home,
+            'a': self.go_to_angle,
+            'wai': self.get_current_position,
+            'verify': self.verify_position,
+            'basic': self.basic_scan,
+            'debug': self.debug,
+            # 'pos': self.get_motor_positions,
+            'mox': self.move_x,
+            'moy': self.move_y,
+            'setpos': self.set_motor_positions,
+            'a' : self.go_to_angle,
+            'z' : self.move_z,
+        }
+
+    # def __initialise(self):
+        # print("Welcome to ")
+
+    @property
+    def current_position(self):
+        '''Position in steps, from the dead-reckoned state. No serial traffic.'''
+        return self.position.steps
+
+    @current_position.setter
+    def current_position(self, steps):
+        self.position.set(steps, trusted=self.position.trusted)
+
+    @property
+    def current_angle(self):
+        '''Position in degrees, from the dead-reckoned state. No serial traffic.'''
+        return self.position.angles
+
+    @current_angle.setter
+    def current_angle(self, angles):
+        self.position.set({axis: self.angle_to_steps(axis, angles[axis]) for axis in self.position.axes}, angles, trusted=self.position.trusted)
+
+    def wait_until_ready(self, timeout=5.0, ping_after=2.5):
+        '''Waits for the controller to boot after the port is opened (opening the port resets the Arduino). Returns as soon as the boot message
+        arrives. If nothing has arrived after ping_after seconds the controller is polled with isrun until it answers with a known flag.'''
+        start = time.perf_counter()
+        next_ping = start + ping_after
+        while True:
+            now = time.perf_counter()
+            response = self.read_command_from_uno()
+            if response:
+                return response
+            if now - start > timeout:
+                raise TimeoutError(f"Controller did not respond within {timeout} s.")
+            if now >= next_ping:
+                self.uno_serial.write('isrun\n'.encode())
+                next_ping = now + 0.25
+            time.sleep(0.02)
+    
+    def debug(self):
+        print("Debugging...")
+        breakpoint()
+
+    def move_x(self, steps):
+        self.position.begin_move()
+        try:
+            self.send_command_to_UNO('mox{}'.format(steps))
+            time.sleep(0.1)
+            self.wait_for_motors()
+        except BaseException as e: # including KeyboardInterrupt: the arms stopped somewhere unknown
+            self.position.invalidate(str(e) or type(e).__name__)
+            raise
+        self.position.moved('X', int(float(steps)))
+
+    def move_y(self, steps):
+        self.position.begin_move()
+        try:
+            self.send_command_to_UNO('moy{}'.format(steps))
+            time.sleep(0.1)
+            self.wait_for_motors()
+        except BaseException as e: # including KeyboardInterrupt: the arms stopped somewhere unknown
+            self.position.invalidate(str(e) or type(e).__name__)
+            raise
+        self.position.moved('Y', int(float(steps)))
+
+    def move_z(self, steps):
+        self.send_command_to_UNO('moz{}'.format(steps))
+        time.sleep(0.1)
+        self.wait_for_motors()
+        self.z_steps += int(float(steps))
+
+    def go_to_z(self, angle):
+        '''Rotates the sample (Z axis) to angle, relative to its position at connection (see z_steps).'''
+        steps = self.angle_to_steps('Z', float(angle)) - self.z_steps
+        if steps:
+            self.move_z(steps)
+
+    @property
+    def z_angle(self):
+        return self.steps_to_angle('Z', self.z_steps)
+
+    def process_coms(self, command):
+        cmd = command.split(' ')
+
+        if len(cmd) > 1:
+            command = cmd[0]
+            args = cmd[1:]
+            if command in self.commandDict:
+                return self.commandDict[command](*args)
+            else:
+                print('Invalid command')
+                return
+
+        else:
+            if command in self.commandDict:
+                return self.commandDict[command]()
+            else:
+                print('Invalid command')
+                return 
+
+
+    def home_partial(self):
+        '''Used for calibrating the setup. Homes the motors to the limit switches and leaves them there.'''
+        self.send_command_to_UNO('home')
+        time.sleep(0.1)
+        responses = self.read_from_serial_until()
+        print(responses)
+
+
+    def home_motors(self, soft_limit=None):
+        '''Homing protocol for the motors. Moves the motors to the limit switches and then moves them back to the soft limit.'''
+        if soft_limit is None:
+            soft_limit = self.soft_limit
+            
+        # print("Homing motors...")
+
+        self.position.invalidate('homing')
+        self.send_command_to_UNO('home')
+        time.sleep(0.1)
+        responses = self.read_from_serial_until()
+        # print(responses)
+
+        # calculate steps from zero to soft limit
+        steps_soft_limit_x = self.angle_to_steps('X', soft_limit)
+        steps_soft_limit_y = self.angle_to_steps('Y', soft_limit)
+
+        # calculate steps from limit switch to soft limit 
+        steps_to_soft_home_x = self.x_home+steps_soft_limit_x
+        steps_to_soft_home_y = self.y_home+steps_soft_limit_y
+
+        # self.wait_for_motors()
+
+        # move from limit switch (hard limit) to soft limit 
+        self.send_command_to_UNO('mox{}'.format(steps_to_soft_home_x))
+        self.send_command_to_UNO('moy{}'.format(steps_to_soft_home_y))
+
+        self.wait_for_motors()
+
+        # set motor positions in controller to soft limit (in steps)
+        self.set_motor_positions(steps_soft_limit_x, steps_soft_limit_y, 0)
+
+        # set current position and angle to soft limit - necessary for correctly calculating relative movements
+        self.position.set({'X': steps_soft_limit_x, 'Y': steps_soft_limit_y}, {'X': soft_limit, 'Y': soft_limit})
+
+        print("Motors homed to {} degrees.".format(soft_limit))
+
+    def home(self, mode='auto', soft_limit=None):
+        '''Homes the arms as quickly as the position state allows and returns {'mode', 'elapsed', 'saved'} (s). Modes:
+            full       home_motors: to the limit switches and back to the soft limit
+            verify     one pos check; if it agrees with the trusted position, move straight to the soft limit without homing
+            approach   from the journaled position of the last session: move to just above the soft limit at full speed, then home
+                       from there, so the slow search for the switches is short
+            auto       verify if the position is trusted, approach if the last session left a clean journal, otherwise full
+        Cold starts without a journal and anything after an error use full homing, and verify falls back to full homing on a mismatch.
+        saved is the time saved compared with the last full homing, None until one has been timed.'''
+        if soft_limit is None:
+            soft_limit = self.soft_limit
+        journaled = self.position.journaled
+        self.position.journaled = None # only valid for the first homing of the session
+        if mode == 'auto':
+            if self.position.trusted and not self.position.in_motion:
+                mode = 'verify'
+            elif journaled is not None and journaled.get('trusted') and not self.position.last_error:
+                mode = 'approach'
+            else:
+                mode = 'full'
+        if mode not in ('full', 'verify', 'approach'):
+            raise ValueError(f"Unknown homing mode '{mode}'.")
+
+        start = time.perf_counter()
+        if mode == 'verify':
+            try:
+                self.verify_position()
+                self.go_to_angle(soft_limit, soft_limit)
+            except PositionMismatch as e:
+                print(f"{e} Falling back to full homing.")
+                mode = 'full'
+                self.home_motors(soft_limit)
+        elif mode == 'approach':
+            if journaled is None:
+                raise ValueError("No journaled position to approach from.")
+            steps = journaled['steps']
+            # the controller counts from 0 after the reset on connecting, so restore the journaled counts first
+            self.set_motor_positions(steps['X'], steps['Y'], 0)
+            self.position.set(steps, journaled.get('angles'))
+            approach_angle = soft_limit + self.approach_margin
+            self.go_to_angle(approach_angle, approach_angle)
+            self.home_motors(soft_limit)
+        else:
+            self.home_motors(soft_limit)
+        elapsed = time.perf_counter() - start
+
+        if mode == 'full':
+            self.position.full_home_time = elapsed
+            self.position.save()
+            saved = 0.0
+        else:
+            saved = None if self.position.full_home_time is None else self.position.full_home_time - elapsed
+        return {'mode': mode, 'elapsed': elapsed, 'saved': saved}
+
+    def set_motor_positions(self, x_pos, y_pos, z_pos):
+        self.send_command_to_UNO('setpos{},{},{}'.format(x_pos, y_pos, z_pos))
+        flag = self.wait_for_flag()
+        if flag == 'S0':
+            self.position.set({'X': int(float(x_pos)), 'Y': int(float(y_pos))}, trusted=self.position.trusted)
+            print("Motor positions set successfully.")
+
+
+    def angle_to_steps(self, axis, angle, motor_sign=1):
+        """Convert angle to steps for the given axis."""
+        steps = int(angle * self.steps_per_degree[axis]) * motor_sign #flip the sign to match the motor direction
+        return steps
+
+    def steps_to_angle(self, axis, steps):
+        """Convert steps to angle for the given axis."""
+        angle = steps / self.steps_per_degree[axis]
+        return angle
+
+    def go_to_angle(self, x_angle, y_angle):
+        """Move both motors to the given angle (specular reflectance mode)."""
+        try:
+            x_angle = float(x_angle)
+            y_angle = float(y_angle)
+        except ValueError:
+            print("Error: Invalid angle value.")
+
+        # Convert angle to steps for both motors
+        x_target = self.angle_to_steps('X', x_angle)
+        y_target = self.angle_to_steps('Y', y_angle)
+
+        if x_target > self.hard_limits['X'][1] or x_target < self.hard_limits['X'][0]:
+            print("Error: X angle exceeds hard limits.")
+            return
+        if y_target > self.hard_limits['Y'][1] or y_target < self.hard_limits['Y'][0]:
+            print("Error: Y angle exceeds hard limits.")
+            return
+        
+        # Relative moves are only as good as the dead-reckoned position, so check it against the controller when due
+        if self.position.due():
+            self.verify_position()
+
+        # Calculate relative movement from current position
+        x_move_steps = x_target - self.current_position['X']
+        y_move_steps = y_target - self.current_position['Y']
+
+        # Send commands to motors
+        print("sending command")
+        self.position.begin_move()
+        try:
+            if x_move_steps != 0:
+                self.send_command_to_UNO('mox{}'.format(x_move_steps))
+            if y_move_steps != 0:
+                self.send_command_to_UNO('moy{}'.format(y_move_steps))
+
+            # Wait for motors to finish moving
+            self.wait_for_motors()
+        except BaseException as e: # including KeyboardInterrupt: the arms stopped somewhere unknown
+            self.position.invalidate(str(e) or type(e).__name__)
+            raise
+
+        # Update current positions and angles
+        self.position.commanded({'X': x_target, 'Y': y_target}, {'X': x_angle, 'Y': y_angle})
+
+        # print(f"Motors moved to {angle} degrees (specular).")
+        print(f"Motors moved to X: {x_angle} degrees, Y: {y_angle} degrees.")
+
+    def wait_for_motors(self, delay=0.2):
+        """Wait until the motors are done moving."""
+        while True:
+            self.send_command_to_UNO('isrun')
+            time.sleep(delay)
+            response = self.wait_for_flag()
+            if response == "S0":
+                break
+            time.sleep(delay)
+
+    def send_command_to_UNO(self, command):
+        """Send a command to the Arduino."""
+        self.uno_serial.write('{}\n'.format(command).encode())
+        time.sleep(0.1)
+
+    def read_command_from_uno(self):
+        """Read response from Arduino."""
+        response = ''
+        while self.uno_serial.in_waiting > 0:
+            response += self.uno_serial.readline().decode()
+            # print(response)
+        
+        return response.strip()
+    
+    def wait_for_flag(self):
+        """Wait for a specific flag to be received."""
+        while True:
+            response = self.read_command_from_uno()
+            response = response.splitlines()
+            for res in response:
+                if res in self.flag_dict.keys():
+                    return res
+            time.sleep(0.1)
+
+    def read_from_serial_until(self, end_flag='#CF', report=True):
+        """Read from serial until end flag is encountered. Responses are printed if report is True."""
+        responses = []
+        while True:
+            # print("Reading from serial...")
+            response = self.read_command_from_uno()
+            if response == '':
+                time.sleep(0.01)
+                continue
+            if end_flag in response:
+                # print("End flag found.")
+                if report:
+                    print(response)
+                response = response[:-len('\r\n'+end_flag)]
+                responses.append(response)
+                return responses
+            
+            responses.append(response)
+            if report:
+                print(response)
+
+    def send_and_receive(self, command):
+        '''Blocking. waits until axes are done'''
+        """Send a command to Arduino and get the response."""
+        self.send_command_to_UNO(command)
+        return self.read_from_serial_until()
+
+    def query_position(self):
+        """Ask the controller for its step counts. Returns {'X': steps, 'Y': steps} without touching the dead-reckoned state."""
+        self.send_command_to_UNO('pos')
+        response = self.read_from_serial_until(report=False)
+        pos = response[0][2:-2].split(',')
+        return {'X': int(pos[0]), 'Y': int(pos[1])}
+
+    def start_move(self, x_steps, y_steps):
+        """Sends relative moves of both axes back to back, without the pause after each command, so that both arms start together.
+        Does not wait for the move or update the position state."""
+        commands = ''.join('mo{}{}\n'.format(axis, steps) for axis, steps in (('x', x_steps), ('y', y_steps)) if steps != 0)
+        self.uno_serial.write(commands.encode())
+
+    def motors_running(self):
+        """One isrun query, without the fixed sleeps of wait_for_motors. True while either arm is moving."""
+        self.uno_serial.write('isrun\n'.encode())
+        return self.wait_for_flag() == 'R1'
+
+    def sample_position(self):
+        """Timestamped pos query for fly scans, without the fixed sleeps. Returns (time, {'X': steps, 'Y': steps}), where time is the
+        wall clock (time.time) half way through the round trip, so it can be compared with the spectrometer's file times."""
+        sent = time.time()
+        self.uno_serial.write('pos\n'.encode())
+        response = ''.join(self.read_from_serial_until(report=False))
+        received = time.time()
+        match = re.search(r'<\[(-?\d+),(-?\d+)', response)
+        if match is None:
+            raise ValueError(f"Unexpected reply to pos: {response!r}")
+        return (sent + received) / 2, {'X': int(match.group(1)), 'Y': int(match.group(2))}
+
+    def verify_position(self):
+        """Check the dead-reckoned position against the controller. Raises PositionMismatch if a trusted position is off by more than
+        the tolerance; an untrusted one (cold start, after an error) is replaced by the controller's."""
+        return self.position.reconcile(self.query_position())
+
+    def get_current_position(self):
+        """Retrieve current position of motors."""
+        self.position.set(self.query_position())
+        print(f'X: {self.current_angle["X"]}, Y: {self.current_angle["Y"]}')
+        
+
+    def rename_files(self, series_name, angles):
+        """Rename files in the current directory with a given prefix and suffix."""
+        # This is just a placeholder function for demonstration
+        # takes the files that have been generated by the spectrometer and renames then with the correct angles
+        pass
+
+    def basic_scan(self, start_angle, end_angle, resolution):
+        """Run a basic scan from start to end angle with given step size."""
+        start_angle = float(start_angle)
+        end_angle = float(end_angle)
+        resolution = float(resolution)
+        angles = np.arange(start_angle, end_angle + resolution, resolution)
+        print("Scan to commence at angles: ", angles)
+        input("Press Enter to start the scan...")
+
+        for angle in angles:
+            self.go_to_angle(angle)
+            input("Collect data at this angle and press Enter to continue...")
+            # Do something with the spectrometer here
+            # For example, take a measurement at the current angle
+            # and store the data for further
+
+    def main_loop(self):
+        """Main loop to receive commands."""
+        while True:
+            try:
+                cmd = input("Enter command: ").strip().lower()
+
+                if cmd.startswith('z'):
+                    angle = cmd.split(' ')[1]
+                    self.send_command_to_UNO('moz{}'.format(angle))
+                else:
+                    self.process_coms(cmd)
+                    # print("Invalid command")
+            except Exception as e:
+                print("Error:", e)
+                continue
@@ -0,0 +1,184 @@
+import os
+import time
+import numpy as np
+from ars_analysis import ReflectionFile
+
+
+class DetectorDriver:
+    '''Interface to a spectrometer detector. Drivers provide
+
+        wavelength                 the wavelength axis (nm), a numpy array
+        integration_time           s
+        set_integration_time(s)
+        acquire(angles=None)       takes one spectrum and returns its intensity as a numpy array
+
+    A driver is also an acquirer for scan_job and adaptive_scan_job: calling it as driver(worker, angles) takes a spectrum at the current
+    point. The spectrum is handed to every writer (anything with the append method of ars_container.ScanContainer, e.g. a container
+    or a TextFileWriter) when the next one is taken or on flush(), so that one rejected by a quality gate (reject()) is never written.
+    data_type ('sample', 'reference' or 'dark') is recorded with each spectrum; set it for each pass.'''
+
+    can_set_integration_time = True
+
+    def __init__(self, integration_time=0.1, writers=None):
+        self.integration_time = integration_time
+        self.writers = list(writers or [])
+        self.data_type = 'sample'
+        self.wavelength = None
+        self._pending = None
+
+    def set_integration_time(self, seconds):
+        self.integration_time = float(seconds)
+
+    def acquire(self, angles=None):
+        raise NotImplementedError
+
+    def add_writer(self, writer):
+        self.writers.append(writer)
+
+    def __call__(self, worker, angles):
+        self.flush()
+        worker.checkpoint()
+        intensity = self.acquire(angles)
+        self._pending = {'intensity': intensity, 'angles': None if self.data_type == 'dark' else tuple(angles), 'data_type': self.data_type,
+                         'integration_time': self.integration_time, 'timestamp': time.time()}
+        return intensity
+
+    def reject(self):
+        '''Discards the last spectrum.'''
+        self._pending = None
+
+    def flush(self):
+        '''Writes the last spectrum, if it has not been written or rejected.'''
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            for writer in self.writers:
+                writer.append(**pending)
+
+    def close(self):
+        self.flush()
+
+
+class SimulatedDetector(DetectorDriver):
+    '''Detector for testing without hardware. A lamp spectrum (counts per second) is reflected by the sample (reflectance(angles,
+    wavelength), a fraction; by default a dip moving with angle) for data_type 'sample', seen directly for 'reference' and not at all
+    for 'dark'. Adds a dark level, shot and read noise, and clips at saturation. With realtime, acquire takes the integration time.'''
+
+    def __init__(self, wavelength=None, integration_time=0.1, lamp=None, reflectance=None, dark_level=100.0, read_noise=5.0,
+                 saturation=65535, realtime=True, seed=None, writers=None):
+        super().__init__(integration_time, writers)
+        self.wavelength = np.linspace(400, 1000, 512) if wavelength is None else np.asarray(wavelength, dtype=float)
+        self.lamp = 2e5 * np.exp(-((self.wavelength - 700) / 200) ** 2) + 2e3 if lamp is None else np.asarray(lamp, dtype=float)
+        self.reflectance = reflectance if reflectance is not None else self.default_reflectance
+        self.dark_level = dark_level
+        self.read_noise = read_noise
+        self.saturation = saturation
+        self.realtime = realtime
+        self.rng = np.random.default_rng(seed)
+
+    @staticmethod
+    def default_reflectance(angles, wavelength):
+        angle = 0.0 if angles is None else float(angles[0])
+        return 0.5 - 0.3 * np.exp(-((wavelength - (600 + 3 * angle)) / 20) ** 2)
+
+    def acquire(self, angles=None):
+        start = time.perf_counter()
+        if self.data_type == 'dark':
+            signal = np.zeros_like(self.wavelength)
+        elif self.data_type == 'reference':
+            signal = self.lamp * self.integration_time
+        else:
+            signal = self.lamp * self.integration_time * self.reflectance(angles, self.wavelength)
+        counts = self.rng.poisson(np.clip(signal, 0, None)) + self.dark_level + self.rng.normal(0, self.read_noise, len(self.wavelength))
+        counts = np.clip(counts, 0, self.saturation)
+        if self.realtime:
+            remaining = self.integration_time - (time.perf_counter() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+        return counts
+
+
+class FolderDetector(DetectorDriver):
+    '''Acquisition through the spectrometer software, which writes a .txt file per spectrum into data_dir: waits for the dwell time
+    (or the Continue button when dwell is 0), then for a new file to appear, and returns its intensity column. The wavelength axis and
+    integration time are read from the file; the integration time is set in the spectrometer software, not here. reject() moves the
+    last file into the rejected folder. Writers get a copy of each spectrum, e.g. to build a container as the scan runs.'''
+
+    can_set_integration_time = False
+
+    def __init__(self, data_dir, dwell=None, timeout=30.0, writers=None):
+        super().__init__(None, writers)
+        self.data_dir = data_dir
+        self.dwell = dwell
+        self.timeout = timeout
+        self.last_file = None
+
+    def set_integration_time(self, seconds):
+        raise NotImplementedError("The integration time is set in the spectrometer software.")
+
+    def _files(self):
+        return set(file for file in os.listdir(self.data_dir) if file.endswith('.txt'))
+
+    def __call__(self, worker, angles):
+        self.flush()
+        existing = self._files()
+        worker.wait_for_continue(self.dwell)
+        intensity = self.acquire(angles, existing=existing, checkpoint=worker.checkpoint)
+        self._pending = {'intensity': intensity, 'angles': None if self.data_type == 'dark' else tuple(angles), 'data_type': self.data_type,
+                         'integration_time': self.integration_time or 0.0, 'timestamp': time.time(), 'source': self.last_file}
+        return intensity
+
+    def acquire(self, angles=None, existing=None, checkpoint=None):
+        '''Waits for a file not in existing (the files present now by default).'''
+        if existing is None:
+            existing = self._files()
+        deadline = time.perf_counter() + self.timeout
+        while time.perf_counter() < deadline:
+            if checkpoint is not None:
+                checkpoint()
+            new_files = self._files() - existing
+            if new_files:
+                newest = max(new_files, key=lambda x: os.path.getmtime(os.path.join(self.data_dir, x)))
+                try:
+                    header, data = ReflectionFile.read_file(os.path.join(self.data_dir, newest))
+                    intensity = data[:, 1]
+                except (OSError, ValueError, IndexError):
+                    pass # still being written
+                else:
+                    self.last_file = newest
+                    self.wavelength = data[:, 0]
+                    self.integration_time = float(header.get('Integration Time (sec)', 0)) or None
+                    return intensity
+            time.sleep(0.1)
+        raise TimeoutError(f"No new spectrum file in {self.data_dir} after {self.timeout} s at {angles}.")
+
+    def reject(self):
+        self._pending = None
+        if self.last_file is None:
+            return
+        rejected_dir = os.path.join(self.data_dir, 'rejected')
+        if not os.path.exists(rejected_dir):
+            os.makedirs(rejected_dir)
+        os.replace(os.path.join(self.data_dir, self.last_file), os.path.join(rejected_dir, self.last_file))
+        self.last_file = None
+
+
+class TextFileWriter:
+    '''Writes spectra as .txt files in the layout of the spectrometer software, named <data_type>_<index>_<x>,<y>[,<z>].txt so they load
+    without renaming. Has the append method of ScanContainer, so it can be a detector writer.'''
+
+    def __init__(self, data_dir, wavelength):
+        self.data_dir = data_dir
+        self.wavelength = np.asarray(wavelength, dtype=float)
+        self.count = 0
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir)
+
+    def append(self, intensity, angles=None, data_type='sample', integration_time=0.0, timestamp=None, repeat=None, source=''):
+        angles_tag = '' if angles is None else '_' + ','.join(str(float(angle)) for angle in angles)
+        filepath = os.path.join(self.data_dir, f"{data_type}_{self.count:05d}{angles_tag}.txt")
+        lines = [f"Integration Time (sec): {integration_time}\n", ">>>>>Begin Spectral Data<<<<<\n"]
+        lines.extend(f"{wavelength}\t{value}\n" for wavelength, value in zip(self.wavelength, np.asarray(intensity, dtype=float)))
+        with open(filepath, 'w') as file:
+            file.writelines(lines)
+        self.count += 1
+        return filepath
@@ -0,0 +1,181 @@
+import os
+import json
+import threading
+import numpy as np
+from ars_scan import ScanPlan, as_points
+from ars_position import user_data_dir
+
+
+class MotionModel:
+    '''Predicts the time of a move from its step count with a trapezoidal velocity profile: the motor accelerates at acceleration (steps/s^2)
+    up to speed (steps/s), cruises and decelerates. Short moves never reach full speed. overhead (s) covers the serial commands and the
+    wait_for_motors polling of each move, settle (s) the time allowed for the arms to stop ringing.'''
+
+    def __init__(self, speed=500.0, acceleration=500.0, overhead=0.5, settle=0.0):
+        self.speed = speed
+        self.acceleration = acceleration
+        self.overhead = overhead
+        self.settle = settle
+
+    def to_dict(self):
+        return {'speed': self.speed, 'acceleration': self.acceleration, 'overhead': self.overhead, 'settle': self.settle}
+
+    @staticmethod
+    def profile_time(steps, speed, acceleration):
+        '''Time for moves of |steps| under the trapezoidal profile. Broadcasts over steps, speed and acceleration.'''
+        steps = np.abs(steps)
+        ramp_steps = speed ** 2 / acceleration # steps spent accelerating plus decelerating at full speed
+        triangular = 2 * np.sqrt(steps / acceleration)
+        trapezoidal = steps / speed + speed / acceleration
+        return np.where(steps < ramp_steps, triangular, trapezoidal)
+
+    def move_time(self, steps):
+        '''Predicted time (s) for moves of the given step counts, one per element. Zero-length moves cost nothing.'''
+        steps = np.asarray(steps, dtype=float)
+        time = self.profile_time(steps, self.speed, self.acceleration) + self.overhead + self.settle
+        return np.where(steps == 0, 0.0, time)
+
+    def fit(self, steps, elapsed):
+        '''Fits speed, acceleration and overhead to measured moves by a grid search over speed and acceleration, with the overhead solved in closed form for each pair. Needs moves of several different lengths to separate the parameters.'''
+        steps = np.abs(np.asarray(steps, dtype=float))
+        elapsed = np.asarray(elapsed, dtype=float) - self.settle
+        moving = steps > 0
+        steps, elapsed = steps[moving], elapsed[moving]
+        if len(steps) < 3 or len(np.unique(steps)) < 2:
+            return False
+
+        speed_range = (20, 20000)
+        acceleration_range = (20, 50000)
+        for _ in range(3): # coarse grid, then zoom in around the best pair
+            speeds = np.geomspace(*speed_range, 40)[:, None, None]
+            accelerations = np.geomspace(*acceleration_range, 40)[None, :, None]
+            profile = self.profile_time(steps[None, None, :], speeds, accelerations)
+            overhead = np.clip((elapsed - profile).mean(axis=2, keepdims=True), 0, None)
+            error = ((profile + overhead - elapsed) ** 2).sum(axis=2)
+
+            i, j = np.unravel_index(np.argmin(error), error.shape)
+            speed, acceleration = float(speeds[i, 0, 0]), float(accelerations[0, j, 0])
+            speed_range = (speed / 1.5, speed * 1.5)
+            acceleration_range = (acceleration / 1.5, acceleration * 1.5)
+
+        self.speed = speed
+        self.acceleration = acceleration
+        self.overhead = float(overhead[i, j, 0])
+        return True
+
+
+class ScanEstimator:
+    '''Predicts how long a scan will take and calibrates itself from the timings recorded during scans.
+
+    The timings (moves, acquisition waits and predicted versus actual scan times) are kept in a json file, by default
+    motion_timings_<state_name>.json in the spectrometer's state_dir (or user_data_dir()), so the estimate improves over sessions. Time spent paused is left out of the
+    recorded timings by scan_job. Safe to use from the worker and preview threads at once.'''
+
+    max_records = 2000
+
+    def __init__(self, spectrometer, timings_path=None, acquisition_time=5.0):
+        self.spectrometer = spectrometer
+        if timings_path is None:
+            state_dir = getattr(spectrometer, 'state_dir', None) or user_data_dir()
+            state_name = getattr(spectrometer, 'state_name', None)
+            timings_path = os.path.join(state_dir, f'motion_timings_{state_name}.json' if state_name else 'motion_timings.json')
+        self.timings_path = timings_path
+        self.model = MotionModel()
+        self.acquisition_time = acquisition_time # s per point when acquisition is manual, until measured
+
+        self.moves = [] # [steps_x, steps_y, elapsed]
+        self.acquisitions = [] # elapsed
+        self.scans = [] # {'points', 'predicted', 'actual'}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.timings_path):
+            return
+        with open(self.timings_path, 'r') as file:
+            timings = json.load(file)
+        self.moves = timings.get('moves', [])
+        self.acquisitions = timings.get('acquisitions', [])
+        self.scans = timings.get('scans', [])
+        self.model = MotionModel(**timings.get('model', {}))
+        self.acquisition_time = timings.get('acquisition_time', self.acquisition_time)
+
+    def save(self):
+        with self._lock:
+            timings = {
+                'model': self.model.to_dict(),
+                'acquisition_time': self.acquisition_time,
+                'moves': self.moves[-self.max_records:],
+                'acquisitions': self.acquisitions[-self.max_records:],
+                'scans': self.scans[-self.max_records:],
+            }
+        with open(self.timings_path, 'w') as file:
+            json.dump(timings, file)
+
+    def step_counts(self, points, start=None):
+        '''Per-axis step counts of each move of a scan, as an (N, 2) array. The first move starts from start (x, y), by default the current angle of the spectrometer.'''
+        points = as_points(points)[:, :2]
+        if start is None:
+            current_angle = getattr(self.spectrometer, 'current_angle', {'X': points[0, 0], 'Y': points[0, 1]} if len(points) else {'X': 0, 'Y': 0})
+            start = (current_angle['X'], current_angle['Y'])
+        path = np.vstack((np.asarray(start, dtype=float).reshape(1, 2), points))
+
+        steps = np.empty(path.shape, dtype=float)
+        for column, axis in enumerate(('X', 'Y')):
+            steps[:, column] = [self.spectrometer.angle_to_steps(axis, angle) for angle in path[:, column]]
+        return np.diff(steps, axis=0)
+
+    def estimate(self, points, dwell=None, start=None, return_to=None, repeats=1):
+        '''Predicted duration of a scan in seconds, split into 'motion', 'acquisition' and 'total'. dwell is the time per acquisition, of which
+        there are repeats per point; None or 0 means manual acquisition, for which the measured average wait is used. A ScanPlan is
+        estimated block by block, so it is never materialised. Only the arm moves are modelled, not those of the Z axis.'''
+        if isinstance(points, ScanPlan):
+            estimate = {'points': 0, 'motion': 0.0, 'acquisition': 0.0, 'total': 0.0}
+            done = 0
+            for block in points.blocks():
+                done += len(block)
+                part = self.estimate(block, dwell, start, return_to if done == len(points) else None, repeats)
+                start = tuple(block[-1, :2])
+                for key in estimate:
+                    estimate[key] += part[key]
+            return estimate
+        points = as_points(points)[:, :2]
+        if len(points) == 0:
+            return {'points': 0, 'motion': 0.0, 'acquisition': 0.0, 'total': 0.0}
+        if return_to is not None:
+            points_with_return = np.vstack((points, np.asarray(return_to, dtype=float)[:2].reshape(1, 2)))
+        else:
+            points_with_return = points
+
+        steps = self.step_counts(points_with_return, start)
+        # the axes move at the same time, so the longer move sets the time
+        motion = float(self.model.move_time(np.abs(steps).max(axis=1)).sum())
+        acquisition = len(points) * repeats * (dwell if dwell else self.acquisition_time)
+        return {'points': len(points), 'motion': motion, 'acquisition': acquisition, 'total': motion + acquisition}
+
+    def record_move(self, steps_x, steps_y, elapsed):
+        with self._lock:
+            self.moves.append([int(steps_x), int(steps_y), float(elapsed)])
+
+    def record_acquisition(self, elapsed):
+        with self._lock:
+            self.acquisitions.append(float(elapsed))
+
+    def record_scan(self, n_points, predicted, actual):
+        '''Stores the predicted and actual time of a finished scan, refits the model and saves the timings. Returns the relative error of the prediction.'''
+        with self._lock:
+            self.scans.append({'points': int(n_points), 'predicted': float(predicted), 'actual': float(actual)})
+        self.calibrate()
+        self.save()
+        return (predicted - actual) / actual if actual > 0 else np.nan
+
+    def calibrate(self):
+        '''Refits the motion model and the manual acquisition time from the recorded timings.'''
+        with self._lock:
+            moves = np.array(self.moves[-self.max_records:], dtype=float).reshape(-1, 3)
+            acquisitions = list(self.acquisitions[-self.max_records:])
+        if len(moves) > 0:
+            self.model.fit(np.abs(moves[:, :2]).max(axis=1), moves[:, 2])
+        if len(acquisitions) > 0:
+            self.acquisition_time = float(np.median(acquisitions))
+        return self.model
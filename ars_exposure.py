@@ -0,0 +1,137 @@
+import os
+import json
+import numpy as np
+
+
+class ExposurePlanner:
+    '''Chooses the integration time at each angle of a scan so that the brightest part of the spectrum reaches target_level counts,
+    instead of using the worst-case time everywhere.
+
+    The signal rate (counts/s above dark_level at the 99th percentile of the spectrum) of every acquisition is recorded. The rate at a
+    new angle is predicted from a base, corrected by how the measured rates of the nearest points of the same pass compare with their
+    base:
+
+        base        the cached rate for this pass and angles (from an earlier scan, see cache_path), otherwise, for the sample pass, the
+                    reference rate at these angles (measured or cached), otherwise nothing
+        correction  the measured/base ratio at the two nearest measured points, interpolated (inverse distance, in log), or 1
+
+    Without any base the measured rates of the neighbours are interpolated directly, and the very first point uses default_time. The
+    times are clipped to [min_time, max_time].
+
+    A spectrum whose 99th percentile is at or above saturation_level was clipped, so its rate is only a lower bound. It is recorded as
+    such: it shortens the next predictions, but never replaces an unsaturated rate at the same angles and is not written to the cache.
+
+    The exposure map (the rates, by pass and angles) is kept in cache_path (json) when given, so repeat samples start from the map of
+    the last one. The time used is recorded with each spectrum by the detector driver; analyse such scans with time_normalised.'''
+
+    def __init__(self, target_level=45000, dark_level=0.0, default_time=0.1, min_time=0.001, max_time=10.0, cache_path=None,
+                 saturation_level=65000):
+        self.target_level = target_level
+        self.saturation_level = saturation_level
+        self.dark_level = dark_level
+        self.default_time = default_time
+        self.min_time = min_time
+        self.max_time = max_time
+        self.cache_path = cache_path
+        self.cached = {} # {data_type: {angles: rate}} from earlier scans
+        self.measured = {} # {data_type: {angles: rate}} from this scan
+        self.lower_bounds = {} # {data_type: set of angles} whose measured rate is from a saturated spectrum
+        if cache_path is not None and os.path.exists(cache_path):
+            self.load(cache_path)
+
+    @staticmethod
+    def _key(angles):
+        return tuple(float(angle) for angle in angles)
+
+    def rate(self, intensity, integration_time):
+        '''Signal rate (counts/s) of a spectrum.'''
+        peak = np.nanpercentile(np.asarray(intensity, dtype=float), 99) - self.dark_level
+        return max(float(peak), 1.0) / integration_time
+
+    def saturated(self, intensity):
+        '''True if the level the rate is measured at (the 99th percentile) is clipped by saturation.'''
+        return bool(np.nanpercentile(np.asarray(intensity, dtype=float), 99) >= self.saturation_level)
+
+    def _base(self, data_type, angles):
+        base = self.cached.get(data_type, {}).get(angles)
+        if base is None and data_type != 'reference':
+            base = self.measured.get('reference', {}).get(angles) or self.cached.get('reference', {}).get(angles)
+        return base
+
+    @staticmethod
+    def _interpolate(values, angles):
+        '''Inverse distance interpolation, in log, of {angles: value} from the two points nearest to angles.'''
+        keys = list(values)
+        points = np.array(keys, dtype=float)
+        distances = np.sqrt(((points - np.array(angles, dtype=float)) ** 2).sum(axis=1))
+        nearest = np.argsort(distances)[:2]
+        if distances[nearest[0]] == 0 or len(nearest) == 1:
+            return values[keys[nearest[0]]]
+        weights = 1 / distances[nearest]
+        logs = np.log([values[keys[index]] for index in nearest])
+        return float(np.exp((weights * logs).sum() / weights.sum()))
+
+    def predict_rate(self, angles, data_type='sample'):
+        '''Predicted signal rate at angles, or None if there is nothing to go on.'''
+        angles = self._key(angles)
+        measured = self.measured.get(data_type, {})
+        base = self._base(data_type, angles)
+        if base is None:
+            return self._interpolate(measured, angles) if measured else None
+
+        ratios = {}
+        for point, rate in measured.items():
+            point_base = self._base(data_type, point)
+            if point_base:
+                ratios[point] = rate / point_base
+        correction = self._interpolate(ratios, angles) if ratios else 1.0
+        return base * correction
+
+    def predict(self, angles, data_type='sample'):
+        '''Integration time (s) for angles.'''
+        rate = self.predict_rate(angles, data_type)
+        if rate is None:
+            return self.default_time
+        return float(np.clip((self.target_level - self.dark_level) / rate, self.min_time, self.max_time))
+
+    def record(self, angles, data_type, intensity, integration_time):
+        '''Records an acquisition, so it informs the prediction for the next angles.'''
+        if not integration_time:
+            return
+        angles = self._key(angles)
+        measured = self.measured.setdefault(data_type, {})
+        lower_bounds = self.lower_bounds.setdefault(data_type, set())
+        rate = self.rate(intensity, integration_time)
+        if self.saturated(intensity):
+            if angles in measured and angles not in lower_bounds:
+                return # an unsaturated measurement here is better than a bound
+            measured[angles] = max(rate, measured.get(angles, 0.0))
+            lower_bounds.add(angles)
+        else:
+            measured[angles] = rate
+            lower_bounds.discard(angles)
+
+    def exposure_map(self, data_type='sample'):
+        '''{angles: integration time} that the measured rates of this scan call for.'''
+        return {angles: float(np.clip((self.target_level - self.dark_level) / rate, self.min_time, self.max_time))
+                for angles, rate in self.measured.get(data_type, {}).items()}
+
+    def save(self, filepath=None):
+        '''Merges the rates measured in this scan into the cache file.'''
+        filepath = filepath or self.cache_path
+        if filepath is None:
+            return None
+        merged = {data_type: dict(rates) for data_type, rates in self.cached.items()}
+        for data_type, rates in self.measured.items():
+            lower_bounds = self.lower_bounds.get(data_type, set())
+            merged.setdefault(data_type, {}).update({angles: rate for angles, rate in rates.items() if angles not in lower_bounds})
+        data = {data_type: [list(angles) + [rate] for angles, rate in sorted(rates.items())] for data_type, rates in merged.items()}
+        with open(filepath + '.tmp', 'w') as file:
+            json.dump({'target_level': self.target_level, 'dark_level': self.dark_level, 'rates': data}, file)
+        os.replace(filepath + '.tmp', filepath)
+        return filepath
+
+    def load(self, filepath):
+        with open(filepath, 'r') as file:
+            data = json.load(file)
+        self.cached = {data_type: {self._key(row[:-1]): float(row[-1]) for row in rows} for data_type, rows in data.get('rates', {}).items()}
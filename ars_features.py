@@ -0,0 +1,178 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+FEATURE_DTYPE = np.dtype([('angle', 'f8'), ('position', 'f8'), ('depth', 'f8'), ('centroid', 'f8'), ('width', 'f8'),
+                          ('fit_centre', 'f8'), ('fit_width', 'f8'), ('fit_amplitude', 'f8'), ('fit_baseline', 'f8'),
+                          ('fit_rms', 'f8'), ('fit_ok', '?')])
+
+
+def lorentzian(x, baseline, amplitude, centre, width):
+    '''Lorentzian line of full width at half maximum width on a constant baseline.'''
+    return baseline + amplitude / (1 + ((x - centre) / (width / 2)) ** 2)
+
+
+def gaussian(x, baseline, amplitude, centre, width):
+    '''Gaussian line of full width at half maximum width on a constant baseline.'''
+    return baseline + amplitude * np.exp(-4 * np.log(2) * ((x - centre) / width) ** 2)
+
+
+def _jacobian(model, x, params):
+    baseline, amplitude, centre, width = params
+    if model == 'lorentzian':
+        u = (x - centre) / (width / 2)
+        shape = 1 / (1 + u ** 2)
+        d_u = -2 * amplitude * u * shape ** 2
+        return np.column_stack((np.ones_like(x), shape, d_u * -2 / width, d_u * -u / width))
+    shape = np.exp(-4 * np.log(2) * ((x - centre) / width) ** 2)
+    d_arg = amplitude * shape * -4 * np.log(2)
+    return np.column_stack((np.ones_like(x), shape, d_arg * -2 * (x - centre) / width ** 2, d_arg * -2 * (x - centre) ** 2 / width ** 3))
+
+
+MODELS = {'lorentzian': lorentzian, 'gaussian': gaussian}
+
+
+def fit_line(x, y, p0, model='lorentzian', max_iterations=50, tolerance=1e-8):
+    '''Least squares fit of a single line shape by Levenberg-Marquardt with the analytic Jacobian. p0 is (baseline, amplitude, centre,
+    width). Returns (params, rms residual, converged).'''
+    function = MODELS[model]
+    params = np.array(p0, dtype=float)
+    residual = y - function(x, *params)
+    cost = residual @ residual
+    damping = 1e-3
+    for _ in range(max_iterations):
+        jacobian = _jacobian(model, x, params)
+        normal = jacobian.T @ jacobian
+        gradient = jacobian.T @ residual
+        while True:
+            try:
+                step = np.linalg.solve(normal + damping * np.diag(np.diag(normal) + 1e-12), gradient)
+            except np.linalg.LinAlgError:
+                return params, np.sqrt(cost / len(x)), False
+            trial = params + step
+            trial[3] = abs(trial[3]) or params[3]
+            trial_residual = y - function(x, *trial)
+            trial_cost = trial_residual @ trial_residual
+            if trial_cost <= cost:
+                break
+            damping *= 10
+            if damping > 1e10:
+                return params, np.sqrt(cost / len(x)), True # no further improvement possible
+        improvement = cost - trial_cost
+        params, residual, cost = trial, trial_residual, trial_cost
+        damping = max(damping / 10, 1e-12)
+        if improvement <= tolerance * max(cost, 1e-300):
+            break
+    return params, np.sqrt(cost / len(x)), True
+
+
+def find_extrema(wavelength, values, kind='dip', region=None):
+    '''Vectorized first estimates for every spectrum (row) of values: the position of the minimum (kind='dip') or maximum ('peak'),
+    its depth or height against the median of the spectrum, the centroid of the part beyond half depth and the full width at half depth.
+    Returns a dict of arrays, plus 'index', 'left' and 'right' (indices of the half depth crossings).'''
+    wavelength = np.asarray(wavelength, dtype=float)
+    values = np.asarray(values, dtype=float)
+    sign = -1.0 if kind == 'dip' else 1.0
+    signal = sign * values
+    if region is not None:
+        signal = np.where((wavelength >= region[0]) & (wavelength <= region[1]), signal, -np.inf)
+
+    index = np.argmax(signal, axis=1)
+    rows = np.arange(len(values))
+    baseline = np.nanmedian(values, axis=1)
+    extreme = values[rows, index]
+    depth = sign * (extreme - baseline)
+
+    # contiguous part of the line beyond half depth around the extremum
+    beyond = sign * (values - (baseline + sign * depth / 2)[:, None]) >= 0
+    columns = np.arange(values.shape[1])[None, :]
+    left = np.where(~beyond & (columns < index[:, None]), columns, -1).max(axis=1) + 1
+    right = np.where(~beyond & (columns > index[:, None]), columns, values.shape[1]).min(axis=1) - 1
+    inside = (columns >= left[:, None]) & (columns <= right[:, None])
+
+    weights = np.where(inside, np.abs(values - baseline[:, None]), 0)
+    total = weights.sum(axis=1)
+    centroid = np.where(total > 0, (weights * wavelength[None, :]).sum(axis=1) / np.where(total > 0, total, 1), wavelength[index])
+    width = wavelength[right] - wavelength[left]
+    return {'index': index, 'left': left, 'right': right, 'position': wavelength[index], 'depth': depth, 'centroid': centroid,
+            'width': width, 'baseline': baseline, 'extreme': extreme}
+
+
+def _fit_in_window(x, y, p0, model, kind):
+    params, rms, converged = fit_line(x, y, p0, model)
+    ok = converged and (params[1] < 0 if kind == 'dip' else params[1] > 0) and x[0] <= params[2] <= x[-1]
+    return params, rms, ok
+
+
+def _fit_chunk(wavelength, values, estimates, model, window, kind):
+    '''Fits the rows of one chunk of neighbouring angles in order. The centre and the fit window always come from the row's own
+    vectorized estimate; width, amplitude and baseline start from the previous row's fit when that worked (warm start). A warm fit that
+    fails or whose centre leaves the window is redone from the estimate. Module level so it can be run in a worker process.'''
+    results = []
+    previous = None
+    step = np.median(np.diff(wavelength)) if len(wavelength) > 1 else 1.0
+    for row, estimate in zip(values, estimates):
+        position, width, baseline, extreme = estimate
+        width = max(width, 2 * step)
+        half_window = window * width / 2
+        mask = (wavelength >= position - half_window) & (wavelength <= position + half_window) & np.isfinite(row)
+        if mask.sum() < 5:
+            results.append((np.nan, np.nan, np.nan, np.nan, np.nan, False))
+            previous = None
+            continue
+        x, y = wavelength[mask], row[mask]
+        ok = False
+        if previous is not None:
+            params, rms, ok = _fit_in_window(x, y, (previous[0], previous[1], position, previous[3]), model, kind)
+        if not ok:
+            params, rms, ok = _fit_in_window(x, y, (baseline, extreme - baseline, position, width), model, kind)
+        results.append((params[2], abs(params[3]), params[1], params[0], rms, ok))
+        previous = tuple(params) if ok else None
+    return results
+
+
+def extract_features(wavelength, values, angles, kind='dip', model='lorentzian', region=None, window=3.0, processes=None, chunk_size=16):
+    '''Dip (or peak) positions, depths, centroids and widths of every spectrum of an (n_angles, n_wavelengths) array, refined by fitting
+    a Lorentzian or Gaussian over window times the estimated width. Rows should be sorted by angle: the fits run over chunks of
+    neighbouring angles (chunk_size rows), each fit warm started from the previous angle, with the chunks spread over a process pool
+    (processes=1 fits in this process; None uses one process per CPU). The chunks do not depend on the number of processes, so neither
+    do the results. Returns a structured array with FEATURE_DTYPE fields, one row per angle.'''
+    if model not in MODELS:
+        raise ValueError(f"Unknown model '{model}'. Options are {tuple(MODELS)}.")
+    wavelength = np.asarray(wavelength, dtype=float)
+    values = np.asarray(values, dtype=float)
+    estimates = find_extrema(wavelength, values, kind, region)
+
+    table = np.zeros(len(values), dtype=FEATURE_DTYPE)
+    table['angle'] = angles
+    for field in ('position', 'depth', 'centroid', 'width'):
+        table[field] = estimates[field]
+    if len(values) == 0:
+        return table
+
+    starts = np.column_stack((estimates['position'], estimates['width'], estimates['baseline'], estimates['extreme']))
+    if processes is None:
+        processes = os.cpu_count() or 1
+    chunks = [slice(start, start + chunk_size) for start in range(0, len(values), chunk_size)]
+    arguments = [(wavelength, values[chunk], starts[chunk], model, window, kind) for chunk in chunks]
+
+    if processes == 1 or len(chunks) == 1:
+        fitted = [_fit_chunk(*args) for args in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(chunks))) as pool:
+            fitted = list(pool.map(_fit_chunk, *zip(*arguments)))
+
+    rows = [row for chunk in fitted for row in chunk]
+    for column, field in enumerate(('fit_centre', 'fit_width', 'fit_amplitude', 'fit_baseline', 'fit_rms', 'fit_ok')):
+        table[field] = [row[column] for row in rows]
+    return table
+
+
+def export_features(table, filepath):
+    '''Writes a feature table to csv.'''
+    header = ','.join(table.dtype.names)
+    with open(filepath, 'w') as file:
+        file.write(header + '\n')
+        for row in table:
+            file.write(','.join(str(int(value)) if isinstance(value, (bool, np.bool_)) else f"{value:.6g}" for value in row) + '\n')
+    return filepath
@@ -0,0 +1,96 @@
+import numpy as np
+from functools import lru_cache
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+@lru_cache(maxsize=32)
+def savgol_projection(window, order):
+    '''(window, window) matrix whose row i gives the value at point i of the least squares polynomial of the given order through a
+    window of samples. The centre row is the usual Savitzky-Golay kernel; the others are used at the edges. Cached per window/order.'''
+    if window % 2 == 0 or window < 3:
+        raise ValueError("window must be an odd number >= 3.")
+    if order >= window:
+        raise ValueError("order must be less than window.")
+    positions = np.arange(window) - window // 2
+    vandermonde = np.vander(positions, order + 1, increasing=True)
+    projection = vandermonde @ np.linalg.pinv(vandermonde)
+    projection.setflags(write=False)
+    return projection
+
+
+def savgol(values, window=11, order=3):
+    '''Savitzky-Golay smoothing of every row of values along the last axis. The edges use the polynomial fitted to the first and last
+    window (like scipy's mode='interp').'''
+    values = np.asarray(values, dtype=float)
+    if values.shape[-1] < window:
+        raise ValueError(f"Spectra of {values.shape[-1]} points are shorter than the window ({window}).")
+    projection = savgol_projection(window, order)
+    half = window // 2
+    result = np.empty_like(values)
+    result[..., half:-half] = sliding_window_view(values, window, axis=-1) @ projection[half]
+    result[..., :half] = values[..., :window] @ projection[:half].T
+    result[..., -half:] = values[..., -window:] @ projection[-half:].T
+    return result
+
+
+def moving_median(values, window=5):
+    '''Moving median of every row along the last axis, with the edges padded by repeating the end values.'''
+    if window % 2 == 0 or window < 3:
+        raise ValueError("window must be an odd number >= 3.")
+    values = np.asarray(values, dtype=float)
+    half = window // 2
+    padding = [(0, 0)] * (values.ndim - 1) + [(half, half)]
+    return np.median(sliding_window_view(np.pad(values, padding, mode='edge'), window, axis=-1), axis=-1)
+
+
+@lru_cache(maxsize=32)
+def _baseline_solver(n_points, order, mask_bytes):
+    x = np.linspace(-1, 1, n_points)
+    vandermonde = np.vander(x, order + 1, increasing=True)
+    mask = np.frombuffer(mask_bytes, dtype=bool)
+    solver = np.linalg.pinv(vandermonde[mask])
+    return vandermonde, solver
+
+
+def polynomial_baseline(values, order=3, iterations=0, mask=None):
+    '''Polynomial baseline of every row, fitted over the points in mask (all by default) with one shared least squares solve for all
+    rows. With iterations > 0 the fit is repeated on min(spectrum, fit), which lets the baseline run under peaks (modified polyfit).
+    Returns the baseline; subtract it, or divide by it.'''
+    values = np.asarray(values, dtype=float)
+    n_points = values.shape[-1]
+    mask = np.ones(n_points, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+    vandermonde, solver = _baseline_solver(n_points, order, mask.tobytes())
+    target = values[..., mask]
+    baseline = (target @ solver.T) @ vandermonde.T
+    for _ in range(iterations):
+        target = np.minimum(target, baseline[..., mask])
+        baseline = (target @ solver.T) @ vandermonde.T
+    return baseline
+
+
+def remove_baseline(values, order=3, iterations=0, mask=None):
+    return values - polynomial_baseline(values, order, iterations, mask)
+
+
+FILTERS = {'savgol': savgol, 'median': moving_median, 'baseline': remove_baseline}
+
+
+def apply_filters(values, steps, chunk_size=64, columns=None):
+    '''Applies a list of filter steps, e.g. [('median', {'window': 5}), ('savgol', {'window': 11, 'order': 3})], to every row of the
+    (n_spectra, n_wavelengths) array values, chunk_size rows at a time so the temporary arrays stay small. columns (a boolean mask or
+    slice) restricts the filtering to part of the wavelength axis, e.g. a noisy edge. Returns a new array.'''
+    values = np.asarray(values, dtype=float)
+    steps = [(name, dict(parameters)) for name, parameters in steps]
+    for name, _ in steps:
+        if name not in FILTERS:
+            raise ValueError(f"Unknown filter '{name}'. Options are {tuple(FILTERS)}.")
+    if columns is None:
+        columns = slice(None)
+
+    result = values.copy()
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size, columns]
+        for name, parameters in steps:
+            chunk = FILTERS[name](chunk, **parameters)
+        result[start:start + chunk_size, columns] = chunk
+    return result
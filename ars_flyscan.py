@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import numpy as np
+from ars_analysis import ReflectionFile
+
+
+class Trajectory:
+    '''Timestamped step positions of both arms recorded during a fly scan. times are wall clock seconds (time.time), steps an (N, 2)
+    array of (X, Y) step counts. Positions between samples are linearly interpolated.'''
+
+    def __init__(self, times, steps, steps_per_degree):
+        self.times = np.asarray(times, dtype=float)
+        self.steps = np.asarray(steps, dtype=float).reshape(-1, 2)
+        self.steps_per_degree = dict(steps_per_degree)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def angles(self):
+        return self.steps / np.array([self.steps_per_degree['X'], self.steps_per_degree['Y']])
+
+    @property
+    def rate(self):
+        '''Mean angular rate (deg/s) of each axis while moving.'''
+        moving = np.flatnonzero(np.any(np.diff(self.steps, axis=0) != 0, axis=1))
+        if len(moving) == 0:
+            return np.zeros(2)
+        first, last = moving[0], moving[-1] + 1
+        return (self.angles[last] - self.angles[first]) / (self.times[last] - self.times[first])
+
+    def angles_at(self, times):
+        '''(len(times), 2) array of the interpolated (X, Y) angles.'''
+        times = np.asarray(times, dtype=float)
+        angles = self.angles
+        return np.column_stack([np.interp(times, self.times, angles[:, axis]) for axis in range(2)])
+
+    def window(self, starts, ends, samples=32):
+        '''Mean angle and angular blur (range of angles covered) of each acquisition window [start, end]. Returns two (n, 2) arrays.'''
+        starts = np.atleast_1d(np.asarray(starts, dtype=float))
+        ends = np.atleast_1d(np.asarray(ends, dtype=float))
+        grid = starts[:, None] + (ends - starts)[:, None] * np.linspace(0, 1, samples)[None, :]
+        angles = self.angles_at(grid.ravel()).reshape(len(starts), samples, 2)
+        return angles.mean(axis=1), angles.max(axis=1) - angles.min(axis=1)
+
+    def to_dict(self):
+        return {'times': self.times.tolist(), 'steps': self.steps.tolist(), 'steps_per_degree': self.steps_per_degree}
+
+    @classmethod
+    def from_dict(cls, trajectory):
+        return cls(trajectory['times'], trajectory['steps'], trajectory['steps_per_degree'])
+
+    def save(self, filepath):
+        with open(filepath, 'w') as file:
+            json.dump(self.to_dict(), file)
+
+    @classmethod
+    def load(cls, filepath):
+        with open(filepath, 'r') as file:
+            return cls.from_dict(json.load(file))
+
+
+def fly_scan_job(worker, start, stop, data_dir=None, poll_interval=0.0, stall_timeout=5.0):
+    '''Worker job for a specular fly scan: moves both arms to start, then sweeps them to stop in a single move while the spectrometer
+    acquires continuously. The position is sampled with timestamped pos queries for the whole sweep (as often as the serial link allows,
+    or every poll_interval s) and the Trajectory is saved to data_dir as fly_trajectory.json. Use tag_files afterwards to give each
+    spectrum its mean angle and angular blur.
+
+    The firmware has no speed command, so the sweep runs at the controller's configured speed; the recorded trajectory, not a nominal
+    rate, is used for tagging, which also accounts for acceleration at both ends.
+
+    The sweep ends when the arms reach stop or, checked with isrun whenever the position stops changing, when the controller reports
+    them stopped short of it; the position is then taken from the controller, untrusted. If the position does not change for
+    stall_timeout s while the controller still reports the arms running, the position is invalidated and the job fails.'''
+    spectrometer = worker.spectrometer
+    worker.checkpoint()
+    spectrometer.go_to_angle(start, start)
+    spectrometer.wait_for_motors()
+    worker.post_position()
+
+    target = {axis: spectrometer.angle_to_steps(axis, stop) for axis in ('X', 'Y')}
+    times, steps = [], []
+    timestamp, origin = spectrometer.sample_position() # move from where the controller is, not from the dead-reckoned position
+    times.append(timestamp)
+    steps.append((origin['X'], origin['Y']))
+    distance = max(abs(target[axis] - origin[axis]) for axis in target) or 1
+    worker.post('scan_started', total=100, predicted=None)
+
+    start_time = time.perf_counter()
+    if hasattr(spectrometer, 'position'):
+        spectrometer.position.begin_move()
+    try:
+        spectrometer.start_move(target['X'] - origin['X'], target['Y'] - origin['Y'])
+        last_change = time.perf_counter()
+        while True:
+            worker.checkpoint()
+            timestamp, position = spectrometer.sample_position()
+            if position == target:
+                times.append(timestamp)
+                steps.append((position['X'], position['Y']))
+                break
+            if (position['X'], position['Y']) != steps[-1]:
+                last_change = time.perf_counter()
+            elif not spectrometer.motors_running():
+                times.append(timestamp)
+                steps.append((position['X'], position['Y']))
+                break
+            elif time.perf_counter() - last_change > stall_timeout:
+                raise RuntimeError(f"Fly scan stalled at {position} for {stall_timeout} s on the way to {target}.")
+            times.append(timestamp)
+            steps.append((position['X'], position['Y']))
+            travelled = max(abs(position[axis] - origin[axis]) for axis in target)
+            angles = (spectrometer.steps_to_angle('X', position['X']), spectrometer.steps_to_angle('Y', position['Y']))
+            worker.post('progress', index=int(100 * travelled / distance), total=100, angles=angles)
+            if poll_interval:
+                time.sleep(poll_interval)
+    except BaseException as e:
+        if hasattr(spectrometer, 'position'):
+            spectrometer.position.invalidate(str(e) or type(e).__name__)
+        raise
+
+    if hasattr(spectrometer, 'position'):
+        if position == target:
+            spectrometer.position.commanded(target, {'X': stop, 'Y': stop})
+        else:
+            print(f"Fly scan stopped at {position}, short of {target}; re-check the position before the next scan.")
+            spectrometer.position.set(position, trusted=False)
+    worker.post_position()
+
+    trajectory = Trajectory(times, steps, spectrometer.steps_per_degree)
+    if data_dir is not None:
+        trajectory.save(os.path.join(data_dir, 'fly_trajectory.json'))
+    elapsed = time.perf_counter() - start_time
+    worker.post('scan_complete', total=len(trajectory), elapsed=elapsed, predicted=None)
+    return trajectory
+
+
+def tag_files(data_dir, trajectory=None, identifier='sample', latency=0.0, integration_time=None, rename=True, decimals=3):
+    '''Tags the spectra acquired during a fly scan with the angles they were acquired at.
+
+    Each .txt file of the given identifier (e.g. sample_..., reference_...) without angles in its name, modified during the trajectory,
+    is taken to have been acquired over [modified - latency - integration time, modified - latency], with the integration time read
+    from its header unless given. The mean angle over that window goes into the file name (as "x,y", so the files load like those of
+    a step scan) and the blur, the angle range covered, is written with the window to fly_scan_tags.csv, which AngleReflectance reads.
+    Files acquired before the sweep started or after it ended (e.g. while the arms moved to the start angle) cannot be tagged and are
+    moved to the outside_sweep folder. Returns the rows of fly_scan_tags.csv.'''
+    if trajectory is None:
+        trajectory = Trajectory.load(os.path.join(data_dir, 'fly_trajectory.json'))
+
+    files = []
+    outside = []
+    for filename in sorted(os.listdir(data_dir)):
+        basename, extension = os.path.splitext(filename)
+        if extension != '.txt' or identifier not in filename or ',' in basename.split('_')[-1]:
+            continue
+        modified = os.path.getmtime(os.path.join(data_dir, filename)) - latency
+        if trajectory.times[0] <= modified <= trajectory.times[-1]:
+            files.append((filename, modified))
+        else:
+            outside.append(filename)
+
+    if outside and rename:
+        outside_dir = os.path.join(data_dir, 'outside_sweep')
+        if not os.path.exists(outside_dir):
+            os.makedirs(outside_dir)
+        for filename in outside:
+            os.rename(os.path.join(data_dir, filename), os.path.join(outside_dir, filename))
+        print(f"{len(outside)} {identifier} files acquired outside the sweep moved to {outside_dir}.")
+    if not files:
+        return []
+
+    ends = np.array([modified for _, modified in files])
+    if integration_time is None:
+        exposures = np.array([float(ReflectionFile.read_file(os.path.join(data_dir, filename))[0].get('Integration Time (sec)', 0)) for filename, _ in files])
+    else:
+        exposures = np.full(len(files), float(integration_time))
+    means, blurs = trajectory.window(ends - exposures, ends)
+
+    rows = []
+    for (filename, _), end, exposure, mean, blur in zip(files, ends, exposures, means, blurs):
+        tagged = filename
+        if rename:
+            tagged = f"{os.path.splitext(filename)[0]}_{round(mean[0], decimals)},{round(mean[1], decimals)}.txt"
+            os.rename(os.path.join(data_dir, filename), os.path.join(data_dir, tagged))
+        rows.append((tagged, end - exposure, end, mean[0], mean[1], blur[0], blur[1]))
+
+    tags_path = os.path.join(data_dir, 'fly_scan_tags.csv')
+    new_file = not os.path.exists(tags_path)
+    with open(tags_path, 'a') as file:
+        if new_file:
+            file.write('filename,start,end,x,y,blur_x,blur_y\n')
+        for row in rows:
+            file.write('{},{:.4f},{:.4f},{:.4f},{:.4f},{:.4f},{:.4f}\n'.format(*row))
+    return rows
+
+
+def read_tags(data_dir):
+    '''{filename: (blur_x, blur_y)} from fly_scan_tags.csv, empty if the directory has none.'''
+    tags_path = os.path.join(data_dir, 'fly_scan_tags.csv')
+    if not os.path.exists(tags_path):
+        return {}
+    tags = {}
+    with open(tags_path, 'r') as file:
+        next(file)
+        for line in file:
+            fields = line.strip().rsplit(',', 6) # the file names contain a comma
+            if len(fields) == 7:
+                tags[fields[0]] = (float(fields[5]), float(fields[6]))
+    return tags
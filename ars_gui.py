@@ -3,13 +3,40 @@ from tkinter import ttk, filedialog
 import numpy as np
 import time
 import os
+import queue
+import threading
+from ars_worker import MotionWorker
+from ars_scan import ScanPlan, specular_points, limit_violations, export_scan_list, scan_job
+from ars_estimator import ScanEstimator
+from ars_live_plot import LiveSpectrumPanel, SpectrumFolderWatcher
 
 class SpectrometerGUI(tk.Tk):
     def __init__(self, spectrometer):
         super().__init__()
         self.spectrometer = spectrometer
         self.title("Angle-Resolved Spectrometer Control")
-        self.geometry("1000x800")
+        self.geometry("1500x850")
+
+        # All serial communication runs on the worker thread so the window stays responsive
+        self.worker = MotionWorker(spectrometer)
+        self.worker.start()
+        self.estimator = ScanEstimator(spectrometer)
+        self.poll_interval = 15 # ms, about one frame
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # Scan plan preview state, recomputed off the UI thread after edits
+        self.preview_delay = 300 # ms after the last edit before the plan is recomputed
+        self.preview_chunk = 200 # rows added to the tree at a time
+        self._preview_after_id = None
+        self._preview_generation = 0
+        self.preview_results = queue.Queue()
+        self.preview = None
+
+        # Live spectrum and reflectance view, fed by a watcher on the data folder. Packed first so it takes the right hand column
+        self.live_panel = LiveSpectrumPanel(self)
+        self.live_panel.pack(side="right", padx=10, pady=10, fill="both", expand=True)
+        self.folder_watcher = SpectrumFolderWatcher()
+        self.folder_watcher.start()
 
         # Specular vs. Uncoupled mode
         self.mode = tk.StringVar(value="specular")
@@ -27,6 +54,10 @@ class SpectrometerGUI(tk.Tk):
         # File saving options
         self.create_file_saving()
 
+        # Progress and pause/abort controls for the worker
+        self.create_progress_panel()
+        self.after(self.poll_interval, self.poll_worker)
+
     def create_file_saving(self):
         '''Create a frame for selecting a folder to save the data to'''
         self.file_frame = ttk.LabelFrame(self, text="File Saving", padding=(10, 10))
@@ -44,11 +75,18 @@ class SpectrometerGUI(tk.Tk):
         browse_button = ttk.Button(self.file_frame, text="Browse", command=self.browse_folder)
         browse_button.pack(side="left", padx=5, pady=5)
 
+        # Also collect the spectra of each scan into a single container file (see ars_container) as they arrive
+        self.write_container = tk.BooleanVar(value=False)
+        container_check = ttk.Checkbutton(self.file_frame, text="Write .arsc", variable=self.write_container)
+        container_check.pack(side="left", padx=5, pady=5)
+
     def browse_folder(self):
         '''Open a folder browser dialog and update the file_path variable with the selected folder'''
         folder_selected = filedialog.askdirectory()
         if folder_selected:  # If the user selected a folder
             self.file_path.set(folder_selected)
+            self.folder_watcher.set_container(None)
+            self.folder_watcher.set_folder(folder_selected)
             print(f"Selected folder: {folder_selected}")
 
     def create_mode_switch(self):
@@ -61,10 +99,10 @@ class SpectrometerGUI(tk.Tk):
         specular_rb.pack(side="left", padx=5, pady=5)
         uncoupled_rb.pack(side="left", padx=5, pady=5)
 
-        home_button = ttk.Button(mode_frame, text="Home", command=self.spectrometer.home_motors)
+        home_button = ttk.Button(mode_frame, text="Home", command=self.home_motors)
         home_button.pack(side="right", padx=5, pady=5) # Add a home button to reset the motors
 
-        show_motor_pos_button = ttk.Button(mode_frame, text="Show Motor Positions", command=self.spectrometer.get_current_position)
+        show_motor_pos_button = ttk.Button(mode_frame, text="Show Motor Positions", command=self.show_motor_positions)
         show_motor_pos_button.pack(side="right", padx=5, pady=5) # Add a button to show the current motor positions
 
         set_motor_pos_button = ttk.Button(mode_frame, text="Set Motor Positions", command=self.set_motor_positions)
@@ -158,8 +196,16 @@ class SpectrometerGUI(tk.Tk):
         self.secondary_stop_angle_label = ttk.Label(self.scan_frame, text="2 Stop Angle (deg):")
         self.secondary_resolution_label = ttk.Label(self.scan_frame, text="2 Step Resolution (deg):")
 
+        # Dwell time per point. 0 waits for the Continue button instead (manual acquisition)
+        self.dwell_time = tk.DoubleVar(value=0.0)
+        dwell_label = ttk.Label(self.scan_frame, text="Dwell per point (s, 0 = manual):")
+        dwell_entry = ttk.Entry(self.scan_frame, textvariable=self.dwell_time, width=10)
+        self.dwell_time.trace_add("write", self.update_scan_tree)
+        dwell_label.grid(row=4, column=0, columnspan=2, padx=5, pady=5)
+        dwell_entry.grid(row=4, column=2, padx=5, pady=5)
+
         start_scan_button = ttk.Button(self.scan_frame, text="Start Scan", command=self.start_scan)
-        start_scan_button.grid(row=4, column=0, columnspan=6, pady=10)
+        start_scan_button.grid(row=5, column=0, columnspan=6, pady=10)
 
         # Initially hide secondary axis controls
         self.toggle_secondary_axis_params(False)
@@ -168,13 +214,143 @@ class SpectrometerGUI(tk.Tk):
         tree_frame = ttk.LabelFrame(self, text="Scan Configuration", padding=(10, 10))
         tree_frame.pack(padx=10, pady=10, fill="both", expand=True)
 
-        self.scan_tree = ttk.Treeview(tree_frame, columns=("Axis", "Start", "Stop", "Resolution"), show="headings")
-        self.scan_tree.heading("Axis", text="Axis")
-        self.scan_tree.heading("Start", text="Start Angle (deg)")
-        self.scan_tree.heading("Stop", text="Stop Angle (deg)")
-        self.scan_tree.heading("Resolution", text="Step Resolution (deg)")
+        self.plan_summary = tk.StringVar(value="No scan planned")
+        summary_label = ttk.Label(tree_frame, textvariable=self.plan_summary)
+        summary_label.pack(fill="x", pady=(0, 5))
+
+        # The tree holds the full point list, but rows are only inserted as the user scrolls towards the end
+        self.scan_tree = ttk.Treeview(tree_frame, columns=("Point", "X", "Y", "Limits"), show="headings")
+        self.scan_tree.heading("Point", text="Point")
+        self.scan_tree.heading("X", text="X Angle (deg)")
+        self.scan_tree.heading("Y", text="Y Angle (deg)")
+        self.scan_tree.heading("Limits", text="Limits")
+        self.scan_tree.tag_configure("violation", foreground="red")
+
+        tree_scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.scan_tree.yview)
+        self.scan_tree.configure(yscrollcommand=lambda first, last: self.on_tree_scroll(tree_scrollbar, first, last))
+        tree_scrollbar.pack(side="right", fill="y")
         self.scan_tree.pack(fill="both", expand=True)
 
+    def create_progress_panel(self):
+        progress_frame = ttk.LabelFrame(self, text="Scan Progress", padding=(10, 10))
+        progress_frame.pack(padx=10, pady=10, fill="x")
+
+        self.status_text = tk.StringVar(value="Idle")
+        self.position_text = tk.StringVar(value="X: -, Y: -")
+
+        self.progress_bar = ttk.Progressbar(progress_frame, orient="horizontal", mode="determinate", length=300)
+        status_label = ttk.Label(progress_frame, textvariable=self.status_text, width=40)
+        position_label = ttk.Label(progress_frame, textvariable=self.position_text, width=32)
+
+        self.continue_button = ttk.Button(progress_frame, text="Continue", command=self.worker.continue_scan, state="disabled")
+        self.pause_button = ttk.Button(progress_frame, text="Pause", command=self.toggle_pause)
+        abort_button = ttk.Button(progress_frame, text="Abort", command=self.abort)
+
+        self.progress_bar.grid(row=0, column=0, columnspan=3, padx=5, pady=5, sticky="we")
+        status_label.grid(row=1, column=0, padx=5, pady=5, sticky="w")
+        position_label.grid(row=1, column=1, padx=5, pady=5, sticky="w")
+        self.continue_button.grid(row=0, column=3, padx=5, pady=5)
+        self.pause_button.grid(row=0, column=4, padx=5, pady=5)
+        abort_button.grid(row=0, column=5, padx=5, pady=5)
+
+    def poll_worker(self):
+        '''Handles events posted by the worker thread. Runs on the Tk thread every poll_interval ms and handles a bounded number of events so a burst never stalls the UI.'''
+        for _ in range(50):
+            try:
+                kind, payload = self.worker.events.get_nowait()
+            except queue.Empty:
+                break
+            self.handle_worker_event(kind, payload)
+
+        for _ in range(5):
+            try:
+                spectrum = self.folder_watcher.spectra.get_nowait()
+            except queue.Empty:
+                break
+            self.live_panel.push_spectrum(spectrum['data_type'], spectrum['angles'], spectrum['wavelength'], spectrum['intensity'])
+
+        try:
+            generation, preview = self.preview_results.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            if generation == self._preview_generation:
+                self.show_preview(preview)
+
+        self.after(self.poll_interval, self.poll_worker)
+
+    def handle_worker_event(self, kind, payload):
+        if kind == 'started':
+            self.status_text.set(f"Running: {payload['job']}")
+        elif kind == 'finished':
+            self.status_text.set(f"Done: {payload['job']}")
+            self.continue_button.config(state="disabled")
+        elif kind == 'aborted':
+            self.status_text.set(f"Aborted: {payload['job']}")
+            self.continue_button.config(state="disabled")
+            self.pause_button.config(text="Pause")
+        elif kind == 'error':
+            self.status_text.set(f"Error in {payload['job']}: {payload['error']}")
+            self.continue_button.config(state="disabled")
+            print(payload['traceback'])
+        elif kind == 'position':
+            angles = payload['angles']
+            unverified = '' if payload.get('trusted', True) else ' (unverified)'
+            self.position_text.set(f"X: {angles['X']:.2f}, Y: {angles['Y']:.2f}{unverified}")
+        elif kind == 'scan_started':
+            self.progress_bar.config(maximum=max(payload['total'], 1), value=0)
+            if payload.get('predicted') is not None:
+                print(f"Scan of {payload['total']} points predicted to take {self.format_duration(payload['predicted'])}.")
+        elif kind == 'progress':
+            self.folder_watcher.set_angles(payload['angles'])
+            self.progress_bar.config(value=payload['index'] + 1)
+            self.status_text.set(f"Point {payload['index'] + 1}/{payload['total']} at {payload['angles']}")
+        elif kind == 'waiting':
+            self.continue_button.config(state="normal")
+            self.status_text.set(self.status_text.get() + " - collect data, then Continue")
+        elif kind == 'scan_complete':
+            message = f"Scan complete: {payload['total']} points in {self.format_duration(payload['elapsed'])}"
+            if payload.get('predicted') is not None:
+                message += f" (predicted {self.format_duration(payload['predicted'])})"
+            self.status_text.set(message)
+            print(message)
+        elif kind == 'paused':
+            self.pause_button.config(text="Resume")
+        elif kind == 'resumed':
+            self.pause_button.config(text="Pause")
+
+    def toggle_pause(self):
+        if self.worker.paused:
+            self.worker.resume()
+        else:
+            self.worker.pause()
+
+    def abort(self):
+        self.worker.abort()
+        # also drop anything queued behind the running job
+        while True:
+            try:
+                self.worker.jobs.get_nowait()
+            except queue.Empty:
+                break
+
+    def on_close(self):
+        self.folder_watcher.set_container(None)
+        self.folder_watcher.stop()
+        self.worker.stop(timeout=2)
+        self.destroy()
+
+    def submit_job(self, name, func, *args, **kwargs):
+        if self.worker.busy:
+            print(f"Busy with {self.worker.current_job}. {name} has been queued.")
+        self.worker.submit(name, func, *args, **kwargs)
+
+    def home_motors(self):
+        self.worker.submit_call("home", self.spectrometer.home_motors)
+
+    def show_motor_positions(self):
+        self.worker.submit_call("position", self.spectrometer.get_current_position)
+
     def set_motor_positions(self):
         x_angle = self.x_angle.get()
         x_steps = self.spectrometer.angle_to_steps("X", x_angle)
@@ -183,16 +359,104 @@ class SpectrometerGUI(tk.Tk):
 
         print(f"Setting X axis to {x_angle}° and Y axis to {y_angle}°")
         # Z is not yet implemented
-        self.spectrometer.set_motor_positions(x_steps, y_steps, 0)
+        self.worker.submit_call("set positions", self.spectrometer.set_motor_positions, x_steps, y_steps, 0)
 
     def update_scan_tree(self, *args):
+        '''Schedules a preview of the scan plan. Called on every edit, so the plan is only recomputed once the input has been quiet for preview_delay ms.'''
+        if self._preview_after_id is not None:
+            self.after_cancel(self._preview_after_id)
+        self._preview_after_id = self.after(self.preview_delay, self.start_preview)
+
+    def read_scan_parameters(self):
+        '''Returns (mode, primary_parameters, secondary_parameters, axis_order) or raises ValueError for partial or invalid input.'''
+        try:
+            primary_parameters = (self.primary_start_angle.get(), self.primary_stop_angle.get(), self.primary_resolution.get())
+            secondary_parameters = (self.secondary_start_angle.get(), self.secondary_stop_angle.get(), self.secondary_resolution.get())
+            dwell = self.dwell_time.get()
+        except tk.TclError:
+            raise ValueError("Incomplete angle entry")
+
+        mode = self.mode.get()
+        if primary_parameters[2] <= 0 or (mode == "uncoupled" and secondary_parameters[2] <= 0):
+            raise ValueError("Step resolution must be positive")
+        if primary_parameters[1] < primary_parameters[0] or (mode == "uncoupled" and secondary_parameters[1] < secondary_parameters[0]):
+            raise ValueError("Stop angle is before start angle")
+
+        axis_order = (self.primary_axis.get(), self.secondary_axis.get())
+        return mode, primary_parameters, secondary_parameters, axis_order, dwell
+
+    def start_preview(self):
+        self._preview_after_id = None
+        self._preview_generation += 1
+        try:
+            parameters = self.read_scan_parameters()
+        except ValueError as e:
+            self.plan_summary.set(f"Invalid scan: {e}")
+            self.clear_scan_tree()
+            return
+
+        self.plan_summary.set("Planning...")
+        thread = threading.Thread(target=self.compute_preview, args=(self._preview_generation, parameters), daemon=True)
+        thread.start()
+
+    def compute_preview(self, generation, parameters):
+        '''Runs off the UI thread. Results are picked up by poll_worker, and dropped there if a newer preview has been started.'''
+        mode, primary_parameters, secondary_parameters, axis_order, dwell = parameters
+        try:
+            if mode == "specular":
+                points = ScanPlan.specular(*primary_parameters)
+            else:
+                points = self.generate_scan_dimensions(primary_parameters, secondary_parameters, axis_order)
+            n_violations = points.count_violations(self.spectrometer)
+            duration = self.estimator.estimate(points, dwell, return_to=points[0] if len(points) else None)['total']
+            preview = {'points': points, 'n_violations': n_violations, 'duration': duration}
+        except Exception as e:
+            preview = {'error': e}
+        self.preview_results.put((generation, preview))
+
+    def clear_scan_tree(self):
+        self.preview = None
+        self._tree_rows = 0
         self.scan_tree.delete(*self.scan_tree.get_children())
-        # Update the scan tree with the selected scan configuration
-        if self.mode.get() == "specular":
-            self.scan_tree.insert("", "end", values=("X/Y", self.primary_start_angle.get(), self.primary_stop_angle.get(), self.primary_resolution.get()))
-        if self.mode.get() == "uncoupled":
-            self.scan_tree.insert("", "end", values=(self.primary_axis.get(), self.primary_start_angle.get(), self.primary_stop_angle.get(), self.primary_resolution.get()))
-            self.scan_tree.insert("", "end", values=(self.secondary_axis.get(), self.secondary_start_angle.get(), self.secondary_stop_angle.get(), self.secondary_resolution.get()))
+
+    def show_preview(self, preview):
+        self.clear_scan_tree()
+        if 'error' in preview:
+            self.plan_summary.set(f"Invalid scan: {preview['error']}")
+            return
+
+        self.preview = preview
+        n_points = len(preview['points'])
+        n_violations = preview['n_violations']
+        summary = f"{n_points} points, estimated {self.format_duration(preview['duration'])}"
+        if n_violations:
+            summary += f", {n_violations} outside the hard limits"
+        self.plan_summary.set(summary)
+        self.populate_scan_tree()
+
+    @staticmethod
+    def format_duration(seconds):
+        hours, remainder = divmod(int(seconds), 3600)
+        minutes, seconds = divmod(remainder, 60)
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+    def populate_scan_tree(self):
+        '''Inserts the next chunk of preview points into the tree. Only the shown points are computed and checked.'''
+        if self.preview is None:
+            return
+        plan = self.preview['points']
+        stop = min(self._tree_rows + self.preview_chunk, len(plan))
+        points = plan.block(self._tree_rows, stop)
+        violations = limit_violations(self.spectrometer, points)
+        for offset, idx in enumerate(range(self._tree_rows, stop)):
+            tags = ("violation",) if violations[offset] else ()
+            self.scan_tree.insert("", "end", values=(idx + 1, f"{points[offset, 0]:.3f}", f"{points[offset, 1]:.3f}", "outside" if violations[offset] else "ok"), tags=tags)
+        self._tree_rows = stop
+
+    def on_tree_scroll(self, scrollbar, first, last):
+        scrollbar.set(first, last)
+        if float(last) > 0.9 and self.preview is not None and self._tree_rows < len(self.preview['points']):
+            self.populate_scan_tree()
 
     def update_mode(self):
         mode = self.mode.get()
@@ -201,6 +465,7 @@ class SpectrometerGUI(tk.Tk):
             self.toggle_secondary_axis_params(True)
         else:
             self.toggle_secondary_axis_params(False)
+        self.update_scan_tree()
 
     def update_secondary_axis(self):
         primary = self.primary_axis.get()
@@ -214,6 +479,7 @@ class SpectrometerGUI(tk.Tk):
             self.secondary_x_rb.config(state="normal")
             self.secondary_y_rb.config(state="disabled")
             self.secondary_axis.set("X")
+        self.update_scan_tree()
 
     def toggle_secondary_axis_params(self, show):
         """Show or hide secondary axis parameters."""
@@ -237,7 +503,7 @@ class SpectrometerGUI(tk.Tk):
         y = self.y_angle.get()
         print(f"Moving to X: {x} deg, Y: {y} deg")
         self.update_scan_tree()
-        self.spectrometer.go_to_angle(x, y)
+        self.worker.submit_call("goto", self.spectrometer.go_to_angle, x, y)
 
     def start_scan(self):
 
@@ -254,6 +520,20 @@ class SpectrometerGUI(tk.Tk):
         primary_resolution = self.primary_resolution.get()
         primary_parameters = (primary_start, primary_stop, primary_resolution)
 
+        if self.write_container.get():
+            # reference and sample scans of the same folder go into the same file
+            container_path = os.path.join(self.spectrometer.data_dir, 'spectra.arsc')
+            self.folder_watcher.set_container(container_path, recipe={'mode': self.mode.get(), 'primary_axis': primary, 'primary': primary_parameters})
+            print(f"Writing spectra to {container_path}")
+        else:
+            self.folder_watcher.set_container(None)
+
+        # size the live map (angle of the X arm) for the whole scan now, so it is not redrawn in full as rows arrive
+        if self.mode.get() == "specular" or primary == "X":
+            self.live_panel.set_map_range(primary_start, primary_stop, primary_resolution)
+        else:
+            self.live_panel.set_map_range(self.secondary_start_angle.get(), self.secondary_stop_angle.get(), self.secondary_resolution.get())
+
         if self.mode.get() == "specular":
             self.run_specular_scan(primary_start, primary_stop, primary_resolution)
         elif self.mode.get() == "uncoupled":
@@ -266,38 +546,16 @@ class SpectrometerGUI(tk.Tk):
 
     def generate_scan_dimensions(self, primary_parameters, secondary_parameters, axis_order):
         # Generate the scan dimensions based on the primary and secondary axis
-        primary_angles = np.arange(primary_parameters[0], primary_parameters[1]+primary_parameters[2], primary_parameters[2])
-        secondary_angles = np.arange(secondary_parameters[0], secondary_parameters[1]+secondary_parameters[2], secondary_parameters[2])
-
-        flattened_angles = []
-
-        for i, secondary_angle in enumerate(secondary_angles):
-            for j, primary_angle in enumerate(primary_angles):
-                if axis_order == ("X", "Y"):
-                    flattened_angles.append((primary_angle, secondary_angle))
-                elif axis_order == ("Y", "X"):
-                    flattened_angles.append((secondary_angle, primary_angle))
-
-        return flattened_angles
+        return ScanPlan.uncoupled(primary_parameters, secondary_parameters, axis_order)
 
     def run_specular_scan(self, start, stop, resolution):
         print(f"Running specular scan from {start}° to {stop}° with resolution {resolution}°.")
 
-        self.scan_list = np.arange(start, stop+resolution, resolution)
+        self.scan_list = specular_points(start, stop, resolution)
         print("Scan to commense:")
-        print(f"Angles: {self.scan_list}")
-        input("Press Enter to start the scan...")
-
-        for angle in np.arange(start, stop+resolution, resolution):
-            self.spectrometer.go_to_angle(angle, angle)
-            self.spectrometer.wait_for_motors()
-            input("Press Enter to continue to next angle...")
+        print(f"Angles: {[angle for angle, _ in self.scan_list]}")
 
-        self.spectrometer.go_to_angle(start, start)  # Return to the origin
-        print("Scan complete.")
-        
-        self.export_scan_list()
-        self.rename_files()
+        self.submit_job("specular scan", scan_job, self.scan_list, dwell=self.dwell_time.get(), return_to=(start, start), data_dir=self.spectrometer.data_dir, estimator=self.estimator)
 
     def rename_files(self):
         data_files = [file for file in os.listdir(self.file_path) if file.endswith('.txt')]
@@ -326,59 +584,62 @@ class SpectrometerGUI(tk.Tk):
         self.scan_list = self.generate_scan_dimensions(primary_parameters, secondary_parameters, axis_order)
         
         print(f"Running uncoupled scan with primary axis from {p_start}° to {p_stop}° and secondary axis from {s_start}° to {s_stop}°.")
-        # primary_angles = np.arange(p_start, p_stop+p_res, p_res)
-        # secondary_angles = np.arange(s_start, s_stop+s_res, s_res)
 
         print("Scan to commense:")
         print(self.scan_list)
-        input("Press Enter to start the scan...")
-
-        self.export_scan_list(self.scan_list, "scan_list.dat") # Export the scan list to a file, 
-
-        # for sec_angle in np.arange(s_start, s_stop+s_res, s_res):
-        #     pri_angle = p_start
-        #     self.spectrometer.go_to_angle(pri_angle, sec_angle) 
 
-        #     for pri_angle in np.arange(p_start, p_stop+p_res, p_res):
-        #         self.spectrometer.go_to_angle(pri_angle, sec_angle)  
-        #         self.spectrometer.wait_for_motors()
-        #         input("Press Enter to continue to next primary axis angle...")
-
-        for primary_angle, secondary_angle in self.scan_list:
-            self.spectrometer.go_to_angle(primary_angle, secondary_angle)
-            self.spectrometer.wait_for_motors()
-            input("Press Enter to continue to next angle...")
-
-        self.spectrometer.go_to_angle(p_start, s_start)  # Return to the origin
-        print("Scan complete.")
+        if axis_order == ("X", "Y"):
+            origin = (p_start, s_start)
+        else:
+            origin = (s_start, p_start)
+        self.submit_job("uncoupled scan", scan_job, self.scan_list, dwell=self.dwell_time.get(), return_to=origin, data_dir=self.spectrometer.data_dir, estimator=self.estimator)
     
     def export_scan_list(self, scan_list, filename):
-        with open(filename, "w") as f:
-            for primary_angle, secondary_angle in scan_list:
-                f.write(f"{primary_angle},{secondary_angle}\n")
+        export_scan_list(scan_list, filename)
 
 # For testing purposes, we'll create a dummy Spectrometer class
 class DummySpectrometer:
+    def __init__(self):
+        self.current_angle = {'X': 0, 'Y': 0}
+        self.data_dir = None
+        self.steps_per_degree = {'X': 9584 / 180, 'Y': 9584 / 180}
+        self.hard_limits = {'X': (self.angle_to_steps('X', 10), self.angle_to_steps('X', 90)),
+                            'Y': (self.angle_to_steps('Y', 10), self.angle_to_steps('Y', 90))}
+
     def home_motors(self, **args):
         print("Homing motors...")
-        pass
+        time.sleep(1)
+        self.current_angle = {'X': 10, 'Y': 10}
 
     def get_current_position(self, **args):
         print("Getting current motor positions...")
         pass
 
+    def set_motor_positions(self, x_pos, y_pos, z_pos):
+        print(f"Setting motor positions to {x_pos}, {y_pos}, {z_pos}")
+
+    def angle_to_steps(self, axis, angle, motor_sign=1):
+        return int(angle * 9584 / 180) * motor_sign
+
+    def wait_for_motors(self):
+        pass
+
     def debug(self, **args):
         print("Debugging...")
         breakpoint()
 
 
     def go_to_angle(self, x, y):
+        dx = abs(x - self.current_angle['X']) if x is not None else 0
+        dy = abs(y - self.current_angle['Y']) if y is not None else 0
         if x is None:
             print(f"Moving Y axis to {y}°")
         elif y is None:
             print(f"Moving X axis to {x}°")
         else:
             print(f"Moving X axis to {x}° and Y axis to {y}°")
+        time.sleep(0.2 + max(dx, dy) * 0.05) # simulate the motion time
+        self.current_angle = {'X': x, 'Y': y}
 
 # Instantiate the GUI with the dummy spectrometer
 if __name__ == "__main__":
@@ -0,0 +1,99 @@
+import numpy as np
+from collections import OrderedDict
+
+HC_EV_NM = 1239.841984 # h c in eV nm
+
+
+def kspace_coordinates(angles, wavelength):
+    '''In-plane wavevector k = (2 pi / lambda) sin(theta) in 1/um for every (angle, wavelength) pair, as an (n_angles, n_wavelengths)
+    array, and the photon energy (eV) of each wavelength. angles in degrees from the normal, wavelength in nm.'''
+    angles = np.asarray(angles, dtype=float)
+    wavelength = np.asarray(wavelength, dtype=float)
+    k = (2 * np.pi * 1e3 / wavelength)[None, :] * np.sin(np.radians(angles))[:, None]
+    return k, HC_EV_NM / wavelength
+
+
+class KSpaceRegridder:
+    '''Resamples reflectance on an (angle, wavelength) grid onto a uniform (k, E) grid by bilinear interpolation in (angle, wavelength).
+
+    Every (k, E) grid point is mapped back to the angle and wavelength it corresponds to, so the source grid can be non-uniform in
+    angle. The four source indices and weights of every grid point are computed once per geometry (angles, wavelengths and target grid)
+    and kept in a small cache, so regridding many scans taken with the same settings is a gather and a weighted sum. Grid points
+    outside the measured angle or wavelength range are NaN.'''
+
+    def __init__(self, cache_size=8):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def default_grid(angles, wavelength, n_k=200, n_e=200, k_range=None, e_range=None):
+        k, energy = kspace_coordinates(angles, wavelength)
+        if k_range is None:
+            k_range = (np.nanmin(k), np.nanmax(k))
+        if e_range is None:
+            e_range = (np.nanmin(energy), np.nanmax(energy))
+        return np.linspace(*k_range, n_k), np.linspace(*e_range, n_e)
+
+    def weights(self, angles, wavelength, k_grid, e_grid):
+        '''(indices, weights, valid) for the bilinear interpolation, cached per geometry.'''
+        key = tuple(np.ascontiguousarray(array, dtype=float).tobytes() for array in (angles, wavelength, k_grid, e_grid))
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached
+        self.misses += 1
+
+        angles = np.asarray(angles, dtype=float)
+        wavelength = np.asarray(wavelength, dtype=float)
+        angle_order = np.argsort(angles)
+        wavelength_order = np.argsort(wavelength)
+        sorted_angles = angles[angle_order]
+        sorted_wavelength = wavelength[wavelength_order]
+
+        # source coordinates of every target point
+        target_wavelength = HC_EV_NM / np.asarray(e_grid, dtype=float)[:, None]
+        with np.errstate(invalid='ignore'):
+            sin_theta = np.asarray(k_grid, dtype=float)[None, :] * target_wavelength / (2 * np.pi * 1e3)
+            target_angle = np.degrees(np.arcsin(sin_theta))
+        target_wavelength = np.broadcast_to(target_wavelength, target_angle.shape)
+
+        valid = (np.abs(sin_theta) <= 1) & (target_angle >= sorted_angles[0]) & (target_angle <= sorted_angles[-1]) \
+                & (target_wavelength >= sorted_wavelength[0]) & (target_wavelength <= sorted_wavelength[-1])
+        target_angle = np.where(valid, target_angle, sorted_angles[0])
+        target_wavelength = np.where(valid, target_wavelength, sorted_wavelength[0])
+
+        def bracket(sorted_values, targets):
+            upper = np.clip(np.searchsorted(sorted_values, targets, side='right'), 1, len(sorted_values) - 1)
+            lower = upper - 1
+            span = sorted_values[upper] - sorted_values[lower]
+            fraction = np.where(span > 0, (targets - sorted_values[lower]) / np.where(span > 0, span, 1), 0.0)
+            return lower, upper, fraction
+
+        if len(sorted_angles) == 1:
+            a0 = a1 = np.zeros(target_angle.shape, dtype=int)
+            fa = np.zeros(target_angle.shape)
+        else:
+            a0, a1, fa = bracket(sorted_angles, target_angle)
+        w0, w1, fw = bracket(sorted_wavelength, target_wavelength)
+
+        indices = (angle_order[a0], angle_order[a1], wavelength_order[w0], wavelength_order[w1])
+        weights = ((1 - fa) * (1 - fw), (1 - fa) * fw, fa * (1 - fw), fa * fw)
+        cached = (indices, weights, valid)
+        self._cache[key] = cached
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return cached
+
+    def regrid(self, values, angles, wavelength, k_grid, e_grid):
+        '''values is (n_angles, n_wavelengths). Returns an (len(e_grid), len(k_grid)) array.'''
+        values = np.asarray(values, dtype=float)
+        (a0, a1, w0, w1), (w00, w01, w10, w11), valid = self.weights(angles, wavelength, k_grid, e_grid)
+        result = values[a0, w0] * w00 + values[a0, w1] * w01 + values[a1, w0] * w10 + values[a1, w1] * w11
+        result[~valid] = np.nan
+        return result
+
+
+default_regridder = KSpaceRegridder()
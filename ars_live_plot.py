@@ -0,0 +1,288 @@
+import os
+import time
+import queue
+import threading
+import numpy as np
+from tkinter import ttk
+from ars_analysis import ReflectionFile, AngleReflectance
+
+
+class SpectrumFolderWatcher(threading.Thread):
+    '''Polls a data folder for new spectrum files written by the spectrometer software and parses them off the UI thread.
+
+    Files present when the folder is set are ignored. New files are tagged with the scan point the stage was at (set_angles),
+    since they are only renamed with their angles after the scan. Parsed spectra are put on the spectra queue as dicts. With a
+    ScanContainer (set_container) every new file, darks included, is also appended to it as it arrives; the GUI sets one when a scan
+    starts with "Write .arsc" checked.'''
+
+    def __init__(self, poll_interval=0.25):
+        super().__init__(daemon=True)
+        self.poll_interval = poll_interval
+        self.spectra = queue.Queue()
+        self.folder = None
+        self.angles = None
+        self.container = None
+        self._container_recipe = None
+        self._owns_container = False
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def set_folder(self, folder):
+        with self._lock:
+            self.folder = folder
+            self._seen = set(self._list_files(folder))
+
+    def set_container(self, container, recipe=None):
+        '''Appends new spectra to container, or stops appending if None. container is a ScanContainer open for appending or the path
+        of one, which is opened when the next spectrum arrives: appended to if it exists, otherwise created on the wavelength axis of
+        that spectrum, with recipe in its header. Containers opened from a path are closed when replaced.'''
+        with self._lock:
+            current = self.container
+            if container is not None and current is not None and getattr(current, 'filepath', current) == getattr(container, 'filepath', container):
+                return # already writing there, e.g. the sample pass after the reference pass
+            if self._owns_container and not isinstance(current, str):
+                current.close()
+            self.container = container
+            self._container_recipe = recipe
+            self._owns_container = isinstance(container, str)
+
+    def _open_container(self, wavelength):
+        '''The container to append to, opening or creating it if it was given as a path. Called with the lock held.'''
+        from ars_container import ScanContainer
+
+        if not isinstance(self.container, str):
+            return self.container
+        filepath = self.container
+        try:
+            if os.path.exists(filepath):
+                self.container = ScanContainer(filepath, mode='a')
+            else:
+                self.container = ScanContainer.create(filepath, wavelength, recipe=self._container_recipe)
+        except (OSError, ValueError) as e:
+            print(f"Could not open the scan container {filepath}: {e}")
+            self.container, self._owns_container = None, False
+        return self.container
+
+    def set_angles(self, angles):
+        self.angles = tuple(float(angle) for angle in angles)
+
+    def stop(self):
+        self._stop_event.set()
+
+    @staticmethod
+    def _list_files(folder):
+        if folder is None or not os.path.isdir(folder):
+            return []
+        return [file for file in os.listdir(folder) if file.endswith('.txt')]
+
+    @staticmethod
+    def _mtime(folder, filename):
+        '''Modification time of a file, or 0 if it has gone (e.g. renamed by the scan) since the folder was listed.'''
+        try:
+            return os.path.getmtime(os.path.join(folder, filename))
+        except OSError:
+            return 0.0
+
+    def run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            with self._lock:
+                folder = self.folder
+                new_files = [file for file in self._list_files(folder) if file not in self._seen]
+            for filename in sorted(new_files, key=lambda x: self._mtime(folder, x)):
+                filepath = os.path.join(folder, filename)
+                try:
+                    header, data = ReflectionFile.read_file(filepath)
+                except (OSError, ValueError):
+                    continue # still being written, try again on the next poll
+                with self._lock:
+                    self._seen.add(filename)
+                if data.ndim != 2 or len(data) == 0:
+                    continue
+
+                basename = filename.split('_')[0].lower()
+                data_type = 'dark' if 'dark' in basename else 'reference' if 'ref' in basename else 'sample'
+                with self._lock:
+                    container = self._open_container(data[:, 0]) if self.container is not None else None
+                    if container is not None:
+                        try:
+                            container.append(data[:, 1], angles=None if data_type == 'dark' else self.angles, data_type=data_type,
+                                             integration_time=float(header.get('Integration Time (sec)', 0)), timestamp=self._mtime(folder, filename), source=filename)
+                        except (OSError, ValueError) as e:
+                            print(f"Could not add {filename} to the scan container: {e}")
+                if data_type == 'dark':
+                    continue
+                self.spectra.put({'data_type': data_type, 'angles': self.angles, 'wavelength': data[:, 0], 'intensity': data[:, 1], 'filename': filename})
+
+
+class LiveSpectrumPanel(ttk.LabelFrame):
+    '''Live view of the latest spectrum, its reflectance against the matching reference and a growing angle versus wavelength
+    reflectance map. Artists are redrawn by blitting onto a cached background, at most max_fps times a second, so the panel
+    costs a bounded amount of Tk thread time however fast spectra arrive. Feed it with push_spectrum from the Tk thread.'''
+
+    def __init__(self, master, max_fps=10, map_axis=0, map_margin=5.0):
+        from matplotlib.figure import Figure
+        from matplotlib.image import PcolorImage
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        super().__init__(master, text="Live View", padding=(5, 5))
+        self.frame_interval = int(1000 / max_fps)
+        self.map_axis = map_axis # which angle of the angle tuple is used for the map
+        self.map_margin = map_margin # deg the map angle axis is grown by beyond the data, so it is not rescaled on every row
+
+        self.references = {}
+        self.map_rows = {}
+        self.map_wavelength = None
+        self.map_range = None # (low, high) angle limits of the map, from the scan plan (set_map_range)
+        self._dirty = False
+        self._needs_full_draw = True
+        self._background = None
+        self._scaled_axes = set()
+
+        self.figure = Figure(figsize=(5, 7), dpi=90)
+        self.spectrum_ax = self.figure.add_subplot(3, 1, 1)
+        self.reflectance_ax = self.figure.add_subplot(3, 1, 2)
+        self.map_ax = self.figure.add_subplot(3, 1, 3)
+
+        self.spectrum_line, = self.spectrum_ax.plot([], [], animated=True)
+        self.reference_line, = self.spectrum_ax.plot([], [], color='grey', alpha=0.6, animated=True)
+        self.reflectance_line, = self.reflectance_ax.plot([], [], color='tab:red', animated=True)
+        # cells reach half way to their neighbours, as in AngleReflectance.plot_reflectance_map, so refined scans show true resolution
+        self.map_image = PcolorImage(self.map_ax, [0, 1], [0, 1], np.zeros((1, 1)), cmap='plasma', animated=True)
+        self.map_ax.add_image(self.map_image)
+        self.title_text = self.spectrum_ax.set_title("Waiting for spectra", animated=True)
+
+        self.spectrum_ax.set_ylabel('Intensity (a.u.)')
+        self.reflectance_ax.set_ylabel('Reflectance (%)')
+        self.map_ax.set_xlabel('Wavelength (nm)')
+        self.map_ax.set_ylabel('Angle (deg)')
+        self.figure.tight_layout()
+
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self)
+        self.canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+        clear_button = ttk.Button(self, text="Clear", command=self.clear)
+        clear_button.pack(side="right", padx=5, pady=5)
+
+        self.after(self.frame_interval, self._refresh)
+
+    def clear(self):
+        self.references = {}
+        self.map_rows = {}
+        self.map_wavelength = None
+        for line in (self.spectrum_line, self.reference_line, self.reflectance_line):
+            line.set_data([], [])
+        self.map_image.set_data([0, 1], [0, 1], np.zeros((1, 1)))
+        self._scaled_axes = set()
+        self._needs_full_draw = True
+
+    def set_map_range(self, start, stop, step=0.0):
+        '''Sizes the map angle axis for a scan from start to stop (deg) with step, before its first spectrum, so the axis does not
+        have to grow as rows arrive. Call when a scan starts; costs one full redraw.'''
+        low, high = min(start, stop) - abs(step) / 2, max(start, stop) + abs(step) / 2
+        if high - low <= 0:
+            low, high = low - 0.5, high + 0.5
+        self.map_range = (float(low), float(high))
+        self.map_ax.set_ylim(*self.map_range)
+        self._needs_full_draw = True
+
+    def push_spectrum(self, data_type, angles, wavelength, intensity):
+        '''Adds a spectrum. Only updates the artist data; the redraw happens on the next frame.'''
+        if data_type == 'reference':
+            self.references[angles] = intensity
+            self.reference_line.set_data(wavelength, intensity)
+            self._rescale(self.spectrum_ax, wavelength, intensity)
+            self.title_text.set_text(f"reference {angles}")
+            self._dirty = True
+            return
+
+        self.spectrum_line.set_data(wavelength, intensity)
+        self._rescale(self.spectrum_ax, wavelength, intensity)
+        self.title_text.set_text(f"sample {angles}")
+
+        reference = self.references.get(angles)
+        if reference is not None and len(reference) == len(intensity):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                reflectance = intensity / reference * 100
+            self.reflectance_line.set_data(wavelength, reflectance)
+            self._rescale(self.reflectance_ax, wavelength, reflectance)
+            if angles is not None:
+                self._add_map_row(angles[self.map_axis], wavelength, reflectance)
+        self._dirty = True
+
+    def _add_map_row(self, angle, wavelength, reflectance):
+        if self.map_wavelength is None:
+            self.map_wavelength = wavelength
+        elif len(wavelength) != len(self.map_wavelength) or not np.array_equal(wavelength, self.map_wavelength):
+            reflectance = np.interp(self.map_wavelength, wavelength, reflectance)
+        self.map_rows[angle] = reflectance
+
+        angles = sorted(self.map_rows)
+        image = np.array([self.map_rows[angle] for angle in angles])
+        finite = image[np.isfinite(image)]
+        angle_edges = AngleReflectance._cell_edges(angles)
+        wavelength_edges = AngleReflectance._cell_edges(self.map_wavelength)
+        self.map_image.set_data(wavelength_edges, angle_edges, image)
+        if len(finite):
+            self.map_image.set_clim(np.percentile(finite, 1), np.percentile(finite, 99))
+
+        # the image is blitted like the lines; only changing the axis limits needs a full redraw. The wavelength axis is set by the
+        # first row, the angle axis by set_map_range, and the angle axis only grows, in map_margin chunks, for rows outside it
+        x_lim = (wavelength_edges[0], wavelength_edges[-1])
+        if tuple(self.map_ax.get_xlim()) != x_lim:
+            self.map_ax.set_xlim(*x_lim)
+            self._needs_full_draw = True
+        if self.map_range is None:
+            self.map_range = (angle_edges[0] - self.map_margin, angle_edges[-1] + self.map_margin)
+            self.map_ax.set_ylim(*self.map_range)
+            self._needs_full_draw = True
+        elif angle_edges[0] < self.map_range[0] or angle_edges[-1] > self.map_range[1]:
+            low, high = self.map_range
+            self.map_range = (angle_edges[0] - self.map_margin if angle_edges[0] < low else low, angle_edges[-1] + self.map_margin if angle_edges[-1] > high else high)
+            self.map_ax.set_ylim(*self.map_range)
+            self._needs_full_draw = True
+
+    def _rescale(self, ax, x, y):
+        '''Expands the axis limits when new data falls outside them, which forces one full redraw.'''
+        finite = np.isfinite(y)
+        if not finite.any():
+            return
+        x_lim = (float(np.min(x)), float(np.max(x)))
+        y_lim = (float(np.min(y[finite])), float(np.max(y[finite])))
+        if ax in self._scaled_axes:
+            (x_min, x_max), (y_min, y_max) = ax.get_xlim(), ax.get_ylim()
+            if x_lim[0] >= x_min and x_lim[1] <= x_max and y_lim[0] >= y_min and y_lim[1] <= y_max:
+                return
+            x_lim = (min(x_lim[0], x_min), max(x_lim[1], x_max))
+            y_lim = (min(y_lim[0], y_min), max(y_lim[1], y_max))
+
+        margin = (y_lim[1] - y_lim[0]) * 0.05 or 1
+        ax.set_xlim(*x_lim)
+        ax.set_ylim(y_lim[0] - margin, y_lim[1] + margin)
+        self._scaled_axes.add(ax)
+        self._needs_full_draw = True
+
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for artist in (self.map_image, self.spectrum_line, self.reference_line, self.reflectance_line, self.title_text):
+            self.figure.draw_artist(artist)
+
+    def _refresh(self):
+        start = time.perf_counter()
+        if self._needs_full_draw or self._background is None:
+            self._needs_full_draw = False
+            self._dirty = False
+            self.canvas.draw() # triggers _on_draw, which caches the background and draws the artists
+            self.canvas.blit(self.figure.bbox)
+        elif self._dirty:
+            self._dirty = False
+            self.canvas.restore_region(self._background)
+            self._draw_artists()
+            self.canvas.blit(self.figure.bbox)
+        # keep a steady frame rate, leaving the Tk thread at least one frame free after an expensive redraw
+        elapsed = int((time.perf_counter() - start) * 1000)
+        self.after(max(self.frame_interval - elapsed, 15), self._refresh)
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import queue
+import itertools
+import threading
+from ars_worker import MotionWorker
+
+
+class Journal:
+    '''Append-only json lines log shared by all rigs. Every entry gets a wall clock timestamp.'''
+
+    def __init__(self, filepath=None):
+        self.filepath = filepath
+        self.entries = [] # kept in memory when there is no file
+        self._lock = threading.Lock()
+
+    def write(self, event, **fields):
+        entry = {'time': time.time(), 'event': event}
+        entry.update(fields)
+        line = json.dumps(entry, default=str)
+        with self._lock:
+            if self.filepath is None:
+                self.entries.append(entry)
+            else:
+                with open(self.filepath, 'a') as file:
+                    file.write(line + '\n')
+        return entry
+
+    def read(self):
+        if self.filepath is None:
+            with self._lock:
+                return list(self.entries)
+        if not os.path.exists(self.filepath):
+            return []
+        with open(self.filepath, 'r') as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+
+class ResultsStore:
+    '''Results of finished jobs keyed by job id, optionally written to results_dir as one json file per job.'''
+
+    def __init__(self, results_dir=None):
+        self.results_dir = results_dir
+        self.results = {}
+        self._lock = threading.Lock()
+        if results_dir is not None and not os.path.exists(results_dir):
+            os.makedirs(results_dir)
+
+    def put(self, job_id, rig, status, result=None, error=None):
+        record = {'job': job_id, 'rig': rig, 'status': status, 'result': result, 'error': None if error is None else str(error)}
+        with self._lock:
+            self.results[job_id] = record
+        if self.results_dir is not None:
+            with open(os.path.join(self.results_dir, f"{job_id}.json"), 'w') as file:
+                json.dump(record, file, default=str)
+        return record
+
+    def get(self, job_id):
+        with self._lock:
+            return self.results.get(job_id)
+
+
+class RigStats:
+    def __init__(self):
+        self.jobs = 0
+        self.errors = 0
+        self.points = 0
+        self.busy_time = 0.0
+        self._job_start = None
+
+    def as_dict(self):
+        points_per_hour = self.points / self.busy_time * 3600 if self.busy_time > 0 else 0.0
+        return {'jobs': self.jobs, 'errors': self.errors, 'points': self.points, 'busy_time': self.busy_time, 'points_per_hour': points_per_hour}
+
+
+class MultiRigController:
+    '''Runs jobs on several spectrometers at once from one process.
+
+    Each rig gets its own MotionWorker, so each serial port is only ever used from one thread and slow rigs never hold up the others.
+    Jobs go into one shared queue and are handed to the next idle rig (or to a specific rig with submit(..., rig=name)). All worker
+    events are journaled, finished jobs are put in the shared ResultsStore, and per-rig throughput is tracked in stats().
+
+    Jobs are the same callables the GUI uses, e.g. submit('scan', scan_job, points, dwell=1.0). Every rig needs its own position
+    journal (see AngleResolvedSpectrometer state_dir and state_name), since it describes one rig.'''
+
+    def __init__(self, rigs, journal_path=None, results_dir=None):
+        journals = [getattr(getattr(spectrometer, 'position', None), 'journal_path', None) for spectrometer in rigs.values()]
+        shared = {journal for journal in journals if journal is not None and journals.count(journal) > 1}
+        if shared:
+            raise ValueError(f"Rigs share the position journal {sorted(shared)}; give each rig its own state_dir.")
+        self.events = queue.Queue()
+        self.workers = {name: MotionWorker(spectrometer, name=name, events=self.events) for name, spectrometer in rigs.items()}
+        self.journal = Journal(journal_path)
+        self.results = ResultsStore(results_dir)
+        self.rig_stats = {name: RigStats() for name in rigs}
+        self.subscribers = []
+
+        self._pending = [] # (job_id, rig, name, func, args, kwargs), in submission order
+        self._idle = set(rigs)
+        self._outstanding = 0
+        self._condition = threading.Condition()
+        self._job_ids = itertools.count(1)
+        self._stop_event = threading.Event()
+        self._threads = [threading.Thread(target=self._dispatch, daemon=True), threading.Thread(target=self._pump_events, daemon=True)]
+
+    def start(self):
+        for worker in self.workers.values():
+            worker.start()
+        for thread in self._threads:
+            thread.start()
+        self.journal.write('started', rigs=list(self.workers))
+        return self
+
+    def stop(self, timeout=2):
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+        for worker in self.workers.values():
+            worker.stop(timeout)
+        for thread in self._threads:
+            thread.join(timeout)
+        self.journal.write('stopped')
+
+    def submit(self, name, func, *args, rig=None, **kwargs):
+        '''Queues a job for any idle rig, or only for the named rig. Returns the job id.'''
+        if rig is not None and rig not in self.workers:
+            raise KeyError(f"Unknown rig {rig}.")
+        job_id = f"job-{next(self._job_ids)}"
+        with self._condition:
+            self._pending.append((job_id, rig, name, func, args, kwargs))
+            self._outstanding += 1
+            self._condition.notify_all()
+        self.journal.write('queued', job=job_id, name=name, rig=rig)
+        return job_id
+
+    def subscribe(self, callback):
+        '''callback(kind, payload) is called from the event thread for every worker event.'''
+        self.subscribers.append(callback)
+
+    def wait(self, timeout=None):
+        '''Blocks until every submitted job has finished. Returns False on timeout.'''
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self._condition:
+            while self._outstanding > 0:
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def stats(self):
+        return {name: stats.as_dict() for name, stats in self.rig_stats.items()}
+
+    def _next_job(self):
+        for index, job in enumerate(self._pending):
+            rig = job[1]
+            if rig is None and self._idle:
+                return self._pending.pop(index), sorted(self._idle)[0]
+            if rig is not None and rig in self._idle:
+                return self._pending.pop(index), rig
+        return None, None
+
+    def _dispatch(self):
+        while not self._stop_event.is_set():
+            with self._condition:
+                job, rig = self._next_job()
+                if job is None:
+                    self._condition.wait(0.5)
+                    continue
+                self._idle.discard(rig)
+            job_id, _, name, func, args, kwargs = job
+            self.journal.write('dispatched', job=job_id, name=name, rig=rig)
+            self.workers[rig].submit(job_id, func, *args, **kwargs)
+
+    def _pump_events(self):
+        while not self._stop_event.is_set():
+            try:
+                kind, payload = self.events.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            self._handle_event(kind, payload)
+            for callback in self.subscribers:
+                callback(kind, payload)
+
+    def _handle_event(self, kind, payload):
+        rig = payload.get('rig')
+        stats = self.rig_stats[rig]
+        if kind == 'progress':
+            stats.points += 1
+            return
+        if kind == 'position':
+            return # too frequent to journal
+
+        self.journal.write(kind, **{key: value for key, value in payload.items() if key != 'traceback'})
+        if kind == 'started':
+            stats._job_start = time.perf_counter()
+            return
+        if kind not in ('finished', 'aborted', 'error'):
+            return
+
+        if stats._job_start is not None:
+            stats.busy_time += time.perf_counter() - stats._job_start
+            stats._job_start = None
+        stats.jobs += 1
+        if kind == 'error':
+            stats.errors += 1
+        self.results.put(payload['job'], rig, kind, result=payload.get('result'), error=payload.get('error'))
+
+        with self._condition:
+            self._idle.add(rig)
+            self._outstanding -= 1
+            self._condition.notify_all()
+
+
+def simulated_rigs(n_rigs, speed=4000.0, state_dir=None, **kwargs):
+    '''Starts n_rigs SimulatedControllers on ptys and connects an AngleResolvedSpectrometer to each. Each rig keeps its position
+    journal and motion timings in its own folder of state_dir (by default a new temporary directory, so simulated rigs never touch the
+    state of real ones). Returns (rigs, simulators).'''
+    import tempfile
+    from ars_simulator import SimulatedController
+    from ars_controller import AngleResolvedSpectrometer
+
+    if state_dir is None:
+        state_dir = tempfile.mkdtemp(prefix='ars_simulated_rigs_')
+    simulators = []
+    rigs = {}
+    for index in range(n_rigs):
+        simulator = SimulatedController(speed=speed, name=f"rig{index + 1}")
+        simulator.start()
+        simulators.append(simulator)
+        rig_dir = os.path.join(state_dir, simulator.name)
+        os.makedirs(rig_dir, exist_ok=True)
+        rigs[simulator.name] = AngleResolvedSpectrometer(serial_port=simulator.port, ready_ping_after=0, state_dir=rig_dir, **kwargs)
+    return rigs, simulators
+
+
+if __name__ == '__main__':
+    # Demo against simulated controllers: three rigs sharing six specular scans
+    from ars_scan import specular_points, scan_job
+
+    rigs, simulators = simulated_rigs(3)
+    controller = MultiRigController(rigs).start()
+    start = time.perf_counter()
+    for index in range(6):
+        controller.submit(f"specular scan {index + 1}", scan_job, specular_points(15, 25, 5), dwell=0.2)
+    controller.wait()
+    print(f"6 scans on 3 rigs in {time.perf_counter() - start:.1f} s")
+    stats = controller.stats()
+    for name, rig_stats in stats.items():
+        print(name, rig_stats)
+    controller.stop()
+    for simulator in simulators:
+        simulator.stop()
+    errors = sum(rig_stats['errors'] for rig_stats in stats.values())
+    if errors or sum(rig_stats['jobs'] for rig_stats in stats.values()) != 6:
+        raise SystemExit(f"{errors} of the 6 scans failed.")
@@ -0,0 +1,192 @@
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+
+
+def user_data_dir():
+    '''Per-user directory for the state kept between sessions (position journal, motion timings): %LOCALAPPDATA%\\ars on Windows,
+    otherwise $XDG_DATA_HOME/ars (~/.local/share/ars). Created if needed.'''
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    path = os.path.join(base, 'ars')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def rig_state_name(serial_port):
+    '''File name part for the state of the rig on serial_port, e.g. COM4 -> COM4, /dev/ttyUSB0 -> dev_ttyUSB0, so that several rigs
+    can keep their journals and timings in one directory.'''
+    return re.sub(r'[^A-Za-z0-9]+', '_', str(serial_port)).strip('_') or 'rig'
+
+
+class PositionMismatch(RuntimeError):
+    '''Raised when the controller reports a position that differs from the dead-reckoned one by more than the tolerance.'''
+
+    def __init__(self, expected, reported, tolerance):
+        self.expected = dict(expected)
+        self.reported = dict(reported)
+        self.tolerance = tolerance
+        differences = ', '.join(f"{axis}: expected {expected[axis]}, controller {reported[axis]}" for axis in expected)
+        super().__init__(f"Position mismatch of more than {tolerance} steps ({differences}). The arms may have stalled or slipped; re-home before continuing.")
+
+
+class PositionState:
+    '''Position of the arms as the host believes it to be, kept by dead reckoning from the moves it has commanded.
+
+    Reading the position (steps, angles) never talks to the controller. The estimate is trusted after homing or after it has been
+    checked against a pos reply, and becomes untrusted after an error (invalidate). due() says when it should be checked again: always
+    when untrusted, otherwise after check_every moves or check_interval seconds (None disables either). reconcile() compares a pos reply
+    with the estimate; an untrusted estimate is simply replaced, a trusted one that is off by more than tolerance steps raises
+    PositionMismatch.
+
+    With a journal_path the state is written to a json file after every change, so the next session can start from it. The loaded
+    state is kept in journaled; it is never trusted as is (opening the port resets the controller's step counts), but it tells
+    AngleResolvedSpectrometer.home where the arms were left. The file also keeps the duration of the last full homing. begin_move
+    marks the journal untrusted (in_motion) before a move is commanded, until the move is recorded as completed, so a session killed
+    mid-move never leaves a trusted journal with the steps of before the move.'''
+
+    axes = ('X', 'Y')
+
+    def __init__(self, steps_to_angle, tolerance=2, check_every=None, check_interval=None, journal_path=None):
+        self.steps_to_angle = steps_to_angle
+        self.tolerance = tolerance
+        self.check_every = check_every
+        self.check_interval = check_interval
+
+        self.steps = {axis: 0 for axis in self.axes}
+        self.angles = {axis: 0 for axis in self.axes}
+        self.trusted = False # unknown until homed or checked
+        self.in_motion = False # a move has been commanded and not yet recorded as completed
+        self.moves_since_check = 0
+        self.last_check = None
+        self.last_error = None
+        self.full_home_time = None # s, last measured
+        self._lock = threading.Lock()
+
+        self.journal_path = journal_path
+        self.journaled = self.load_journal() if journal_path is not None else None
+        if self.journaled is not None:
+            self.full_home_time = self.journaled.get('full_home_time')
+
+    def __repr__(self):
+        state = 'trusted' if self.trusted else 'untrusted'
+        return f"PositionState({self.steps}, {state})"
+
+    def snapshot(self):
+        with self._lock:
+            return {'steps': dict(self.steps), 'angles': dict(self.angles), 'trusted': self.trusted and not self.in_motion,
+                    'in_motion': self.in_motion, 'error': self.last_error,
+                    'full_home_time': self.full_home_time, 'time': time.time()}
+
+    def load_journal(self):
+        if not os.path.exists(self.journal_path):
+            return None
+        try:
+            with open(self.journal_path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def save(self):
+        '''Writes the journal. A failed write is reported and otherwise ignored: the journal only helps the next session, so it must
+        never turn a completed move into an error.'''
+        if self.journal_path is None:
+            return
+        state = self.snapshot()
+        temporary_path = None
+        try:
+            # a temporary file of our own, so concurrent saves never replace each other's, and os.replace so that a process dying
+            # mid-write never leaves a half written journal
+            with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(self.journal_path)), prefix=os.path.basename(self.journal_path) + '.',
+                                             suffix='.tmp', delete=False) as file:
+                temporary_path = file.name
+                json.dump(state, file)
+            os.replace(temporary_path, self.journal_path)
+        except OSError as e:
+            print(f"Could not write the position journal {self.journal_path}: {e}")
+            if temporary_path is not None and os.path.exists(temporary_path):
+                try:
+                    os.remove(temporary_path)
+                except OSError:
+                    pass
+
+    def set(self, steps, angles=None, trusted=True):
+        '''Sets the position outright, e.g. after homing or setpos.'''
+        with self._lock:
+            self.steps = {axis: int(steps[axis]) for axis in self.axes}
+            self.angles = dict(angles) if angles is not None else {axis: self.steps_to_angle(axis, self.steps[axis]) for axis in self.axes}
+            self.trusted = trusted
+            self.in_motion = False
+            self.moves_since_check = 0
+            self.last_check = time.perf_counter() if trusted else None
+            if trusted:
+                self.last_error = None
+        self.save()
+
+    def begin_move(self):
+        '''Records that a move is about to be commanded; the journal is untrusted until commanded or moved records it as done.'''
+        with self._lock:
+            self.in_motion = True
+        self.save()
+
+    def commanded(self, targets, angles=None):
+        '''Records a completed move to the target steps (angles are the requested angles, before rounding to steps).'''
+        with self._lock:
+            self.in_motion = False
+            self.steps.update({axis: int(steps) for axis, steps in targets.items()})
+            for axis in targets:
+                self.angles[axis] = angles[axis] if angles is not None and axis in angles else self.steps_to_angle(axis, self.steps[axis])
+            self.moves_since_check += 1
+        self.save()
+
+    def moved(self, axis, steps):
+        '''Records a completed relative move of one axis.'''
+        self.commanded({axis: self.steps[axis] + int(steps)})
+
+    def invalidate(self, reason=None):
+        '''Marks the estimate as unknown, e.g. after a serial error or an interrupted move.'''
+        with self._lock:
+            self.trusted = False
+            self.in_motion = False
+            self.last_error = reason
+        self.save()
+
+    def due(self):
+        if not self.trusted or self.in_motion: # in_motion: a move was interrupted before it was recorded
+            return True
+        if self.check_every is not None and self.moves_since_check >= self.check_every:
+            return True
+        if self.check_interval is not None and (self.last_check is None or time.perf_counter() - self.last_check >= self.check_interval):
+            return True
+        return False
+
+    def reconcile(self, reported):
+        '''Checks a pos reply ({axis: steps}) against the estimate. Returns the largest difference in steps.'''
+        reported = {axis: int(reported[axis]) for axis in self.axes}
+        expected = None
+        with self._lock:
+            difference = max(abs(reported[axis] - self.steps[axis]) for axis in self.axes)
+            if self.trusted and difference > self.tolerance:
+                expected = dict(self.steps)
+                self.trusted = False
+                self.last_error = 'mismatch'
+        if expected is not None:
+            self.save()
+            raise PositionMismatch(expected, reported, self.tolerance)
+        with self._lock:
+            for axis in self.axes:
+                if reported[axis] != self.steps[axis]:
+                    self.angles[axis] = self.steps_to_angle(axis, reported[axis])
+            self.steps = reported
+            self.trusted = True
+            self.in_motion = False
+            self.moves_since_check = 0
+            self.last_check = time.perf_counter()
+            self.last_error = None
+        self.save()
+        return difference
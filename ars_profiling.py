@@ -0,0 +1,158 @@
+import os
+import time
+import functools
+import tracemalloc
+import cProfile
+import pstats
+from contextlib import contextmanager
+
+
+def profiled(stage_name):
+    '''Decorator for methods of objects carrying a `profiler` attribute. When the profiler is None the method is called directly, so a disabled profiler only costs an attribute lookup.'''
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if profiler is None:
+                return method(self, *args, **kwargs)
+            with profiler.stage(stage_name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _StageFrame:
+    def __init__(self, name, label, mem_start):
+        self.name = name
+        self.label = label
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.mem_start = mem_start
+        self.mem_peak = mem_start
+        self.bytes_read = 0
+
+
+class StageProfiler:
+    '''Records wall time, CPU time, bytes read and allocations for named processing stages.
+
+    Stages can be nested (e.g. per-file loads inside the load stage). Every finished stage is kept as a record dict with the keys
+    stage, label, wall, cpu, bytes_read and alloc (peak bytes allocated above the level at stage entry).
+
+    track_allocations uses tracemalloc, which slows python code down noticeably; disable it when only timings are wanted.
+    use_cprofile additionally runs cProfile over all top level stages, which can be written out with dump_stats.'''
+
+    def __init__(self, track_allocations=True, use_cprofile=False):
+        self.track_allocations = track_allocations
+        self.records = []
+        self._stack = []
+        self._started_tracemalloc = False
+        self.cprofile = cProfile.Profile() if use_cprofile else None
+
+    def _memory(self):
+        if not self.track_allocations:
+            return 0, 0
+        return tracemalloc.get_traced_memory()
+
+    @contextmanager
+    def stage(self, name, label=None):
+        if self.track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        current, peak = self._memory()
+        if self._stack:
+            parent = self._stack[-1]
+            parent.mem_peak = max(parent.mem_peak, peak)
+        if self.track_allocations:
+            tracemalloc.reset_peak()
+
+        if not self._stack and self.cprofile is not None:
+            self.cprofile.enable()
+
+        frame = _StageFrame(name, label, current)
+        self._stack.append(frame)
+        try:
+            yield frame
+        finally:
+            wall = time.perf_counter() - frame.wall_start
+            cpu = time.process_time() - frame.cpu_start
+            current, peak = self._memory()
+            frame.mem_peak = max(frame.mem_peak, peak)
+            self._stack.pop()
+
+            if self._stack:
+                parent = self._stack[-1]
+                parent.mem_peak = max(parent.mem_peak, frame.mem_peak)
+                parent.bytes_read += frame.bytes_read
+            elif self.cprofile is not None:
+                self.cprofile.disable()
+
+            self.records.append({
+                'stage': name,
+                'label': label,
+                'wall': wall,
+                'cpu': cpu,
+                'bytes_read': frame.bytes_read,
+                'alloc': frame.mem_peak - frame.mem_start,
+            })
+
+    def add_bytes_read(self, nbytes):
+        '''Attributes bytes read to the innermost running stage.'''
+        if self._stack:
+            self._stack[-1].bytes_read += nbytes
+
+    def stop(self):
+        '''Stops tracemalloc if it was started by this profiler.'''
+        if self._started_tracemalloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._started_tracemalloc = False
+
+    def summary(self, sort_by='wall'):
+        '''Aggregates the records per stage. Returns a list of dicts sorted in descending order by sort_by.'''
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['stage'], {'stage': record['stage'], 'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'bytes_read': 0, 'alloc': 0})
+            total['calls'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+            total['bytes_read'] += record['bytes_read']
+            total['alloc'] = max(total['alloc'], record['alloc'])
+
+        return sorted(totals.values(), key=lambda x: x[sort_by], reverse=True)
+
+    def report(self, sort_by='wall', per_file=False, limit=None):
+        '''Formats the stage summary as a table. With per_file the individual labelled records (e.g. one per file) are listed as well.'''
+        header = f"{'stage':<14}{'calls':>7}{'wall (s)':>12}{'cpu (s)':>12}{'read (kB)':>12}{'alloc (kB)':>12}"
+        lines = ['### Profile ###', header]
+        for row in self.summary(sort_by)[:limit]:
+            lines.append(f"{row['stage']:<14}{row['calls']:>7}{row['wall']:>12.4f}{row['cpu']:>12.4f}{row['bytes_read'] / 1024:>12.1f}{row['alloc'] / 1024:>12.1f}")
+
+        if per_file:
+            labelled = [record for record in self.records if record['label'] is not None]
+            labelled = sorted(labelled, key=lambda x: x[sort_by], reverse=True)[:limit]
+            if labelled:
+                lines.append('')
+                lines.append(f"{'label':<40}{'wall (s)':>12}{'cpu (s)':>12}{'read (kB)':>12}{'alloc (kB)':>12}")
+                for record in labelled:
+                    lines.append(f"{str(record['label'])[:39]:<40}{record['wall']:>12.4f}{record['cpu']:>12.4f}{record['bytes_read'] / 1024:>12.1f}{record['alloc'] / 1024:>12.1f}")
+
+        return '\n'.join(lines)
+
+    def write_report(self, filepath, sort_by='wall', per_file=True):
+        directory = os.path.dirname(filepath)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(filepath, 'w') as file:
+            file.write(self.report(sort_by=sort_by, per_file=per_file))
+            file.write('\n')
+
+    def dump_stats(self, filepath):
+        '''Writes the cProfile data in pstats format. Only available with use_cprofile=True.'''
+        if self.cprofile is None:
+            raise RuntimeError("cProfile was not enabled. Create the profiler with use_cprofile=True.")
+        self.cprofile.dump_stats(filepath)
+
+    def print_stats(self, sort='cumulative', limit=20):
+        if self.cprofile is None:
+            raise RuntimeError("cProfile was not enabled. Create the profiler with use_cprofile=True.")
+        pstats.Stats(self.cprofile).sort_stats(sort).print_stats(limit)
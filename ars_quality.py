@@ -0,0 +1,193 @@
+import os
+import numpy as np
+
+SATURATED = 1
+LOW_SIGNAL = 2
+LOW_SNR = 4
+NOT_FINITE = 8
+FLAG_NAMES = {SATURATED: 'saturated', LOW_SIGNAL: 'low_signal', LOW_SNR: 'low_snr', NOT_FINITE: 'not_finite'}
+ALL_FLAGS = SATURATED | LOW_SIGNAL | LOW_SNR | NOT_FINITE
+
+
+def flag_names(flags):
+    '''Names of the bits set in flags, e.g. ['saturated', 'low_snr'].'''
+    return [name for bit, name in FLAG_NAMES.items() if int(flags) & bit]
+
+
+def parse_flags(names):
+    '''Flag bits from a list of names (see FLAG_NAMES), e.g. for command line options.'''
+    lookup = {name: bit for bit, name in FLAG_NAMES.items()}
+    flags = 0
+    for name in names:
+        if name not in lookup:
+            raise ValueError(f"Unknown quality flag '{name}'. Options are {tuple(lookup)}.")
+        flags |= lookup[name]
+    return flags
+
+
+def estimate_snr(values):
+    '''Signal to noise ratio of every row of values, without repeats: the median level over the noise, estimated from the median
+    absolute deviation of the second difference (which removes the smooth part of a spectrum).'''
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    second = values[:, :-2] - 2 * values[:, 1:-1] + values[:, 2:]
+    deviation = np.abs(second - np.nanmedian(second, axis=1, keepdims=True))
+    noise = np.nanmedian(deviation, axis=1) / 0.6745 / np.sqrt(6)
+    signal = np.nanmedian(np.abs(values), axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(noise > 0, signal / noise, np.inf)
+
+
+class QualityGate:
+    '''Checks spectra as they arrive, so that bad points can be measured again while the arms are still there. A spectrum is flagged
+    (bits of the returned flags) when:
+
+        SATURATED   more than max_saturated pixels are at or above saturation_level (counts)
+        LOW_SIGNAL  its 95th percentile is below min_signal (counts), i.e. it is close to dark
+        LOW_SNR     its SNR is below min_snr; against a reference, the SNR of the ratio to the reference (see estimate_snr)
+        NOT_FINITE  it, or its ratio to the reference, contains NaN or inf
+
+    Checks with None thresholds are skipped. check and metrics work on a single spectrum or on a stack of them (one per row) at once.
+    References measured in the reference pass are kept by angles (add_reference) and used for the sample at the same angles.
+
+    adjust proposes the integration time for a repeat: shorter when saturated, longer (within the limits) when the signal or SNR is
+    too low, assuming the signal grows linearly and the SNR with the square root of the integration time.'''
+
+    def __init__(self, saturation_level=65000, max_saturated=0, min_signal=None, min_snr=None, max_retries=2,
+                 min_integration_time=0.001, max_integration_time=10.0):
+        self.saturation_level = saturation_level
+        self.max_saturated = max_saturated
+        self.min_signal = min_signal
+        self.min_snr = min_snr
+        self.max_retries = max_retries
+        self.min_integration_time = min_integration_time
+        self.max_integration_time = max_integration_time
+        self.references = {}
+
+    def add_reference(self, angles, spectrum):
+        self.references[tuple(float(angle) for angle in angles)] = np.asarray(spectrum, dtype=float)
+
+    def reference_for(self, angles):
+        return self.references.get(tuple(float(angle) for angle in angles))
+
+    def metrics(self, intensity, reference=None):
+        '''{'saturated', 'signal', 'snr', 'finite'} arrays, one element per spectrum.'''
+        intensity = np.atleast_2d(np.asarray(intensity, dtype=float))
+        finite = np.isfinite(intensity).all(axis=1)
+        target = intensity
+        if reference is not None:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                target = intensity / np.atleast_2d(np.asarray(reference, dtype=float))
+            finite &= np.isfinite(target).all(axis=1)
+        with np.errstate(invalid='ignore'):
+            saturated = (intensity >= self.saturation_level).sum(axis=1)
+        return {'saturated': saturated, 'signal': np.nanpercentile(intensity, 95, axis=1), 'snr': estimate_snr(target), 'finite': finite}
+
+    def flags(self, metrics):
+        flags = np.where(metrics['saturated'] > self.max_saturated, SATURATED, 0)
+        if self.min_signal is not None:
+            flags |= np.where(metrics['signal'] < self.min_signal, LOW_SIGNAL, 0)
+        if self.min_snr is not None:
+            flags |= np.where(metrics['snr'] < self.min_snr, LOW_SNR, 0)
+        flags |= np.where(metrics['finite'], 0, NOT_FINITE)
+        return flags.astype(np.uint8)
+
+    def check(self, intensity, reference=None):
+        '''Flags of every spectrum (an array, one element per row of intensity).'''
+        return self.flags(self.metrics(intensity, reference))
+
+    def adjust(self, flags, metrics, integration_time):
+        '''Integration time for a repeat of a flagged spectrum, or None if changing it cannot help (or it is not known). NOT_FINITE
+        alone is retried with the same integration time.'''
+        flags = int(flags)
+        if not flags or integration_time is None:
+            return None
+
+        factor = 1.0
+        if flags & SATURATED:
+            factor = 0.5
+        else:
+            signal = float(np.ravel(metrics['signal'])[0])
+            snr = float(np.ravel(metrics['snr'])[0])
+            if flags & LOW_SIGNAL and signal > 0:
+                factor = max(factor, 1.2 * self.min_signal / signal)
+            elif flags & LOW_SIGNAL:
+                factor = max(factor, 4.0)
+            if flags & LOW_SNR and snr > 0:
+                factor = max(factor, 1.2 * (self.min_snr / snr) ** 2)
+            if signal > 0:
+                factor = min(factor, 0.9 * self.saturation_level / signal) # do not push the peak into saturation
+        adjusted = float(np.clip(integration_time * factor, self.min_integration_time, self.max_integration_time))
+        if flags & ~NOT_FINITE and np.isclose(adjusted, integration_time):
+            return None
+        return adjusted
+
+    def log(self, data_dir, data_type, angles, repeat, attempts, integration_time, flags, metrics):
+        '''Appends the result for the spectrum kept at a point to quality_flags.csv in data_dir, which AngleReflectance reads.'''
+        log_path = os.path.join(data_dir, 'quality_flags.csv')
+        new_file = not os.path.exists(log_path)
+        with open(log_path, 'a') as file:
+            if new_file:
+                file.write('data_type,x,y,repeat,attempts,integration_time,flags,saturated,signal,snr,z\n')
+            file.write('{},{},{},{},{},{},{},{},{:.6g},{:.6g},{}\n'.format(data_type, float(angles[0]), float(angles[1]), repeat, attempts,
+                       '' if integration_time is None else integration_time, int(flags), int(np.ravel(metrics['saturated'])[0]),
+                       float(np.ravel(metrics['signal'])[0]), float(np.ravel(metrics['snr'])[0]), float(angles[2]) if len(angles) > 2 else ''))
+
+
+def read_quality(data_dir):
+    '''{data_type: {angles: flags}} from quality_flags.csv, with the flags of the repeats at the same angles combined; empty if the
+    directory has none.'''
+    log_path = os.path.join(data_dir, 'quality_flags.csv')
+    if not os.path.exists(log_path):
+        return {}
+    quality = {}
+    with open(log_path, 'r') as file:
+        next(file)
+        for line in file:
+            fields = line.strip().split(',')
+            if len(fields) not in (10, 11):
+                continue
+            angles = (float(fields[1]), float(fields[2]))
+            if len(fields) == 11 and fields[10]:
+                angles += (float(fields[10]),) # sample rotation (Z)
+            flags = quality.setdefault(fields[0], {})
+            flags[angles] = flags.get(angles, 0) | int(fields[6])
+    return quality
+
+
+def gated_acquire(worker, acquire, gate, angles, data_type='sample', repeat=0, data_dir=None):
+    '''Acquires the spectrum at the current point with acquire(worker, angles) and checks it with gate, acquiring it again with the
+    integration time proposed by the gate (through acquire.set_integration_time, when the acquirer has one) up to gate.max_retries
+    times. Rejected spectra are discarded with acquire.reject() if the acquirer supports it, so they do not end up averaged with the
+    repeat. Posts a 'quality' event per attempt and logs the kept spectrum to data_dir. Returns (spectrum, flags).'''
+    integration_time = getattr(acquire, 'integration_time', None)
+    reference = gate.reference_for(angles) if data_type != 'reference' else None
+    attempt = 0
+    while True:
+        worker.checkpoint()
+        spectrum = acquire(worker, angles)
+        metrics = gate.metrics(spectrum, reference)
+        flags = int(gate.flags(metrics)[0])
+        adjusted = None
+        retry = False
+        if flags and attempt < gate.max_retries:
+            if flags == NOT_FINITE:
+                retry = True # e.g. a reference pixel at zero counts from a glitch; the same settings may do
+            else:
+                adjusted = gate.adjust(flags, metrics, integration_time)
+                retry = adjusted is not None and getattr(acquire, 'can_set_integration_time', hasattr(acquire, 'set_integration_time'))
+        worker.post('quality', angles=tuple(angles), data_type=data_type, repeat=repeat, attempt=attempt, flags=flags,
+                    names=flag_names(flags), integration_time=integration_time, retry=retry)
+        if not retry:
+            break
+        if hasattr(acquire, 'reject'):
+            acquire.reject()
+        if adjusted is not None:
+            acquire.set_integration_time(adjusted)
+            integration_time = adjusted
+        attempt += 1
+
+    if data_type == 'reference' and not flags & NOT_FINITE:
+        gate.add_reference(angles, spectrum)
+    if data_dir is not None:
+        gate.log(data_dir, data_type, angles, repeat, attempt + 1, integration_time, flags, metrics)
+    return spectrum, flags
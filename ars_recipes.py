@@ -0,0 +1,238 @@
+import os
+import json
+import time
+from ars_worker import ScanAborted
+from ars_scan import ScanPlan, scan_job
+
+
+class ScanRecipe:
+    '''Declarative description of a scan, loaded from a json or yaml file:
+
+        name: ITO-3nm p-pol
+        mode: specular            # or uncoupled
+        axes: [X, Y]              # primary and secondary axis, uncoupled only
+        primary: {start: 15, stop: 75, resolution: 1}
+        secondary: {start: 20, stop: 60, resolution: 5}   # uncoupled only
+        z: {start: 0, stop: 90, resolution: 15}           # optional sample rotation, slowest varying; or a fixed angle, z: 45
+        passes: [reference, sample]
+        swap: true                # wait for Continue before each pass after the first, to swap the mirror for the sample
+        output_dir: D:/data/ITO-3nm
+        dwell: 2.0                # s per acquisition
+        repeats: 3                # acquisitions per point
+
+    Each pass is a full scan over the same points. Between passes the queue stops, posting 'swap_sample', until the worker is told
+    to continue (continue_scan), unless swap is false, e.g. for a single sample measured twice. All passes are saved to output_dir, so the spectrometer software has to name the
+    files of each pass with its identifier (e.g. reference_..., sample_...), as for manual scans.'''
+
+    modes = ('specular', 'uncoupled')
+
+    def __init__(self, name, mode, primary, output_dir, secondary=None, axes=('X', 'Y'), passes=('reference', 'sample'), dwell=1.0, repeats=1, source=None,
+                 z=None, swap=True):
+        self.name = name
+        self.mode = mode
+        self.primary = primary
+        self.secondary = secondary
+        self.z = z
+        self.axes = tuple(axes)
+        self.passes = tuple(passes)
+        self.output_dir = output_dir
+        self.dwell = dwell
+        self.repeats = repeats
+        self.swap = bool(swap)
+        self.source = source
+        self.validate()
+
+    @classmethod
+    def from_dict(cls, recipe, source=None):
+        recipe = dict(recipe)
+        unknown = set(recipe) - {'name', 'mode', 'primary', 'secondary', 'axes', 'passes', 'output_dir', 'dwell', 'repeats', 'z', 'swap'}
+        if unknown:
+            raise ValueError(f"Unknown recipe keys {sorted(unknown)} in {source or 'recipe'}.")
+        for key in ('mode', 'primary', 'output_dir'):
+            if key not in recipe:
+                raise ValueError(f"Recipe {source or ''} is missing '{key}'.")
+        recipe.setdefault('name', os.path.splitext(os.path.basename(source))[0] if source else 'recipe')
+        return cls(source=source, **recipe)
+
+    def to_dict(self):
+        return {'name': self.name, 'mode': self.mode, 'primary': self.primary, 'secondary': self.secondary, 'axes': list(self.axes),
+                'passes': list(self.passes), 'output_dir': self.output_dir, 'dwell': self.dwell, 'repeats': self.repeats, 'z': self.z,
+                'swap': self.swap}
+
+    @staticmethod
+    def _range(parameters, label):
+        try:
+            start, stop, resolution = float(parameters['start']), float(parameters['stop']), float(parameters['resolution'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"{label} needs numeric start, stop and resolution.")
+        if resolution <= 0:
+            raise ValueError(f"{label} resolution must be positive.")
+        if stop < start:
+            raise ValueError(f"{label} stop angle is before the start angle.")
+        return start, stop, resolution
+
+    def validate(self):
+        if self.mode not in self.modes:
+            raise ValueError(f"Unknown mode '{self.mode}'. Options are {self.modes}.")
+        self._range(self.primary, 'primary')
+        if self.mode == 'uncoupled':
+            if self.secondary is None:
+                raise ValueError("Uncoupled recipes need a secondary range.")
+            self._range(self.secondary, 'secondary')
+            if sorted(self.axes) != ['X', 'Y']:
+                raise ValueError("axes must be [X, Y] or [Y, X].")
+        if isinstance(self.z, dict):
+            self._range(self.z, 'z')
+        elif self.z is not None and not isinstance(self.z, (int, float)):
+            raise ValueError("z must be a range or a fixed angle.")
+        if not self.passes:
+            raise ValueError("A recipe needs at least one pass.")
+        if self.dwell <= 0 or int(self.repeats) < 1:
+            raise ValueError("dwell must be > 0 (recipes run unattended) and repeats >= 1.")
+
+    def points(self):
+        '''The points of each pass, as a ScanPlan.'''
+        primary = self._range(self.primary, 'primary')
+        z = self._range(self.z, 'z') if isinstance(self.z, dict) else self.z
+        if self.mode == 'specular':
+            return ScanPlan.specular(*primary, z=z, repeats=int(self.repeats))
+        return ScanPlan.uncoupled(primary, self._range(self.secondary, 'secondary'), self.axes, z=z, repeats=int(self.repeats))
+
+    def origin(self):
+        return tuple(self.points()[0])
+
+
+def load_recipe(filepath):
+    '''Loads a ScanRecipe from a .json, .yaml or .yml file.'''
+    with open(filepath, 'r') as file:
+        if filepath.lower().endswith(('.yaml', '.yml')):
+            import yaml
+            recipe = yaml.safe_load(file)
+        else:
+            recipe = json.load(file)
+    return ScanRecipe.from_dict(recipe, source=filepath)
+
+
+class RecipeQueue:
+    '''Runs a list of recipes back to back as a single MotionWorker job, homing before each recipe.
+
+    policy is 'fail_fast' (stop the queue at the first failed recipe) or 'skip' (record the failure, re-home and carry on with the next).
+    Aborting from the worker always stops the whole queue. Homing uses the spectrometer's fast home where it has one (a single pos check
+    when the position is trusted) and full homing after a failure; the mode and the time saved are recorded per recipe. A progress report is kept in self.report and written to report_path as json
+    after every recipe, so the state of an overnight run can be checked at any time.'''
+
+    policies = ('fail_fast', 'skip')
+
+    def __init__(self, recipes, policy='skip', home_between=True, estimator=None, report_path=None):
+        if policy not in self.policies:
+            raise ValueError(f"Unknown policy '{policy}'. Options are {self.policies}.")
+        self.recipes = list(recipes)
+        self.policy = policy
+        self.home_between = home_between
+        self.estimator = estimator
+        self.report_path = report_path
+        self.report = [{'name': recipe.name, 'status': 'queued', 'points': len(recipe.points()) * len(recipe.passes), 'elapsed': None, 'error': None,
+                        'homing': None, 'time_saved': None} for recipe in self.recipes]
+
+    def check(self, spectrometer):
+        '''Returns {recipe index: problem} for the problems found before running, i.e. points outside the hard limits.'''
+        problems = {}
+        for index, recipe in enumerate(self.recipes):
+            n_violations = recipe.points().count_violations(spectrometer)
+            if n_violations:
+                problems[index] = f"{recipe.name}: {n_violations} points outside the hard limits."
+        return problems
+
+    def run(self, worker):
+        '''Worker job: worker.submit('recipe queue', recipe_queue.run).'''
+        spectrometer = worker.spectrometer
+        problems = self.check(spectrometer)
+        if problems and self.policy == 'fail_fast':
+            raise ValueError('\n'.join(problems.values()))
+
+        for index, recipe in enumerate(self.recipes):
+            entry = self.report[index]
+            worker.checkpoint()
+            if index in problems:
+                self._finish(worker, entry, 'skipped', error=problems[index])
+                continue
+
+            entry['status'] = 'running'
+            worker.post('recipe_started', index=index, total=len(self.recipes), name=recipe.name)
+            start = time.perf_counter()
+            try:
+                if self.home_between:
+                    self.home(worker, entry)
+                self.run_recipe(worker, recipe)
+            except ScanAborted:
+                self._finish(worker, entry, 'aborted', elapsed=time.perf_counter() - start)
+                raise
+            except Exception as e:
+                self._finish(worker, entry, 'failed', elapsed=time.perf_counter() - start, error=str(e))
+                if self.policy == 'fail_fast':
+                    raise
+                # the position may be unknown after a failure, so the next recipe homes fully
+                if hasattr(spectrometer, 'position'):
+                    spectrometer.position.invalidate('recipe failed')
+                if not self.home_between:
+                    spectrometer.home_motors()
+                continue
+            self._finish(worker, entry, 'done', elapsed=time.perf_counter() - start)
+
+        return self.report
+
+    def home(self, worker, entry):
+        spectrometer = worker.spectrometer
+        if hasattr(spectrometer, 'home'):
+            result = spectrometer.home()
+        else:
+            start = time.perf_counter()
+            spectrometer.home_motors()
+            result = {'mode': 'full', 'elapsed': time.perf_counter() - start, 'saved': 0.0}
+        entry['homing'] = result['mode']
+        entry['time_saved'] = result['saved']
+        worker.post('homed', **result)
+        worker.post_position()
+
+    def run_recipe(self, worker, recipe):
+        points = recipe.points()
+        if not os.path.exists(recipe.output_dir):
+            os.makedirs(recipe.output_dir)
+        with open(os.path.join(recipe.output_dir, 'recipe.json'), 'w') as file:
+            json.dump(recipe.to_dict(), file, indent=2)
+
+        scan_list = {}
+        for index, scan_pass in enumerate(recipe.passes):
+            if index and recipe.swap:
+                worker.post('swap_sample', name=recipe.name, scan_pass=scan_pass, previous=recipe.passes[index - 1])
+                worker.wait_for_continue(None)
+            worker.post('pass_started', name=recipe.name, scan_pass=scan_pass)
+            scan_job(worker, points, dwell=recipe.dwell, return_to=recipe.origin(), data_dir=recipe.output_dir, estimator=self.estimator, repeats=int(recipe.repeats))
+            scan_list[scan_pass] = [point for point in points.tolist() for _ in range(int(recipe.repeats))]
+
+        # same layout as generate_scan_list, one entry per acquisition (repeats in a row), so rename_files can tag every file with its angles
+        with open(os.path.join(recipe.output_dir, 'scan_list.json'), 'w') as file:
+            json.dump(scan_list, file)
+
+    def _finish(self, worker, entry, status, elapsed=None, error=None):
+        entry['status'] = status
+        entry['elapsed'] = elapsed
+        entry['error'] = error
+        worker.post('recipe_finished', name=entry['name'], status=status, error=error)
+        self.write_report()
+
+    def write_report(self):
+        if self.report_path is None:
+            return
+        with open(self.report_path, 'w') as file:
+            json.dump(self.report, file, indent=2)
+
+    def summary(self):
+        lines = [f"{'recipe':<30}{'status':<10}{'points':>8}{'time (s)':>10}{'homing':>10}{'saved (s)':>11}  error"]
+        for entry in self.report:
+            elapsed = f"{entry['elapsed']:.0f}" if entry['elapsed'] is not None else '-'
+            saved = f"{entry['time_saved']:.1f}" if entry['time_saved'] is not None else '-'
+            lines.append(f"{entry['name'][:29]:<30}{entry['status']:<10}{entry['points']:>8}{elapsed:>10}{entry['homing'] or '-':>10}{saved:>11}  {entry['error'] or ''}")
+        total_saved = sum(entry['time_saved'] or 0 for entry in self.report)
+        lines.append(f"Time saved by fast homing: {total_saved:.1f} s")
+        return '\n'.join(lines)
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import numpy as np
+from ars_container import ScanContainer, DATA_TYPES
+
+
+class LibraryReference:
+    '''A reference spectrum resolved from a ReferenceLibrary, with the data, header, angles and integration_time attributes of
+    ReflectionFile so calculate_reflectivity can use it in place of a measured one. sources lists the (scan file, angles) it came from.'''
+
+    def __init__(self, wavelength, intensity, angles, integration_time, sources, timestamp):
+        self.data = np.column_stack((wavelength, intensity))
+        self.angles = angles
+        self.header = {'Integration Time (sec)': str(integration_time)}
+        self.data_type = 'reference'
+        self.filename = ' + '.join(f"{os.path.basename(source)}{tuple(source_angles)}" for source, source_angles in sources)
+        self.sources = sources
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f"LibraryReference: {self.angles}: {self.filename}"
+
+    @property
+    def integration_time(self):
+        return float(self.header.get('Integration Time (sec)', 0))
+
+    def info(self):
+        return {'data_type': self.data_type, 'angles': self.angles, 'filename': self.filename, 'integration_time': self.integration_time}
+
+
+class ReferenceLibrary:
+    '''Persistent store of reference spectra, so sample scans can skip the reference pass while the references are still valid.
+
+    The library is a directory holding one scan container (.arsc) per stored reference scan, with the polarization and a label in its
+    recipe, and an index.json listing them. The spectra are stored dark subtracted and averaged over repeats, with the angles,
+    integration time and acquisition time of each.
+
+    resolve finds the reference for a sample at some angle (the reference axis angle, see AngleReflectance), integration time and
+    polarization, using only references acquired within max_age seconds of the sample (the freshness policy; None accepts any age)
+    and not before not_before (e.g. when the lamp was last changed). Of the matching scans, the newest with a spectrum at that
+    angle is used; failing that, the newest whose angles bracket it, interpolating linearly in angle between the two nearest. Spectra
+    are scaled to the requested integration time (linear, as they are dark subtracted).'''
+
+    def __init__(self, path, max_age=None, not_before=None):
+        self.path = path
+        self.max_age = max_age
+        self.not_before = not_before
+        self.index_path = os.path.join(path, 'index.json')
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.entries = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as file:
+                self.entries = json.load(file)
+        self._containers = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f"ReferenceLibrary: {self.path}: {len(self)} scans"
+
+    def _save_index(self):
+        with open(self.index_path + '.tmp', 'w') as file:
+            json.dump(self.entries, file, indent=1)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+    def container(self, entry):
+        filename = entry['file']
+        if filename not in self._containers:
+            self._containers[filename] = ScanContainer(os.path.join(self.path, filename))
+        return self._containers[filename]
+
+    def add(self, wavelength, spectra, polarization=None, label=None):
+        '''Stores a reference scan. spectra is a list of (angles, intensity, integration_time, timestamp). Returns the index entry.'''
+        created = time.time()
+        filename = time.strftime('references_%Y%m%d_%H%M%S', time.localtime(created)) + f"_{len(self.entries)}.arsc"
+        with ScanContainer.create(os.path.join(self.path, filename), wavelength, recipe={'polarization': polarization, 'label': label}) as container:
+            for angles, intensity, integration_time, timestamp in spectra:
+                container.append(intensity, angles=angles, data_type='reference', integration_time=integration_time, timestamp=timestamp)
+        timestamps = [spectrum[3] for spectrum in spectra]
+        entry = {'file': filename, 'polarization': polarization, 'label': label, 'n_spectra': len(spectra), 'created': created,
+                 'acquired': [min(timestamps), max(timestamps)] if timestamps else [created, created]}
+        self.entries.append(entry)
+        self._save_index()
+        return entry
+
+    def add_scan(self, source, polarization=None, label=None, reference_identifier='reference'):
+        '''Stores the references of a measured scan (a data folder, a .arsc file or an AngleReflectance), dark subtracted and averaged
+        as AngleReflectance loads them. The acquisition time of each is that of its newest file.'''
+        from ars_analysis import AngleReflectance
+
+        angle_data = source if isinstance(source, AngleReflectance) else AngleReflectance(source)
+        references = angle_data.dataDict.get(reference_identifier, {})
+        if not references:
+            raise ValueError(f"No {reference_identifier} spectra in {angle_data.source}.")
+        spectra = []
+        wavelength = None
+        for angles, spectrum in sorted(references.items()):
+            if wavelength is None:
+                wavelength = spectrum.data[:, 0]
+            spectra.append((angles, spectrum.data[:, 1], spectrum.integration_time, angle_data.timestamps.get((reference_identifier, angles), time.time())))
+        return self.add(wavelength, spectra, polarization, label or os.path.basename(os.path.normpath(str(angle_data.source))))
+
+    def _fresh(self, records, when):
+        keep = np.ones(len(records), dtype=bool)
+        if self.max_age is not None and when is not None:
+            keep &= np.abs(records['timestamp'] - when) <= self.max_age
+        if self.not_before is not None:
+            keep &= records['timestamp'] >= self.not_before
+        return keep
+
+    def resolve(self, angle, integration_time=None, polarization=None, wavelength=None, when=None, axis=1):
+        '''The LibraryReference for the reference angle `angle` (the angle on axis, 0 for X, 1 for Y), scaled to integration_time, from
+        scans with the given polarization and wavelength axis, fresh at time when (time.time() by default). Raises LookupError if no
+        fresh reference matches.'''
+        when = time.time() if when is None else when
+        candidates = []
+        for entry in reversed(self.entries): # newest first
+            if entry.get('polarization') != polarization:
+                continue
+            container = self.container(entry)
+            if wavelength is not None and (len(wavelength) != len(container.wavelength) or not np.allclose(wavelength, container.wavelength)):
+                continue
+            records = container.records
+            keep = self._fresh(records, when) & (records['data_type'] == DATA_TYPES.index('reference'))
+            if not keep.any():
+                continue
+            indices = np.flatnonzero(keep)
+            angles = np.column_stack((records['x'][indices], records['y'][indices]))[:, axis]
+            candidates.append((entry, container, indices, angles))
+
+        for entry, container, indices, angles in candidates:
+            exact = np.flatnonzero(np.isclose(angles, angle))
+            if len(exact):
+                index = indices[exact[np.argmax(container.records['timestamp'][indices[exact]])]]
+                return self._reference(container, [(index, 1.0)], angle, integration_time)
+
+        for entry, container, indices, angles in candidates:
+            below = np.flatnonzero(angles < angle)
+            above = np.flatnonzero(angles > angle)
+            if len(below) and len(above):
+                lower = below[np.argmax(angles[below])]
+                upper = above[np.argmin(angles[above])]
+                fraction = (angle - angles[lower]) / (angles[upper] - angles[lower])
+                return self._reference(container, [(indices[lower], 1 - fraction), (indices[upper], fraction)], angle, integration_time)
+
+        age = f" no older than {self.max_age} s" if self.max_age is not None else ''
+        raise LookupError(f"No reference{age} for {angle} deg (polarization {polarization}) in {self.path}.")
+
+    def _reference(self, container, weights, angle, integration_time):
+        '''Weighted sum of the records, each scaled to integration_time (the first record's time if None).'''
+        records = container.records
+        if integration_time is None:
+            integration_time = float(records['integration_time'][weights[0][0]])
+        intensity = 0
+        for index, weight in weights:
+            stored_time = float(records['integration_time'][index])
+            scale = integration_time / stored_time if stored_time else 1.0 # not scaled if the time was not recorded
+            intensity = intensity + weight * scale * np.asarray(records['intensity'][index], dtype=float)
+        sources = [(container.filepath, (float(records['x'][index]), float(records['y'][index]))) for index, _ in weights]
+        timestamp = min(float(records['timestamp'][index]) for index, _ in weights)
+        return LibraryReference(container.wavelength, intensity, angle, integration_time, sources, timestamp)
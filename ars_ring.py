@@ -0,0 +1,231 @@
+import time
+import queue
+import multiprocessing
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class RingFull(TimeoutError):
+    '''No slot became free within the timeout: the reader has fallen behind (or died).'''
+
+
+class SpectrumRing:
+    '''Ring buffer of spectra in shared memory, so an analysis process can read the spectra of the acquisition process without them
+    being pickled, and live analysis does not compete with the GUI and the serial I/O for the GIL.
+
+    The n_slots slots of n_wavelengths values live in one multiprocessing.shared_memory block and are filled in turn by one writer.
+    A semaphore counts the free slots and a queue carries (slot, metadata) to the reader, so only small metadata dicts are pickled.
+    When the reader falls behind the writer blocks in put until a slot is released (backpressure), so a slow analysis slows the scan
+    down rather than dropping spectra or growing memory. put raises RingFull if no slot frees up within timeout s (per put or for the
+    whole ring, 30 s by default; None waits for ever), and at once if the reader is known to have exited (reader_alive, a callable
+    set by AnalysisProcess), so a dead reader cannot hang the scan.
+
+    Create the ring in the acquisition process and pass it to the analysis process (see AnalysisProcess), where it attaches to the
+    same memory:
+
+        writer: ring.put(intensity, angles=(20, 20))   or as a detector writer (append)   ...   ring.finish()
+        reader: for slot, spectrum, metadata in ring: ...; ring.release(slot)
+
+    spectrum is a view of the slot, valid until it is released; slots are released in the order they were read. Call close() in
+    every process and unlink() once, in the creator.'''
+
+    def __init__(self, n_slots, n_wavelengths, dtype='<f8', wavelength=None, timeout=30.0, context=None):
+        context = context or multiprocessing.get_context()
+        self.n_slots = int(n_slots)
+        self.n_wavelengths = int(n_wavelengths)
+        self.dtype = np.dtype(dtype)
+        self.wavelength = None if wavelength is None else np.asarray(wavelength, dtype=float)
+        self.timeout = timeout
+        self.reader_alive = None # callable returning False once the reader has exited, checked while put waits
+        self._shm = shared_memory.SharedMemory(create=True, size=self.n_slots * self.n_wavelengths * self.dtype.itemsize)
+        self.name = self._shm.name
+        self._owner = True
+        self._array = np.ndarray((self.n_slots, self.n_wavelengths), dtype=self.dtype, buffer=self._shm.buf)
+        self.free = context.Semaphore(self.n_slots)
+        self.filled = context.Queue()
+        self._written = 0 # spectra put by this process
+        self._released = 0 # slots released by this process
+        self.blocked_time = 0.0 # s the writer of this process has waited for a free slot
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_shm'], state['_array']
+        state['_owner'] = False
+        state['reader_alive'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = shared_memory.SharedMemory(name=self.name) # reader processes share the creator's resource tracker
+        self._array = np.ndarray((self.n_slots, self.n_wavelengths), dtype=self.dtype, buffer=self._shm.buf)
+
+    def __len__(self):
+        return self.n_slots
+
+    def __repr__(self):
+        return f"SpectrumRing: {self.name}: {self.n_slots} slots of {self.n_wavelengths} {self.dtype}"
+
+    def put(self, intensity, timeout=None, **metadata):
+        '''Copies a spectrum into the next free slot and queues it for the reader, waiting for a slot if all are in use. Returns the
+        slot.'''
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        deadline = None if timeout is None else start + timeout
+        while True:
+            wait = None if deadline is None else max(deadline - time.perf_counter(), 0)
+            if self.reader_alive is not None:
+                wait = 0.5 if wait is None else min(wait, 0.5) # look at the reader every 0.5 s
+            if self.free.acquire(True, wait):
+                break
+            if self.reader_alive is not None and not self.reader_alive():
+                raise RingFull("The reader has exited; no slot will be freed.")
+            if deadline is not None and time.perf_counter() >= deadline:
+                raise RingFull(f"No free slot in {self.n_slots} after {timeout} s; the reader is not keeping up.")
+        self.blocked_time += time.perf_counter() - start
+        slot = self._written % self.n_slots
+        self._written += 1
+        self._array[slot] = intensity
+        self.filled.put((slot, metadata))
+        return slot
+
+    def append(self, intensity, angles=None, data_type='sample', integration_time=0.0, timestamp=None, repeat=None, source=''):
+        '''put with the append method of ars_container.ScanContainer, so the ring can be a detector writer.'''
+        return self.put(intensity, angles=None if angles is None else tuple(angles), data_type=data_type, integration_time=integration_time,
+                        timestamp=time.time() if timestamp is None else timestamp, repeat=repeat, source=source)
+
+    def finish(self):
+        '''Tells the reader that no more spectra follow; it stops after the ones already queued.'''
+        self.filled.put(None)
+
+    def get(self, timeout=None):
+        '''(slot, spectrum, metadata) of the next spectrum, or None once the writer has finished. Raises queue.Empty on timeout.'''
+        item = self.filled.get(timeout=timeout)
+        if item is None:
+            return None
+        slot, metadata = item
+        return slot, self._array[slot], metadata
+
+    def release(self, slot):
+        '''Hands a slot back to the writer.'''
+        if slot != self._released % self.n_slots:
+            raise ValueError(f"Slot {slot} released out of order; slot {self._released % self.n_slots} is next.")
+        self._released += 1
+        self.free.release()
+
+    def __iter__(self):
+        while True:
+            item = self.get()
+            if item is None:
+                return
+            yield item
+
+    def close(self):
+        self._array = None
+        self._shm.close()
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
+
+
+def run_reader(ring, handler, results=None):
+    '''Reads the ring until the writer finishes, calling handler(spectrum, metadata) for every spectrum and putting what it returns,
+    unless None, on results. The slot is released when handler returns, so handler must copy anything it keeps. Returns the number
+    of spectra read.'''
+    count = 0
+    for slot, spectrum, metadata in ring:
+        try:
+            result = handler(spectrum, metadata)
+        finally:
+            ring.release(slot)
+        if results is not None and result is not None:
+            results.put(result)
+        count += 1
+    return count
+
+
+def _reader_main(ring, handler, results):
+    try:
+        count = run_reader(ring, handler, results)
+        results.put(('finished', count))
+    except Exception as e:
+        results.put(('error', repr(e)))
+    finally:
+        ring.close()
+
+
+class AnalysisProcess:
+    '''Runs handler on every spectrum of a ring in a separate process (see run_reader). handler must be picklable, i.e. a module level
+    function or an instance of a module level class such as LiveReflectance. Its results arrive on the results queue, followed by
+    ('finished', count) or ('error', message).
+
+        ring = SpectrumRing(16, len(detector.wavelength))
+        analysis = AnalysisProcess(ring, LiveReflectance())
+        analysis.start()
+        detector.add_writer(ring)
+        ... scan ...
+        analysis.stop()  # finishes the ring, waits for the queued spectra to be analysed and frees the shared memory
+        analysis.remaining  # results that had not been read from analysis.results'''
+
+    def __init__(self, ring, handler, context=None):
+        context = context or multiprocessing.get_context()
+        self.ring = ring
+        self.results = context.Queue()
+        self.remaining = []
+        self.process = context.Process(target=_reader_main, args=(ring, handler, self.results), daemon=True)
+
+    def start(self):
+        self.process.start()
+        self.ring.reader_alive = self.process.is_alive
+
+    def stop(self, timeout=10.0):
+        '''Shuts down cleanly: the reader drains the ring and exits. It is terminated if it has not exited within timeout s. Results
+        not read yet are collected meanwhile (a process cannot exit while its queue is full) and returned in self.remaining.'''
+        if self.process.is_alive():
+            self.ring.finish()
+        self.remaining = []
+        deadline = time.perf_counter() + timeout
+        while self.process.is_alive() and time.perf_counter() < deadline:
+            try:
+                self.remaining.append(self.results.get(timeout=0.1))
+            except queue.Empty:
+                pass
+        while True:
+            try:
+                self.remaining.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.ring.close()
+        self.ring.unlink()
+        return self.process.exitcode
+
+
+class LiveReflectance:
+    '''Live analysis handler: keeps the reference spectrum at each angle (data_type 'reference') and the dark (data_type 'dark'), and
+    for every sample returns {'angles', 'reflectance', 'minimum', 'minimum_at'}, the reflectance (%) of the sample against the
+    reference at the same angles and its minimum and the index where it is, for plotting as the scan runs.'''
+
+    def __init__(self):
+        self.references = {}
+        self.dark = None
+
+    def __call__(self, spectrum, metadata):
+        data_type = metadata.get('data_type', 'sample')
+        if data_type == 'dark':
+            self.dark = np.array(spectrum, dtype=float)
+            return None
+        angles = metadata.get('angles')
+        corrected = np.asarray(spectrum, dtype=float) - (self.dark if self.dark is not None else 0.0)
+        if data_type == 'reference':
+            self.references[angles] = corrected
+            return None
+        reference = self.references.get(angles)
+        if reference is None:
+            return None
+        with np.errstate(divide='ignore', invalid='ignore'):
+            reflectance = 100 * corrected / reference
+        index = int(np.nanargmin(reflectance)) if np.isfinite(reflectance).any() else -1
+        return {'angles': angles, 'reflectance': reflectance, 'minimum': float(reflectance[index]) if index >= 0 else np.nan, 'minimum_at': index}
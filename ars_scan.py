@@ -0,0 +1,282 @@
+import os
+import copy
+import time
+import numpy as np
+from ars_quality import gated_acquire
+
+
+def angle_range(start, stop, resolution):
+    '''Angles from start to stop inclusive, in steps of resolution.'''
+    return np.arange(start, stop + resolution, resolution)
+
+
+def specular_points(start, stop, resolution):
+    '''Scan points for a specular scan, where both arms move to the same angle.'''
+    return [(angle, angle) for angle in angle_range(start, stop, resolution)]
+
+
+def flatten_scan_dimensions(primary_parameters, secondary_parameters, axis_order):
+    '''Flattened (x, y) points of an uncoupled scan as an (N, 2) array. The primary axis varies fastest.'''
+    primary_angles = angle_range(*primary_parameters)
+    secondary_angles = angle_range(*secondary_parameters)
+
+    primary_grid = np.tile(primary_angles, len(secondary_angles))
+    secondary_grid = np.repeat(secondary_angles, len(primary_angles))
+
+    if axis_order == ("Y", "X"):
+        return np.column_stack((secondary_grid, primary_grid))
+    return np.column_stack((primary_grid, secondary_grid))
+
+
+class ScanPlan:
+    '''Lazy grid of scan points over the X and Y arms and the Z axis (sample rotation). The points are computed from their index
+    and never stored, one at a time when iterating or as (n, n_axes) numpy arrays with block and blocks, so even a huge 3D plan costs
+    no memory to build, count, check against the limits or display.
+
+    dimensions lists (axes, values) from the fastest varying to the slowest. axes is an axis name, or a tuple of axes that move
+    together (('X', 'Y') for a specular scan), and values are the angles (deg). fixed holds the angles of axes that do not move, e.g.
+    {'X': 45, 'Y': 45} for a rotation scan. Points are (x, y), or (x, y, z) when the plan has a Z axis. repeats is the number of
+    acquisitions per point (see scan_job).
+
+    len, indexing and slicing work as for a list; a slice is another lazy plan, e.g. plan[done:] to resume a scan.
+
+        plan = ScanPlan.specular(15, 75, 0.1, z=(0, 350, 1))   # 217 k points
+        plan.count_violations(spectrometer), plan[1000], plan.block(0, 4096)'''
+
+    axis_names = ('X', 'Y', 'Z')
+
+    def __init__(self, dimensions, fixed=None, repeats=1):
+        self.dimensions = []
+        for axes, values in dimensions:
+            axes = (axes,) if isinstance(axes, str) else tuple(axes)
+            self.dimensions.append((axes, np.asarray(values, dtype=float).ravel()))
+        self.fixed = {axis: float(angle) for axis, angle in (fixed or {}).items()}
+        self.repeats = int(repeats)
+
+        moving = [axis for axes, _ in self.dimensions for axis in axes]
+        unknown = (set(moving) | set(self.fixed)) - set(self.axis_names)
+        if unknown:
+            raise ValueError(f"Unknown axes {sorted(unknown)}. Options are {self.axis_names}.")
+        if len(moving) != len(set(moving)) or set(moving) & set(self.fixed):
+            raise ValueError("Each axis can only be in one dimension or fixed.")
+        self.axes = self.axis_names if 'Z' in moving or 'Z' in self.fixed else ('X', 'Y')
+        missing = set(self.axes) - set(moving) - set(self.fixed)
+        if missing:
+            raise ValueError(f"Axes {sorted(missing)} need a dimension or a fixed angle.")
+
+        self.shape = tuple(len(values) for _, values in self.dimensions) # fastest varying first
+        self._range = range(int(np.prod(self.shape, dtype=np.int64)))
+
+    @classmethod
+    def specular(cls, start, stop, resolution, z=None, repeats=1):
+        '''Specular scan, both arms at the same angle. z is a (start, stop, resolution) range of sample rotations, scanned as the
+        slowest dimension, or a fixed rotation angle.'''
+        return cls._with_rotation([(('X', 'Y'), angle_range(start, stop, resolution))], {}, z, repeats)
+
+    @classmethod
+    def uncoupled(cls, primary_parameters, secondary_parameters, axis_order=('X', 'Y'), z=None, repeats=1):
+        '''Uncoupled scan, as flatten_scan_dimensions: the primary axis varies fastest. z as for specular.'''
+        dimensions = [(axis_order[0], angle_range(*primary_parameters)), (axis_order[1], angle_range(*secondary_parameters))]
+        return cls._with_rotation(dimensions, {}, z, repeats)
+
+    @classmethod
+    def _with_rotation(cls, dimensions, fixed, z, repeats):
+        if z is None:
+            return cls(dimensions, fixed, repeats)
+        if np.ndim(z) == 0:
+            return cls(dimensions, dict(fixed, Z=z), repeats)
+        return cls(list(dimensions) + [('Z', angle_range(*z))], fixed, repeats)
+
+    def __len__(self):
+        return len(self._range)
+
+    def __repr__(self):
+        dimensions = ' x '.join(f"{'='.join(axes)} {values[0]:g}..{values[-1]:g} ({len(values)})" if len(values) else f"{'='.join(axes)} (0)"
+                                for axes, values in self.dimensions)
+        fixed = ''.join(f", {axis}={angle:g}" for axis, angle in self.fixed.items())
+        sliced = '' if len(self) == int(np.prod(self.shape, dtype=np.int64)) else ' (slice)'
+        return f"ScanPlan: {len(self)} points{sliced}, {dimensions or 'fixed'}{fixed}, {self.repeats} repeats"
+
+    def _points(self, flat):
+        '''(n, n_axes) array of the points with the given flat indices into the full grid.'''
+        remainder = np.asarray(flat, dtype=np.int64)
+        points = np.empty((len(remainder), len(self.axes)))
+        for axis, angle in self.fixed.items():
+            points[:, self.axes.index(axis)] = angle
+        for axes, values in self.dimensions:
+            remainder, index = np.divmod(remainder, len(values))
+            for axis in axes:
+                points[:, self.axes.index(axis)] = values[index]
+        return points
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            plan = copy.copy(self)
+            plan._range = self._range[index]
+            return plan
+        return tuple(self._points([self._range[index]])[0].tolist())
+
+    def __iter__(self):
+        for block in self.blocks():
+            yield from map(tuple, block.tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        return self.block(0, len(self)).astype(dtype or float, copy=False)
+
+    def block(self, start, stop):
+        '''Points start to stop (as for a slice) as an (n, n_axes) array.'''
+        indices = self._range[start:stop]
+        return self._points(np.arange(indices.start, indices.stop, indices.step, dtype=np.int64))
+
+    def blocks(self, size=65536):
+        '''The points in order, as arrays of up to size points.'''
+        for start in range(0, len(self), size):
+            yield self.block(start, start + size)
+
+    def tolist(self):
+        return [list(point) for point in self]
+
+    def violations(self, spectrometer, start=0, stop=None):
+        '''Boolean mask of the points start to stop outside the hard limits (see limit_violations).'''
+        return limit_violations(spectrometer, self.block(start, len(self) if stop is None else stop))
+
+    def count_violations(self, spectrometer):
+        '''Number of points outside the hard limits. For a whole plan only the values of each dimension are checked, so this costs
+        nothing even for huge plans; slices are checked block by block.'''
+        if len(self) != int(np.prod(self.shape, dtype=np.int64)) or self._range.step != 1:
+            return int(sum(limit_violations(spectrometer, block).sum() for block in self.blocks()))
+        if any(axis_violations(spectrometer, axis, [angle])[0] for axis, angle in self.fixed.items()):
+            return len(self)
+        n_valid = 1
+        for axes, values in self.dimensions:
+            violations = np.zeros(len(values), dtype=bool)
+            for axis in axes:
+                violations |= axis_violations(spectrometer, axis, values)
+            n_valid *= int((~violations).sum())
+        return len(self) - n_valid
+
+
+def as_points(points):
+    '''Points as an (N, 2) or (N, 3) array, from a list of tuples, an array or a ScanPlan (which this materialises).'''
+    if isinstance(points, ScanPlan):
+        return points.block(0, len(points))
+    points = np.asarray(points, dtype=float)
+    return points.reshape(-1, points.shape[-1] if points.ndim > 1 else 2)
+
+
+def axis_violations(spectrometer, axis, angles):
+    '''Boolean mask of the angles outside the hard limits of one axis (none for axes without hard limits, e.g. Z).'''
+    angles = np.asarray(angles, dtype=float)
+    hard_limits = getattr(spectrometer, 'hard_limits', None)
+    steps_per_degree = getattr(spectrometer, 'steps_per_degree', None)
+    if hard_limits is None or steps_per_degree is None or axis not in hard_limits:
+        return np.zeros(len(angles), dtype=bool)
+    steps = (angles * steps_per_degree[axis]).astype(int) # truncation as in angle_to_steps
+    return (steps < hard_limits[axis][0]) | (steps > hard_limits[axis][1])
+
+
+def limit_violations(spectrometer, points):
+    '''Boolean mask of the points outside the hard limits of the spectrometer, evaluated for all points at once. Only the arms (X
+    and Y) have hard limits.'''
+    if isinstance(points, ScanPlan):
+        return np.concatenate([limit_violations(spectrometer, block) for block in points.blocks()] or [np.zeros(0, dtype=bool)])
+    points = as_points(points)
+    violations = np.zeros(len(points), dtype=bool)
+    for column, axis in enumerate(('X', 'Y')):
+        violations |= axis_violations(spectrometer, axis, points[:, column])
+    return violations
+
+
+def export_scan_list(scan_list, filepath):
+    with open(filepath, "w") as f:
+        for point in scan_list:
+            f.write(','.join(str(angle) for angle in point) + "\n")
+
+
+def scan_job(worker, points, dwell=None, return_to=None, data_dir=None, estimator=None, repeats=None, acquire=None, gate=None, scan_pass='sample',
+             exposure=None):
+    '''Worker job visiting each (x, y) or (x, y, z) point in turn; points can be a list or a ScanPlan, which is never materialised, and
+    Z (sample rotation) is moved with go_to_z. At every point the job waits for the acquisition (see MotionWorker.wait_for_continue), posting
+    'scan_started', 'progress', 'position' and 'scan_complete' events. The scan list is written to data_dir before moving.
+    With repeats > 1 (by default the plan's repeats, or 1) the acquisition is repeated at every point, with an 'acquire' event before each.
+
+    With an estimator (ScanEstimator) the move and acquisition times are recorded to calibrate it, and the predicted and actual scan
+    times are reported in 'scan_complete'.
+
+    With acquire, a callable(worker, angles) returning the spectrum (e.g. a detector driver, see ars_detector), it is called instead of waiting
+    at each point. A QualityGate (gate, see ars_quality) then checks each spectrum as it arrives and has failing ones acquired again
+    with adjusted settings before the arms move on; the flags are logged to data_dir for the analysis. scan_pass ('sample' or
+    'reference') tells the gate which spectra are references. With an ExposurePlanner (exposure, see ars_exposure) and a detector
+    whose integration time can be set, the integration time of every point is predicted from the points before it and the reference
+    pass, and the exposure map is saved to the planner's cache at the end.'''
+    spectrometer = worker.spectrometer
+    total = len(points)
+    if repeats is None:
+        repeats = getattr(points, 'repeats', 1)
+    if hasattr(acquire, 'data_type'):
+        acquire.data_type = scan_pass
+    auto_exposure = exposure is not None and getattr(acquire, 'can_set_integration_time', False)
+
+    if data_dir is not None:
+        export_scan_list(points, os.path.join(data_dir, "scan_list.dat"))
+
+    predicted = None
+    if estimator is not None:
+        predicted = estimator.estimate(points, dwell, return_to=return_to, repeats=repeats)['total']
+
+    worker.post('scan_started', total=total, predicted=predicted)
+    start_time = time.perf_counter()
+    paused_time = getattr(worker, 'paused_time', lambda: 0.0) # pauses are left out of the timings given to the estimator
+    start_paused = paused_time()
+
+    def timed_move(angles):
+        x_angle, y_angle = angles[:2]
+        start_angle = dict(spectrometer.current_angle)
+        move_start = time.perf_counter()
+        spectrometer.go_to_angle(x_angle, y_angle)
+        spectrometer.wait_for_motors()
+        move_elapsed = time.perf_counter() - move_start # the estimator models the arms only, so the Z move is not timed
+        if len(angles) > 2:
+            spectrometer.go_to_z(angles[2])
+        if estimator is not None:
+            steps_x = spectrometer.angle_to_steps('X', x_angle) - spectrometer.angle_to_steps('X', start_angle['X'])
+            steps_y = spectrometer.angle_to_steps('Y', y_angle) - spectrometer.angle_to_steps('Y', start_angle['Y'])
+            estimator.record_move(steps_x, steps_y, move_elapsed)
+        worker.post_position()
+
+    for idx, point in enumerate(points):
+        angles = tuple(float(angle) for angle in point)
+        worker.checkpoint()
+        timed_move(angles)
+        worker.post('progress', index=idx, total=total, angles=angles)
+
+        for repeat in range(repeats):
+            if auto_exposure:
+                acquire.set_integration_time(exposure.predict(angles, scan_pass))
+            worker.post('acquire', index=idx, repeat=repeat, angles=angles, integration_time=getattr(acquire, 'integration_time', None))
+            acquisition_start, acquisition_paused = time.perf_counter(), paused_time()
+            if acquire is None:
+                worker.wait_for_continue(dwell)
+            elif gate is None:
+                spectrum = acquire(worker, angles)
+            else:
+                spectrum, _ = gated_acquire(worker, acquire, gate, angles, data_type=scan_pass, repeat=repeat, data_dir=data_dir)
+            if exposure is not None and acquire is not None:
+                exposure.record(angles, scan_pass, spectrum, getattr(acquire, 'integration_time', None))
+            if estimator is not None and not dwell:
+                estimator.record_acquisition(time.perf_counter() - acquisition_start - (paused_time() - acquisition_paused))
+
+    if hasattr(acquire, 'flush'):
+        acquire.flush() # writes the last spectrum
+    if exposure is not None:
+        exposure.save()
+
+    if return_to is not None:
+        worker.checkpoint()
+        timed_move(tuple(return_to))  # Return to the origin
+
+    elapsed = time.perf_counter() - start_time
+    if estimator is not None:
+        estimator.record_scan(total, predicted, elapsed - (paused_time() - start_paused))
+    worker.post('scan_complete', total=total, elapsed=elapsed, predicted=predicted)
+    return elapsed
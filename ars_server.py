@@ -0,0 +1,442 @@
+import json
+import queue
+import socket
+import itertools
+import threading
+import socketserver
+from concurrent.futures import Future, ThreadPoolExecutor
+from ars_worker import MotionWorker, ScanAborted
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+ABORTED = -32001
+
+
+class RPCError(Exception):
+    def __init__(self, code, message, data=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+# worker jobs, run on the single I/O thread
+def _move_job(worker, x_angle, y_angle):
+    worker.checkpoint()
+    worker.spectrometer.go_to_angle(x_angle, y_angle)
+    worker.post_position()
+    return dict(worker.spectrometer.current_angle)
+
+
+def _home_job(worker, mode='full'):
+    spectrometer = worker.spectrometer
+    if mode == 'full' or not hasattr(spectrometer, 'home'):
+        spectrometer.home_motors()
+        result = {'mode': 'full'}
+    else:
+        result = spectrometer.home(mode)
+    worker.post_position()
+    return result
+
+
+def _query_position_job(worker):
+    spectrometer = worker.spectrometer
+    if hasattr(spectrometer, 'verify_position'):
+        spectrometer.verify_position()
+    else:
+        spectrometer.get_current_position()
+    worker.post_position()
+    return dict(spectrometer.current_angle)
+
+
+def _command_job(worker, command):
+    result = worker.spectrometer.process_coms(command)
+    worker.post_position()
+    return result
+
+
+class ControlServer:
+    '''Local JSON-RPC 2.0 server for scripted control of a spectrometer, one request or response per line over TCP:
+
+        {"jsonrpc": "2.0", "id": 1, "method": "move", "params": {"x": 20, "y": 20}}
+
+    Methods: status, position (cached, no serial traffic), query_position, home, move, scan, command (a console command such as
+    "setpos 0,0,0"), pause, resume, abort, continue, subscribe and unsubscribe. Every call that talks to the controller is run as a job
+    on one MotionWorker, so the serial port is only used from one thread however many clients are connected. Calls that only read
+    state or signal the worker (status, position, pause, resume, abort, continue) are answered at once from the connection's thread;
+    calls that wait for a job run on a small pool per connection, so an abort sent during a move on the same connection is not
+    queued behind it, and responses can arrive out of order (match them by id). move, home and query_position reply when done; scan
+    replies with the job id straight away (or when finished with "wait": true). After subscribe, the worker's events are pushed to
+    the client as {"jsonrpc": "2.0", "method": "event", "params": {"kind": ..., ...}} notifications, through a queue of
+    event_queue_size events per client: a client that falls that far behind is unsubscribed, with a final "unsubscribed" event,
+    rather than holding up the events of the others.
+
+    Binds to localhost only. Use port=0 to pick a free port (see address).'''
+
+    blocking_methods = ('query_position', 'home', 'move', 'scan', 'command') # wait for a worker job
+
+    def __init__(self, spectrometer, host='127.0.0.1', port=8765, worker=None, event_queue_size=1000):
+        self.spectrometer = spectrometer
+        self.event_queue_size = event_queue_size
+        self.worker = worker if worker is not None else MotionWorker(spectrometer)
+        self._futures = {}
+        self._futures_lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        self._subscribers = set()
+        self._subscribers_lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+        self.methods = {
+            'status': self.status,
+            'position': self.position,
+            'query_position': self.query_position,
+            'home': self.home,
+            'move': self.move,
+            'scan': self.scan,
+            'command': self.command,
+            'pause': self.pause,
+            'resume': self.resume,
+            'abort': self.abort,
+            'continue': self.continue_scan,
+        }
+
+        self.server = _ThreadingServer((host, port), _ConnectionHandler)
+        self.server.control = self
+        self._threads = [threading.Thread(target=self.server.serve_forever, daemon=True), threading.Thread(target=self._pump_events, daemon=True)]
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def start(self):
+        if not self.worker.is_alive():
+            self.worker.start()
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=2):
+        self._stop_event.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.worker.stop(timeout)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def serve_forever(self):
+        '''Starts the server and blocks until interrupted.'''
+        self.start()
+        print(f"Listening on {self.address[0]}:{self.address[1]}")
+        try:
+            self._stop_event.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    # jobs
+    def submit(self, name, func, *args, **kwargs):
+        '''Queues a job on the I/O worker. Returns (job id, Future resolved with its result).'''
+        job_id = f"{name}-{next(self._job_ids)}"
+        future = Future()
+        with self._futures_lock:
+            self._futures[job_id] = future
+        self.worker.submit(job_id, func, *args, **kwargs)
+        return job_id, future
+
+    def run(self, name, func, *args, timeout=None, **kwargs):
+        _, future = self.submit(name, func, *args, **kwargs)
+        return future.result(timeout)
+
+    def _pump_events(self):
+        while not self._stop_event.is_set():
+            try:
+                kind, payload = self.worker.events.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if kind in ('finished', 'aborted', 'error'):
+                with self._futures_lock:
+                    future = self._futures.pop(payload.get('job'), None)
+                if future is not None:
+                    if kind == 'finished':
+                        future.set_result(payload.get('result'))
+                    elif kind == 'aborted':
+                        future.set_exception(ScanAborted())
+                    else:
+                        future.set_exception(payload['error'])
+            self.publish(kind, payload)
+
+    def publish(self, kind, payload):
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return
+        params = {key: value for key, value in payload.items() if key != 'traceback'}
+        params['kind'] = kind
+        for connection in subscribers:
+            if not connection.push_event({'jsonrpc': '2.0', 'method': 'event', 'params': params}):
+                self.unsubscribe(connection, reason='overflow')
+
+    def subscribe(self, connection):
+        with self._subscribers_lock:
+            if connection not in self._subscribers:
+                connection.open_events(self.event_queue_size)
+                self._subscribers.add(connection)
+        return True
+
+    def unsubscribe(self, connection, reason=None):
+        with self._subscribers_lock:
+            if connection in self._subscribers:
+                self._subscribers.discard(connection)
+                connection.close_events(reason)
+        return True
+
+    # methods
+    def status(self):
+        state = self.position()
+        state.update({'busy': self.worker.busy, 'paused': self.worker.paused, 'job': self.worker.current_job, 'queued': self.worker.jobs.qsize()})
+        return state
+
+    def position(self):
+        '''The position the host believes the arms are at. No serial traffic.'''
+        position = getattr(self.spectrometer, 'position', None)
+        return {'angles': dict(self.spectrometer.current_angle), 'trusted': getattr(position, 'trusted', None)}
+
+    def query_position(self, timeout=None):
+        return {'angles': self.run('query_position', _query_position_job, timeout=timeout)}
+
+    def home(self, mode='full', timeout=None):
+        return self.run('home', _home_job, mode, timeout=timeout)
+
+    def move(self, x, y, timeout=None):
+        return {'angles': self.run('move', _move_job, float(x), float(y), timeout=timeout)}
+
+    def scan(self, points, dwell=1.0, repeats=1, data_dir=None, wait=False, timeout=None):
+        from ars_scan import scan_job
+
+        if not dwell or dwell <= 0:
+            raise RPCError(INVALID_PARAMS, "dwell must be > 0; use continue to step a manual scan from a client.")
+        points = [tuple(float(angle) for angle in point) for point in points]
+        if any(len(point) not in (2, 3) for point in points):
+            raise RPCError(INVALID_PARAMS, "points are [x, y] or [x, y, z].")
+        job_id, future = self.submit('scan', scan_job, points, dwell=dwell, data_dir=data_dir, repeats=int(repeats))
+        if wait:
+            return {'job': job_id, 'elapsed': future.result(timeout)}
+        return {'job': job_id}
+
+    def command(self, command, timeout=None):
+        return self.run('command', _command_job, str(command), timeout=timeout)
+
+    def pause(self):
+        self.worker.pause()
+        return True
+
+    def resume(self):
+        self.worker.resume()
+        return True
+
+    def abort(self):
+        self.worker.abort()
+        return True
+
+    def continue_scan(self):
+        self.worker.continue_scan()
+        return True
+
+    def dispatch(self, request, connection=None):
+        '''Handles one decoded request and returns the response dict, or None for notifications.'''
+        if not isinstance(request, dict) or request.get('jsonrpc') != '2.0' or not isinstance(request.get('method'), str):
+            return _error(request.get('id') if isinstance(request, dict) else None, INVALID_REQUEST, "Invalid request.")
+        request_id = request.get('id')
+        method = request['method']
+        params = request.get('params', {})
+        try:
+            if method == 'subscribe':
+                result = self.subscribe(connection)
+            elif method == 'unsubscribe':
+                result = self.unsubscribe(connection)
+            elif method not in self.methods:
+                raise RPCError(METHOD_NOT_FOUND, f"Unknown method '{method}'.")
+            elif isinstance(params, dict):
+                result = self.methods[method](**params)
+            elif isinstance(params, list):
+                result = self.methods[method](*params)
+            else:
+                raise RPCError(INVALID_PARAMS, "params must be an object or an array.")
+        except RPCError as e:
+            return _error(request_id, e.code, e.message, e.data)
+        except TypeError as e:
+            return _error(request_id, INVALID_PARAMS, str(e))
+        except ScanAborted:
+            return _error(request_id, ABORTED, "Aborted.")
+        except Exception as e:
+            return _error(request_id, SERVER_ERROR, str(e) or type(e).__name__, type(e).__name__)
+        if request_id is None:
+            return None
+        return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+
+def _error(request_id, code, message, data=None):
+    error = {'code': code, 'message': message}
+    if data is not None:
+        error['data'] = data
+    return {'jsonrpc': '2.0', 'id': request_id, 'error': error}
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _ConnectionHandler(socketserver.StreamRequestHandler):
+    '''One thread per client, which answers the non-blocking requests itself and hands the blocking ones to a pool. Event
+    notifications are written by a separate thread from a bounded queue, interleaved with the responses.'''
+
+    pool_size = 4
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._send_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(self.pool_size, thread_name_prefix='ControlRequest')
+        self._events = None
+        self._events_closed = None
+
+    def open_events(self, maxsize):
+        self._events = queue.Queue(maxsize)
+        self._events_closed = threading.Event()
+        self._events_reason = None
+        threading.Thread(target=self._write_events, args=(self._events, self._events_closed), daemon=True).start()
+
+    def push_event(self, message):
+        '''Queues an event for the client. False if its queue is full, i.e. the client is not reading.'''
+        try:
+            self._events.put_nowait(message)
+        except queue.Full:
+            return False
+        return True
+
+    def close_events(self, reason=None):
+        '''Stops the event writer once it has written the events already queued, then sends an unsubscribed event if reason is given.'''
+        self._events_reason = reason
+        self._events_closed.set()
+
+    def _write_events(self, events, closed):
+        while True:
+            try:
+                message = events.get(timeout=0.1)
+            except queue.Empty:
+                if closed.is_set():
+                    break
+                continue
+            self.send(message)
+        if self._events_reason is not None:
+            self.send({'jsonrpc': '2.0', 'method': 'event', 'params': {'kind': 'unsubscribed', 'reason': self._events_reason}})
+
+    def send(self, message):
+        line = (json.dumps(message, default=str) + '\n').encode()
+        try:
+            with self._send_lock:
+                self.wfile.write(line)
+                self.wfile.flush()
+        except (OSError, ValueError): # ValueError: written after the connection was closed
+            self.server.control.unsubscribe(self)
+
+    def handle(self):
+        control = self.server.control
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    self.send(_error(None, PARSE_ERROR, "Parse error."))
+                    continue
+                if isinstance(request, dict) and request.get('method') in control.blocking_methods:
+                    self._pool.submit(self._respond, request)
+                else:
+                    self._respond(request)
+        except OSError:
+            pass
+        finally:
+            control.unsubscribe(self)
+            self._pool.shutdown(wait=False)
+
+    def _respond(self, request):
+        response = self.server.control.dispatch(request, self)
+        if response is not None:
+            self.send(response)
+
+
+class ControlClient:
+    '''Blocking client for ControlServer:
+
+        client = ControlClient(port=8765)
+        client.call('move', x=20, y=20)
+        client.subscribe(lambda event: print(event['kind']))
+
+    Calls can be made from several threads; responses are matched to calls by id. Event callbacks run on the client's reader thread.'''
+
+    def __init__(self, host='127.0.0.1', port=8765, timeout=None):
+        self.timeout = timeout
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self.socket.makefile('rb')
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def close(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def call(self, method, *args, **kwargs):
+        request_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            self._pending[request_id] = future
+        request = {'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': list(args) if args else kwargs}
+        self.socket.sendall((json.dumps(request) + '\n').encode())
+        return future.result(self.timeout)
+
+    def subscribe(self, callback):
+        '''callback(event) is called with the params of every event notification.'''
+        self._callbacks.append(callback)
+        return self.call('subscribe')
+
+    def _read(self):
+        for line in self._file:
+            message = json.loads(line)
+            if 'id' not in message:
+                for callback in self._callbacks:
+                    callback(message.get('params', {}))
+                continue
+            with self._lock:
+                future = self._pending.pop(message['id'], None)
+            if future is None:
+                continue
+            if 'error' in message:
+                error = message['error']
+                future.set_exception(RPCError(error['code'], error['message'], error.get('data')))
+            else:
+                future.set_result(message.get('result'))
+        with self._lock:
+            for future in self._pending.values():
+                future.set_exception(ConnectionError("Connection closed."))
+            self._pending.clear()
@@ -0,0 +1,131 @@
+import os
+import tty
+import time
+import select
+import threading
+
+
+class SimulatedController(threading.Thread):
+    '''Emulates the motor controller firmware on a pseudo terminal, so AngleResolvedSpectrometer can be run without hardware:
+
+        sim = SimulatedController()
+        sim.start()
+        ars = AngleResolvedSpectrometer(serial_port=sim.port)
+
+    Supported commands and replies, as used by AngleResolvedSpectrometer:
+        mox<n>, moy<n>, moz<n>   relative move of n steps, no reply
+        isrun                    R1 while any axis is moving, otherwise S0
+        pos                      <[x,y,z]> followed by #CF
+        setpos<x>,<y>,<z>        S0
+        home                     homes both arms, then a message followed by #CF. Takes home_time, plus the distance to the
+                                 switches at home_speed (steps/s) if given
+        anything else            F0
+
+    Moves run at a constant speed (steps/s) without acceleration. POSIX only (uses os.openpty).'''
+
+    def __init__(self, speed=4000.0, home_time=0.5, name='simulated controller', home_speed=None):
+        super().__init__(daemon=True)
+        self.speed = speed
+        self.home_time = home_time
+        self.home_speed = home_speed
+        self.name = name
+
+        self.master_fd, slave_fd = os.openpty()
+        tty.setraw(slave_fd) # no echo or line processing before the client configures the port
+        self.port = os.ttyname(slave_fd)
+        self._slave_fd = slave_fd # kept open so the pty survives until the client connects
+
+        self.axes = {axis: {'start': 0, 'target': 0, 't_start': 0.0, 'duration': 0.0} for axis in 'xyz'}
+        self.commands = [] # (timestamp, command) log of everything received
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(1)
+        for fd in (self.master_fd, self._slave_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    # motion model
+    def position(self, axis, now=None):
+        state = self.axes[axis]
+        if now is None:
+            now = time.perf_counter()
+        if state['duration'] <= 0 or now >= state['t_start'] + state['duration']:
+            return state['target']
+        fraction = (now - state['t_start']) / state['duration']
+        return int(round(state['start'] + (state['target'] - state['start']) * fraction))
+
+    def is_running(self, now=None):
+        if now is None:
+            now = time.perf_counter()
+        return any(now < state['t_start'] + state['duration'] for state in self.axes.values())
+
+    def move(self, axis, steps, speed=None):
+        now = time.perf_counter()
+        start = self.position(axis, now)
+        self.axes[axis] = {'start': start, 'target': start + steps, 't_start': now, 'duration': abs(steps) / (speed or self.speed)}
+
+    def set_position(self, axis, steps):
+        self.axes[axis] = {'start': steps, 'target': steps, 't_start': 0.0, 'duration': 0.0}
+
+    # serial side
+    def write(self, text):
+        os.write(self.master_fd, text.encode())
+
+    def run(self):
+        buffer = b''
+        while not self._stop_event.is_set():
+            try:
+                readable, _, _ = select.select([self.master_fd], [], [], 0.05)
+            except (OSError, ValueError):
+                break
+            if not readable:
+                continue
+            try:
+                chunk = os.read(self.master_fd, 1024)
+            except OSError:
+                break
+            buffer += chunk
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                command = line.decode(errors='replace').strip()
+                if command:
+                    with self._lock:
+                        self.commands.append((time.time(), command))
+                        reply = self.handle(command)
+                    if reply:
+                        self.write(reply)
+
+    def handle(self, command):
+        '''Returns the reply to a command, or None.'''
+        if command[:3] in ('mox', 'moy', 'moz'):
+            try:
+                steps = int(float(command[3:]))
+            except ValueError:
+                return 'F0\r\n'
+            self.move(command[2], steps)
+            return None
+        if command == 'isrun':
+            return 'R1\r\n' if self.is_running() else 'S0\r\n'
+        if command == 'pos':
+            return '<[{},{},{}]>\r\n#CF\r\n'.format(*(self.position(axis) for axis in 'xyz'))
+        if command.startswith('setpos'):
+            try:
+                values = [int(float(value)) for value in command[6:].split(',')]
+            except ValueError:
+                return 'F0\r\n'
+            for axis, value in zip('xyz', values):
+                self.set_position(axis, value)
+            return 'S0\r\n'
+        if command == 'home':
+            travel = max(abs(self.position('x')), abs(self.position('y')))
+            time.sleep(self.home_time + (travel / self.home_speed if self.home_speed else 0))
+            self.set_position('x', 0)
+            self.set_position('y', 0)
+            return 'Homing complete\r\n#CF\r\n'
+        return 'F0\r\n'
@@ -0,0 +1,192 @@
+import json
+import time
+import threading
+
+
+class ReplayMismatch(AssertionError):
+    '''Raised by a strict ReplaySerial when the host writes something other than what the transcript recorded.'''
+    pass
+
+
+def _encode(data):
+    return data.decode('latin-1')
+
+
+def _decode(text):
+    return text.encode('latin-1')
+
+
+class RecordingSerial:
+    '''Wraps a serial port (a pyserial Serial or anything with write, readline, read and in_waiting) and appends every byte written to
+    or read from it to a transcript file, one json line per transfer:
+
+        {"t": 1.2345, "dir": "tx", "data": "mox532\\n"}
+
+    t is seconds since the port was wrapped. The first line records the port settings and the wall clock start time. Received data
+    is timestamped when the host first saw it waiting (in_waiting > 0), or when it was read if the host reads without polling.'''
+
+    def __init__(self, port, filepath):
+        self.port = port
+        self.filepath = filepath
+        self._file = open(filepath, 'w')
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._arrived = None
+        self._write_line({'port': getattr(port, 'port', None), 'baudrate': getattr(port, 'baudrate', None), 'started': time.time()})
+
+    def _write_line(self, entry):
+        with self._lock:
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+
+    def _record(self, direction, data, when=None):
+        if data:
+            when = time.perf_counter() if when is None else when
+            self._write_line({'t': round(when - self._start, 6), 'dir': direction, 'data': _encode(data)})
+
+    def _received(self, data):
+        arrived, self._arrived = self._arrived, None
+        self._record('rx', data, arrived)
+
+    def write(self, data):
+        result = self.port.write(data)
+        self._record('tx', data)
+        return result
+
+    def readline(self, *args, **kwargs):
+        data = self.port.readline(*args, **kwargs)
+        self._received(data)
+        return data
+
+    def read(self, size=1):
+        data = self.port.read(size)
+        self._received(data)
+        return data
+
+    @property
+    def in_waiting(self):
+        waiting = self.port.in_waiting
+        if waiting and self._arrived is None:
+            self._arrived = time.perf_counter()
+        return waiting
+
+    def reset_input_buffer(self):
+        self.port.reset_input_buffer()
+        self._arrived = None
+
+    def close(self):
+        self.port.close()
+        with self._lock:
+            self._file.close()
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+
+def load_transcript(filepath):
+    '''Returns (settings, events) from a transcript file, events being (t, direction, bytes) tuples.'''
+    with open(filepath, 'r') as file:
+        lines = [json.loads(line) for line in file if line.strip()]
+    if not lines:
+        raise ValueError(f"{filepath} is empty.")
+    settings = lines[0] if 'dir' not in lines[0] else {}
+    events = [(entry['t'], entry['dir'], _decode(entry['data'])) for entry in lines if 'dir' in entry]
+    return settings, events
+
+
+class ReplaySerial:
+    '''Serial port stand-in that plays a recorded transcript back to AngleResolvedSpectrometer (pass it as transport=...).
+
+    Replies become readable with the delays they had in the recording, measured from the command they followed and divided by speed
+    (speed=float('inf') or 0 makes every reply available as soon as its command is written, which also makes several lines arrive in
+    one read). Each write consumes the next recorded command; with strict=True a write that differs from the recording raises
+    ReplayMismatch, so protocol changes that alter the traffic are caught. Reads wait for the recorded replies and return what is left
+    once the transcript is exhausted.'''
+
+    def __init__(self, filepath=None, speed=1.0, strict=True, events=None):
+        if events is None:
+            _, events = load_transcript(filepath)
+        self.events = list(events)
+        self.speed = float('inf') if not speed else float(speed)
+        self.strict = strict
+        self.port = filepath
+        self.is_open = True
+        self.writes = [] # everything the host wrote
+        self._buffer = b''
+        self._index = 0
+        self._anchor_wall = time.perf_counter()
+        self._anchor_t = 0.0
+
+    def _due(self, t):
+        if self.speed == float('inf'):
+            return self._anchor_wall
+        return self._anchor_wall + (t - self._anchor_t) / self.speed
+
+    def _release(self, wait=False):
+        '''Moves the replies that are due into the input buffer. With wait, sleeps until the next reply is due if none is.'''
+        while self._index < len(self.events):
+            t, direction, data = self.events[self._index]
+            if direction != 'rx':
+                return
+            due = self._due(t)
+            now = time.perf_counter()
+            if now < due:
+                if not wait:
+                    return
+                time.sleep(due - now)
+            self._buffer += data
+            self._index += 1
+            wait = False
+
+    @property
+    def finished(self):
+        return self._index >= len(self.events)
+
+    @property
+    def in_waiting(self):
+        self._release()
+        return len(self._buffer)
+
+    def write(self, data):
+        self.writes.append(data)
+        # replies recorded before this command had arrived before it was sent
+        while self._index < len(self.events) and self.events[self._index][1] == 'rx':
+            self._buffer += self.events[self._index][2]
+            self._index += 1
+        if self._index >= len(self.events):
+            if self.strict:
+                raise ReplayMismatch(f"Write {data!r} after the end of the transcript.")
+            return len(data)
+
+        t, _, recorded = self.events[self._index]
+        if self.strict and data != recorded:
+            raise ReplayMismatch(f"Transcript event {self._index}: expected {recorded!r}, host wrote {data!r}.")
+        self._index += 1
+        self._anchor_wall = time.perf_counter()
+        self._anchor_t = t
+        return len(data)
+
+    def _wait_for(self, condition):
+        self._release()
+        while not condition() and not self.finished and self.events[self._index][1] == 'rx':
+            self._release(wait=True)
+
+    def readline(self):
+        self._wait_for(lambda: b'\n' in self._buffer)
+        if b'\n' in self._buffer:
+            line, self._buffer = self._buffer.split(b'\n', 1)
+            return line + b'\n'
+        line, self._buffer = self._buffer, b''
+        return line
+
+    def read(self, size=1):
+        self._wait_for(lambda: len(self._buffer) >= size)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def reset_input_buffer(self):
+        self._release()
+        self._buffer = b''
+
+    def close(self):
+        self.is_open = False
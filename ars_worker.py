@@ -0,0 +1,146 @@
+import time
+import queue
+import threading
+import traceback
+
+
+class ScanAborted(Exception):
+    '''Raised inside a job when the operator aborts it.'''
+    pass
+
+
+class MotionWorker(threading.Thread):
+    '''Runs motion and scan jobs for a spectrometer on a background thread.
+
+    All serial communication should go through this worker so that only one thread ever talks to the controller. Jobs are callables
+    taking the worker as their first argument, which gives them access to the spectrometer and to post, checkpoint and wait_for_continue.
+    Progress, positions and errors are put on the events queue as (kind, payload) tuples for the UI thread to poll, e.g. with Tk's after().
+    Several workers can share one events queue; give each a name and it is added to every payload as 'rig' (and names the thread).'''
+
+    def __init__(self, spectrometer, name=None, events=None):
+        super().__init__(name=None if name is None else f"MotionWorker-{name}", daemon=True)
+        self.spectrometer = spectrometer
+        self.rig = name
+        self.jobs = queue.Queue()
+        self.events = queue.Queue() if events is None else events
+        self.current_job = None
+
+        self._running = threading.Event()  # cleared while paused
+        self._running.set()
+        self._paused_total = 0.0 # s spent paused, over all jobs
+        self._paused_since = None
+        self._abort = threading.Event()
+        self._continue = threading.Event()
+
+    def submit(self, name, func, *args, **kwargs):
+        '''Queue a job. func is called as func(worker, *args, **kwargs) on the worker thread.'''
+        self.jobs.put((name, func, args, kwargs))
+
+    def submit_call(self, name, method, *args):
+        '''Queue a plain spectrometer method call and report the new position afterwards.'''
+        def job(worker):
+            result = method(*args)
+            worker.post_position()
+            return result
+        self.submit(name, job)
+
+    def stop(self, timeout=None):
+        '''Abort the running job and shut the worker down once the queue is empty.'''
+        self.abort()
+        self.jobs.put(None)
+        if self.is_alive():
+            self.join(timeout)
+
+    @property
+    def busy(self):
+        return self.current_job is not None
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            name, func, args, kwargs = job
+            self._abort.clear()
+            self._continue.clear()
+            self._end_pause()
+            self._running.set()
+            self.current_job = name
+            self.post('started', job=name)
+            try:
+                result = func(self, *args, **kwargs)
+            except ScanAborted:
+                self.post('aborted', job=name)
+            except Exception as e:
+                self.post('error', job=name, error=e, traceback=traceback.format_exc())
+            else:
+                self.post('finished', job=name, result=result)
+            finally:
+                self.current_job = None
+
+    def post(self, kind, **payload):
+        if self.rig is not None:
+            payload['rig'] = self.rig
+        self.events.put((kind, payload))
+
+    def post_position(self):
+        '''Report the position the spectrometer believes it is at. Does not talk to the controller.'''
+        angles = getattr(self.spectrometer, 'current_angle', None)
+        if angles is not None:
+            position = getattr(self.spectrometer, 'position', None)
+            self.post('position', angles=dict(angles), trusted=getattr(position, 'trusted', True))
+
+    # controls, called from the UI thread
+    def paused_time(self):
+        '''Total time (s) the worker has spent paused, including the current pause. Differences of it give the paused part of an
+        interval, e.g. to keep pauses out of measured timings.'''
+        paused_since = self._paused_since
+        return self._paused_total + (time.perf_counter() - paused_since if paused_since is not None else 0.0)
+
+    def _end_pause(self):
+        paused_since, self._paused_since = self._paused_since, None
+        if paused_since is not None:
+            self._paused_total += time.perf_counter() - paused_since
+
+    def pause(self):
+        if self._paused_since is None:
+            self._paused_since = time.perf_counter()
+        self._running.clear()
+        self.post('paused', job=self.current_job)
+
+    def resume(self):
+        self._end_pause()
+        self._running.set()
+        self.post('resumed', job=self.current_job)
+
+    def abort(self):
+        self._abort.set()
+        self._continue.set()
+        self._end_pause()
+        self._running.set()
+
+    def continue_scan(self):
+        '''Signal that the acquisition at the current point is done.'''
+        self._continue.set()
+
+    # helpers for jobs, called from the worker thread
+    def checkpoint(self):
+        '''Blocks while paused and raises ScanAborted if the job was aborted. Jobs should call this between moves.'''
+        while not self._running.wait(0.1):
+            pass
+        if self._abort.is_set():
+            raise ScanAborted()
+
+    def wait_for_continue(self, dwell=None):
+        '''Waits for the acquisition at the current point. With a dwell time (s) the wait ends after dwell seconds, otherwise when continue_scan is called. Pausing extends the wait.'''
+        self._continue.clear()
+        if dwell:
+            self._continue.wait(dwell)
+        else:
+            self.post('waiting', job=self.current_job)
+            self._continue.wait()
+        self.checkpoint()
@@ -0,0 +1,79 @@
+'''Serial protocol handling benchmark. Records a session (home, a series of moves and a position check) against a simulated
+controller, then replays the transcript to the controller code at the recorded speed, faster, and with every reply available at
+once. The replay at full speed is the time the host spends in its own protocol handling (fixed sleeps, polling, parsing), so it
+shows the effect of changes to that code without hardware; the strict replay also fails if a change alters the traffic.
+
+    python benchmarks/bench_replay.py [--moves 10] [--transcript session.jsonl] [--speeds 1 10 0]
+
+With --transcript an existing recording of the same session is replayed (it is recorded there first if the file does not exist).
+'''
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ars_controller import AngleResolvedSpectrometer
+from ars_transcript import ReplaySerial, load_transcript
+
+
+def session(spectrometer, n_moves):
+    spectrometer.home_motors()
+    for index in range(n_moves):
+        angle = 20 + 5 * (index % 4)
+        spectrometer.go_to_angle(angle, angle)
+    spectrometer.verify_position()
+
+
+def record(filepath, n_moves):
+    from ars_simulator import SimulatedController
+
+    simulator = SimulatedController(speed=20000)
+    simulator.start()
+    try:
+        start = time.perf_counter()
+        spectrometer = AngleResolvedSpectrometer(serial_port=simulator.port, ready_ping_after=0, position_journal=False, transcript=filepath)
+        session(spectrometer, n_moves)
+        elapsed = time.perf_counter() - start
+        spectrometer.uno_serial.close()
+    finally:
+        simulator.stop()
+    return elapsed
+
+
+def replay(filepath, n_moves, speed):
+    transport = ReplaySerial(filepath, speed=speed)
+    start = time.perf_counter()
+    spectrometer = AngleResolvedSpectrometer(transport=transport, ready_ping_after=0, position_journal=False)
+    session(spectrometer, n_moves)
+    return time.perf_counter() - start, transport
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--moves', type=int, default=10)
+    parser.add_argument('--transcript', default=None)
+    parser.add_argument('--speeds', type=float, nargs='+', default=[1, 10, 0], help="0 makes every reply available at once")
+    args = parser.parse_args()
+
+    filepath = args.transcript or os.path.join(tempfile.mkdtemp(), 'session.jsonl')
+    if not os.path.exists(filepath):
+        print(f"Recorded {filepath} in {record(filepath, args.moves):.2f} s")
+    _, events = load_transcript(filepath)
+    writes = sum(1 for event in events if event[1] == 'tx')
+    recorded = events[-1][0] if events else 0
+    print(f"{len(events)} transfers, {writes} commands, {recorded:.2f} s recorded")
+
+    print(f"{'speed':<10}{'elapsed (s)':>12}{'per command (ms)':>18}")
+    for speed in args.speeds:
+        elapsed, transport = replay(filepath, args.moves, speed)
+        if not transport.finished:
+            print(f"Replay at speed {speed} stopped before the end of the transcript.")
+        label = f"x{speed:g}" if speed else 'instant'
+        print(f"{label:<10}{elapsed:>12.3f}{elapsed / max(writes, 1) * 1e3:>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
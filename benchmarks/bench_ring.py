@@ -0,0 +1,181 @@
+'''Acquisition to analysis handoff benchmark. Spectra from the simulated detector are analysed (LiveReflectance, plus --work ms of
+pure Python per spectrum standing in for heavier analysis) three ways:
+
+    inline   in the acquisition process, as when live analysis runs next to the GUI and the serial I/O
+    queue    in an analysis process, every spectrum pickled through a bounded multiprocessing.Queue
+    ring     in an analysis process, through a SpectrumRing (shared memory slots, only metadata queued)
+
+With the writer running flat out it reports the throughput (spectra/s until the last one is analysed) and the time the writer was
+held up by backpressure. With the spectra arriving at --rate per second, as from a detector, it reports the handoff latency (put to
+the start of the handler, median and 99th percentile) and the lateness of a 1 ms polling thread in the acquisition process, which
+stands in for the serial polling that stalls while analysis holds the GIL.
+
+    python benchmarks/bench_ring.py [--spectra 2000] [--wavelengths 2048] [--slots 16] [--work 2] [--rate 200] [--modes inline queue ring]
+
+Latencies compare time.perf_counter across processes, which is a system-wide clock on Linux, Windows and macOS.
+'''
+import os
+import sys
+import time
+import argparse
+import threading
+import statistics
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from ars_detector import SimulatedDetector
+from ars_ring import SpectrumRing, LiveReflectance
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples) * 1e3, samples[int(0.99 * (len(samples) - 1))] * 1e3
+
+
+class TimedHandler(LiveReflectance):
+    '''LiveReflectance that records the handoff latency and first spins for work seconds in pure Python, holding the GIL.'''
+
+    def __init__(self, work):
+        super().__init__()
+        self.work = work
+        self.latencies = []
+
+    def __call__(self, spectrum, metadata):
+        self.latencies.append(time.perf_counter() - metadata['sent'])
+        end = time.perf_counter() + self.work
+        while time.perf_counter() < end:
+            pass
+        super().__call__(spectrum, metadata)
+
+
+class Poller(threading.Thread):
+    def __init__(self, interval=0.001):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.lateness = []
+        self.running = True
+
+    def run(self):
+        while self.running:
+            start = time.perf_counter()
+            time.sleep(self.interval)
+            self.lateness.append(time.perf_counter() - start - self.interval)
+
+
+def make_spectra(n_spectra, n_wavelengths, n_angles=61):
+    '''(intensity, metadata) of a dark, a reference pass and sample passes over n_angles angles, from the simulated detector.'''
+    detector = SimulatedDetector(wavelength=np.linspace(400, 1000, n_wavelengths), integration_time=0.1, realtime=False, seed=0)
+    spectra = []
+    for index in range(n_spectra):
+        angle = 15.0 + index % n_angles
+        detector.data_type = 'dark' if index == 0 else 'reference' if index <= n_angles else 'sample'
+        angles = None if detector.data_type == 'dark' else (angle, angle)
+        spectra.append((detector.acquire(angles), {'angles': angles, 'data_type': detector.data_type}))
+    return spectra
+
+
+def queue_reader(spectra_queue, results, work):
+    handler = TimedHandler(work)
+    while True:
+        item = spectra_queue.get()
+        if item is None:
+            break
+        handler(*item)
+    results.put(handler.latencies)
+
+
+def ring_reader(ring, results, work):
+    handler = TimedHandler(work)
+    for slot, spectrum, metadata in ring:
+        try:
+            handler(spectrum, metadata)
+        finally:
+            ring.release(slot)
+    ring.close()
+    results.put(handler.latencies)
+
+
+def paced(spectra, rate):
+    '''The spectra, each released at its time when rate (per second) is given.'''
+    start = time.perf_counter()
+    for index, spectrum in enumerate(spectra):
+        if rate:
+            delay = start + index / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield spectrum
+
+
+def run(mode, spectra, slots, work, rate=None):
+    '''Returns (elapsed, latencies, blocked, poll lateness).'''
+    poller = Poller()
+    poller.start()
+    blocked = 0.0
+    if mode == 'inline':
+        handler = TimedHandler(work)
+        start = time.perf_counter()
+        for intensity, metadata in paced(spectra, rate):
+            handler(intensity, dict(metadata, sent=time.perf_counter()))
+        elapsed = time.perf_counter() - start
+        latencies = handler.latencies
+    elif mode == 'queue':
+        spectra_queue = multiprocessing.Queue(maxsize=slots)
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=queue_reader, args=(spectra_queue, results, work))
+        process.start()
+        start = time.perf_counter()
+        for intensity, metadata in paced(spectra, rate):
+            put_start = time.perf_counter()
+            spectra_queue.put((intensity, dict(metadata, sent=put_start)))
+            blocked += time.perf_counter() - put_start
+        spectra_queue.put(None)
+        latencies = results.get()
+        elapsed = time.perf_counter() - start
+        process.join()
+    else:
+        ring = SpectrumRing(slots, len(spectra[0][0]))
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=ring_reader, args=(ring, results, work))
+        process.start()
+        start = time.perf_counter()
+        for intensity, metadata in paced(spectra, rate):
+            ring.put(intensity, sent=time.perf_counter(), **metadata)
+        ring.finish()
+        latencies = results.get()
+        elapsed = time.perf_counter() - start
+        blocked = ring.blocked_time
+        process.join()
+        ring.close()
+        ring.unlink()
+    poller.running = False
+    poller.join()
+    return elapsed, latencies, blocked, poller.lateness
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--spectra', type=int, default=2000)
+    parser.add_argument('--wavelengths', type=int, default=2048)
+    parser.add_argument('--slots', type=int, default=16, help="Ring slots, and the queue size of the queue mode")
+    parser.add_argument('--work', type=float, default=2.0, help="ms of pure Python analysis per spectrum")
+    parser.add_argument('--rate', type=float, default=200.0, help="spectra/s for the latency run")
+    parser.add_argument('--modes', nargs='+', default=['inline', 'queue', 'ring'], choices=('inline', 'queue', 'ring'))
+    args = parser.parse_args()
+
+    spectra = make_spectra(args.spectra, args.wavelengths)
+    size = spectra[0][0].nbytes
+    print(f"{args.spectra} spectra of {args.wavelengths} points ({size / 1024:.0f} KiB), {args.work} ms analysis each, {args.slots} slots")
+    print(f"{'':<8}{'flat out':^32}{f'at {args.rate:g} spectra/s':^48}")
+    print(f"{'mode':<8}{'spectra/s':>11}{'MB/s':>8}{'blocked (s)':>13}{'latency median (ms)':>21}{'p99 (ms)':>10}{'poll late p99 (ms)':>20}")
+    for mode in args.modes:
+        elapsed, _, blocked, _ = run(mode, spectra, args.slots, args.work * 1e-3)
+        _, latencies, _, lateness = run(mode, spectra, args.slots, args.work * 1e-3, rate=args.rate)
+        median, p99 = percentiles(latencies)
+        _, late = percentiles(lateness) if lateness else (0.0, 0.0)
+        print(f"{mode:<8}{args.spectra / elapsed:>11.0f}{args.spectra * size / elapsed / 1e6:>8.0f}{blocked:>13.2f}{median:>21.3f}{p99:>10.3f}{late:>20.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+'''JSON-RPC control server latency benchmark against a simulated controller. Reports the round trip of calls answered from cached
+state (status, position), of moves through the I/O worker, and the throughput of several clients polling status at once.
+
+    python benchmarks/bench_rpc.py [--calls 500] [--clients 4]
+'''
+import os
+import sys
+import time
+import argparse
+import threading
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ars_simulator import SimulatedController
+from ars_controller import AngleResolvedSpectrometer
+from ars_server import ControlServer, ControlClient
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples) * 1e3, samples[int(0.99 * (len(samples) - 1))] * 1e3
+
+
+def time_calls(client, method, n_calls, **params):
+    samples = []
+    for _ in range(n_calls):
+        start = time.perf_counter()
+        client.call(method, **params)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--moves', type=int, default=10)
+    args = parser.parse_args()
+
+    simulator = SimulatedController(speed=20000)
+    simulator.start()
+    spectrometer = AngleResolvedSpectrometer(serial_port=simulator.port, ready_ping_after=0, position_journal=False)
+    server = ControlServer(spectrometer, port=0).start()
+    host, port = server.address
+
+    print(f"{'call':<28}{'median (ms)':>12}{'p99 (ms)':>10}")
+    with ControlClient(host, port) as client:
+        client.call('home')
+        for method in ('status', 'position'):
+            median, p99 = percentiles(time_calls(client, method, args.calls))
+            print(f"{method:<28}{median:>12.3f}{p99:>10.3f}")
+        samples = []
+        for index in range(args.moves):
+            angle = 20 + (index % 2)
+            start = time.perf_counter()
+            client.call('move', x=angle, y=angle)
+            samples.append(time.perf_counter() - start)
+        median, p99 = percentiles(samples)
+        print(f"{'move (1 deg)':<28}{median:>12.3f}{p99:>10.3f}")
+
+    clients = [ControlClient(host, port) for _ in range(args.clients)]
+    threads = [threading.Thread(target=time_calls, args=(client, 'status', args.calls)) for client in clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(f"{args.clients} clients x {args.calls} status calls: {args.clients * args.calls / elapsed:.0f} calls/s")
+    for client in clients:
+        client.close()
+
+    server.stop()
+    simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
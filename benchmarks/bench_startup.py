@@ -0,0 +1,71 @@
+'''Startup time benchmark. Imports each module in a fresh interpreter and checks the median wall time against a budget, and that
+none of the heavy optional dependencies were loaded as a side effect. Exits with status 1 if any module is over budget.
+
+    python benchmarks/bench_startup.py [--repeats 5]
+'''
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+import statistics
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# seconds, measured from interpreter start to the end of the import
+BUDGETS = {
+    'ars_controller': 0.5,
+    'ars_analysis': 0.5,
+    'ars_scan': 0.5,
+    'ars_worker': 0.5,
+    'ars_estimator': 0.5,
+    'ars_cli': 0.5,
+    'ars_server': 0.5,
+}
+HEAVY_MODULES = ('matplotlib', 'pandas', 'tkinter', 'serial')
+
+PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def measure(module, repeats):
+    wall_times = []
+    import_times = []
+    heavy = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout
+        wall_times.append(time.perf_counter() - start)
+        result = json.loads(output.strip().splitlines()[-1])
+        import_times.append(result['elapsed'])
+        heavy = result['heavy']
+    return statistics.median(wall_times), statistics.median(import_times), heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    baseline, _, _ = measure('os', args.repeats)
+    print(f"interpreter start: {baseline:.3f} s")
+    print(f"{'module':<18}{'process (s)':>12}{'import (s)':>12}{'budget (s)':>12}  heavy imports")
+
+    failed = False
+    for module, budget in BUDGETS.items():
+        wall, import_time, heavy = measure(module, args.repeats)
+        over = wall > budget or heavy
+        failed = failed or over
+        print(f"{module:<18}{wall:>12.3f}{import_time:>12.3f}{budget:>12.3f}  {', '.join(heavy) or '-'}{'  FAIL' if over else ''}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+import numpy as np
+from ars_features import extract_features, lorentzian
+
+
+def dip_spectra():
+    '''Lorentzian dips moving with angle, with a jump half way (a different mode becoming the deepest), plus noise.'''
+    wavelength = np.linspace(400, 800, 801)
+    angles = np.arange(60, dtype=float)
+    centres = np.where(angles < 30, 500 + 2 * angles, 700 - angles)
+    widths = 10 + 0.2 * angles
+    rng = np.random.default_rng(0)
+    values = np.array([lorentzian(wavelength, 1.0, -0.6, centre, width) for centre, width in zip(centres, widths)])
+    return wavelength, values + rng.normal(0, 0.005, values.shape), angles, centres
+
+
+def test_results_do_not_depend_on_the_number_of_processes():
+    wavelength, values, angles, centres = dip_spectra()
+    serial = extract_features(wavelength, values, angles, processes=1)
+    parallel = extract_features(wavelength, values, angles, processes=3)
+    np.testing.assert_array_equal(serial, parallel)
+    assert serial['fit_ok'].all()
+    np.testing.assert_allclose(serial['fit_centre'], centres, atol=0.5)
@@ -0,0 +1,20 @@
+from ars_orchestrator import MultiRigController, simulated_rigs
+from ars_scan import specular_points, scan_job
+
+
+def test_jobs_on_several_rigs_finish_without_errors(tmp_path):
+    rigs, simulators = simulated_rigs(3, state_dir=str(tmp_path))
+    controller = MultiRigController(rigs).start()
+    try:
+        for index in range(6):
+            controller.submit(f"specular scan {index + 1}", scan_job, specular_points(15, 25, 5), dwell=0.05)
+        controller.wait()
+    finally:
+        controller.stop()
+        for simulator in simulators:
+            simulator.stop()
+    stats = controller.stats()
+    assert sum(rig['jobs'] for rig in stats.values()) == 6
+    assert sum(rig['errors'] for rig in stats.values()) == 0
+    assert {entry['status'] for entry in controller.results.results.values()} == {'finished'}
+    assert len({rig.position.journal_path for rig in rigs.values()}) == 3